@@ -0,0 +1,212 @@
+"""Compile a rule's conditions tree into the plan the rules engine runs.
+
+The rule API compiles every rule it saves and stores the result under the
+rule's 'plan' attribute, so the engine does not re-walk the untyped
+conditions dict on every evaluation: durations are already seconds, day
+tokens are day offsets, RATE> thresholds are already per-hour rates and
+values are plain numbers. The plan also records what the rule reads (its
+table, metrics, rollup days and widest look-back), which the engine uses
+to size the weather window it fetches.
+
+A plan evaluates exactly like the conditions it came from, quirks
+included. It is only trusted when its version is PLAN_VERSION and its
+fingerprint matches the rule's conditions; anything else, or a rule the
+compiler rejects, is evaluated from the raw conditions as before. Bump
+PLAN_VERSION whenever the node format or the look-back constants change.
+
+Each Lambda that needs it ships its own copy of this file.
+"""
+import re
+import json
+import hashlib
+from datetime import timedelta
+from decimal import Decimal
+
+PLAN_VERSION = 1
+
+# Look-back used for the "latest row" lookup and for SEQUENCE steps
+LATEST_LOOKBACK = timedelta(days=1)
+SEQUENCE_LOOKBACK = timedelta(days=1)
+# RATE> compares each source's two most recent readings within this look-back
+RATE_LOOKBACK = timedelta(days=1)
+
+# Operators a plain threshold leaf (latest value or temporal duration) accepts
+THRESHOLD_OPERATORS = ['>', '<', '=', '>=', '<=']
+
+_INTERVAL_UNITS = {
+    'sec': 1, 'second': 1,
+    'min': 60, 'minute': 60,
+    'hr': 3600, 'hour': 3600,
+    'day': 86400,
+    'week': 604800
+}
+_INTERVAL_PART = re.compile(r'\s*(\d+(?:\.\d+)?)\s*([a-z]+?)s?\s*(?=\d|$)')
+
+
+def parse_interval(text):
+    """Parse a Postgres-style interval such as '30 minutes' or '1 hour 30 minutes' into a timedelta."""
+    if not isinstance(text, str):
+        return None
+    text = text.strip().lower()
+    if not text:
+        return None
+    seconds = 0.0
+    pos = 0
+    while pos < len(text):
+        match = _INTERVAL_PART.match(text, pos)
+        if not match or match.group(2) not in _INTERVAL_UNITS:
+            return None
+        seconds += float(match.group(1)) * _INTERVAL_UNITS[match.group(2)]
+        pos = match.end()
+    return timedelta(seconds=seconds)
+
+
+def day_offset(day):
+    """Days after today for a 'today' / 'tomorrow' / 'day_N' token."""
+    return 0 if day == 'today' else 1 if day == 'tomorrow' else int(day.split('_')[1])
+
+
+def plain_numbers(value):
+    """Decimals and integral floats as int, other floats as float: the form a rule has after a DynamoDB round trip."""
+    if isinstance(value, Decimal):
+        return float(value) if value % 1 else int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {k: plain_numbers(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [plain_numbers(v) for v in value]
+    return value
+
+
+def fingerprint(data_type, conditions):
+    """Same hash as the engine's rule_fingerprint() for a rule loaded from DynamoDB."""
+    payload = json.dumps([data_type, plain_numbers(conditions)], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _number(value):
+    return float(value) if isinstance(value, (Decimal, str)) else value
+
+
+def _seconds(span):
+    seconds = span.total_seconds()
+    return int(seconds) if seconds.is_integer() else seconds
+
+
+class _Needs:
+    """What the planner's window must hold for a rule; mirrors planner._collect()."""
+
+    def __init__(self):
+        self.metrics = []
+        self.lookback = None
+        self.days = []
+
+    def metric(self, metric):
+        if metric is not None and metric not in self.metrics:
+            self.metrics.append(metric)
+
+    def look_back(self, span):
+        if self.lookback is None or span > self.lookback:
+            self.lookback = span
+
+    def day(self, metric, offset):
+        if [metric, offset] not in self.days:
+            self.days.append([metric, offset])
+
+
+def _leaf(condition, needs):
+    """Compile what evaluate_condition() does with one leaf."""
+    metric = condition.get('metric')
+    operator = condition.get('operator')
+    value = _number(condition.get('value'))
+    needs.metric(metric)
+
+    if operator == 'RATE>':
+        interval = condition['temporal']['interval']
+        needs.look_back(RATE_LOOKBACK)
+        hours = float(interval.split()[0]) / 60 if 'minute' in interval else float(interval.split()[0])
+        if hours <= 0:
+            raise ValueError(f"RATE> interval must be positive: {interval!r}")
+        return {'op': 'rate', 'metric': metric, 'value': value, 'expected_rate': value / hours}
+
+    if operator == 'DAY_DIFF>':
+        temporal = condition['temporal']
+        day1, day2 = day_offset(temporal['day1']), day_offset(temporal['day2'])
+        needs.day(metric, day1)
+        needs.day(metric, day2)
+        return {'op': 'day_diff', 'metric': metric, 'value': value, 'day1': day1, 'day2': day2}
+
+    if condition.get('temporal') and operator in THRESHOLD_OPERATORS:
+        duration = condition['temporal']['duration']
+        span = parse_interval(duration)
+        if span is not None:
+            needs.look_back(span)
+        return {'op': 'count', 'metric': metric, 'cmp': operator, 'value': value, 'duration': duration,
+                'seconds': _seconds(span) if span is not None else None}
+
+    needs.look_back(LATEST_LOOKBACK)
+    if operator in THRESHOLD_OPERATORS:
+        return {'op': 'latest', 'metric': metric, 'cmp': operator, 'value': value}
+    return {'op': 'false'}
+
+
+def _group(conditions, needs):
+    """Compile what evaluate_conditions() does with a list or group node."""
+    if isinstance(conditions, list):
+        return {'op': 'all', 'args': [_leaf(cond, needs) for cond in conditions]}
+    if not isinstance(conditions, dict):
+        raise ValueError(f"Conditions must be a list or dict, got {type(conditions).__name__}")
+
+    operator = conditions.get('operator')
+    sub_conditions = conditions.get('sub_conditions', [])
+    if operator in ('AND', 'OR'):
+        args = [_leaf(cond, needs) if 'metric' in cond else _group(cond, needs) for cond in sub_conditions]
+        return {'op': 'all' if operator == 'AND' else 'any', 'args': args}
+    if operator == 'NOT':
+        return {'op': 'not', 'arg': _group(sub_conditions[0], needs)}
+    if operator == 'SEQUENCE':
+        steps = []
+        max_interval = None
+        for i, cond in enumerate(sub_conditions):
+            needs.metric(cond.get('metric'))
+            if i > 0 and 'within' in sub_conditions[i - 1]:
+                max_interval = sub_conditions[i - 1]['within']
+            # The engine has always read 'within' as a number of minutes
+            steps.append({'metric': cond['metric'], 'cmp': cond['operator'], 'value': _number(cond['value']),
+                          'within_minutes': float(max_interval.split()[0]) if max_interval else None})
+        needs.look_back(SEQUENCE_LOOKBACK)
+        return {'op': 'seq', 'steps': steps}
+    return {'op': 'false'}
+
+
+def compile_rule(rule):
+    """The plan for a rule; ValueError if its conditions cannot be compiled (the engine then uses them as-is)."""
+    data_type = rule.get('data_type')
+    conditions = plain_numbers(rule.get('conditions', []))
+    needs = _Needs()
+    try:
+        root = _group(conditions, needs)
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Cannot compile conditions: {e!r}")
+    table = 'forecast_weather' if data_type == 'forecast' else 'current_weather'
+    return {
+        'version': PLAN_VERSION,
+        'fingerprint': fingerprint(data_type, conditions),
+        'table': table,
+        'tables': [table, 'weather_daily_rollups'] if needs.days else [table],
+        'metrics': needs.metrics,
+        'days': needs.days,
+        'lookback_seconds': _seconds(needs.lookback) if needs.lookback is not None else None,
+        'root': root
+    }
+
+
+def usable_plan(rule):
+    """The rule's stored plan if it is current and was compiled from these conditions, else None."""
+    plan = rule.get('plan')
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION:
+        return None
+    if plan.get('fingerprint') != fingerprint(rule.get('data_type'), rule.get('conditions', [])):
+        return None
+    return plan
@@ -0,0 +1,302 @@
+"""Key layout, bulk writes, paged reads and streaming export for the WeatherRules table.
+
+Rules are keyed on farm_id plus rule_key, "stakeholder#priority#rule_id"
+with the priority zero-padded, so a farm holds any number of rules per
+stakeholder and one Query with begins_with(rule_key, "stakeholder#")
+returns them already in priority order. DataTypeIndex is keyed on
+data_type plus type_key, "farm_id#" + rule_key, for listing the rules of
+one data type (all farms, one farm or one farm and stakeholder) without a
+filtered scan. with_keys() adds both attributes to a rule before it is
+written; since the priority is part of the key, replaced_keys() finds the
+old item of a rule whose priority changed so it can be deleted.
+
+batch_write() takes any iterable of validated rules and sends them with
+BatchWriteItem, 25 at a time, so a bulk import holds one batch in memory
+rather than the whole upload. UnprocessedItems and throttling errors are
+retried with capped exponential backoff and full jitter; whatever is still
+unwritten after max_attempts is returned rather than dropped. iter_rules()
+follows LastEvaluatedKey so no result set is cut off at DynamoDB's 1 MB
+page, and export_lines() turns it into newline-delimited JSON.
+
+Each Lambda that needs it ships its own copy of this file. From the
+command line it exports to, or imports from, an NDJSON file:
+
+    python rule_store.py export --farm-id udaipur_farm1 > rules.ndjson
+    python rule_store.py import rules.ndjson   # validated, compiled and keyed like a bulk POST
+"""
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import itertools
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+TABLE_NAME = 'WeatherRulesV2'
+# A put for a key already in the same BatchWriteItem request is rejected, so batches are deduplicated on it
+KEY_ATTRIBUTES = ('farm_id', 'rule_key')
+DATA_TYPE_INDEX = 'DataTypeIndex'
+# Joins the parts of rule_key and type_key; farm_id and stakeholder may not contain it
+KEY_SEPARATOR = '#'
+# Digits priorities are padded to so that string order is priority order
+PRIORITY_WIDTH = 2
+# BatchWriteItem limit
+BATCH_SIZE = 25
+# Rules per batch_write() call in an import
+IMPORT_CHUNK = 1000
+RETRYABLE_ERRORS = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+                    'InternalServerError'}
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return float(obj) if obj % 1 else int(obj)
+        return super(DecimalEncoder, self).default(obj)
+
+
+def to_item(value):
+    """A parsed JSON rule with floats replaced by Decimal, which is what boto3 accepts for numbers."""
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: to_item(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_item(v) for v in value]
+    return value
+
+
+def item_key(item):
+    return {name: item[name] for name in KEY_ATTRIBUTES}
+
+
+def rule_key(stakeholder, priority, rule_id):
+    """Sort key ordering a farm's rules by stakeholder, then priority, then rule_id."""
+    return KEY_SEPARATOR.join([stakeholder, f"{int(priority):0{PRIORITY_WIDTH}d}", str(rule_id)])
+
+
+def with_keys(rule):
+    """The rule with the rule_key and type_key attributes the table and DataTypeIndex are keyed on."""
+    key = rule_key(rule['stakeholder'], rule['priority'], rule['rule_id'])
+    return {**rule, 'rule_key': key, 'type_key': rule['farm_id'] + KEY_SEPARATOR + key}
+
+
+def backoff(attempt, base=0.05, cap=2.0):
+    """Full-jitter delay before retry number attempt (1-based)."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _request_key(request):
+    if 'PutRequest' in request:
+        return item_key(request['PutRequest']['Item'])
+    return request['DeleteRequest']['Key']
+
+
+def _write_batch(dynamodb, table_name, requests, stats, max_attempts, sleep, counter='written'):
+    attempt = 0
+    while requests:
+        attempt += 1
+        stats['requests'] += 1
+        try:
+            response = dynamodb.batch_write_item(RequestItems={table_name: requests})
+            unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+        except ClientError as e:
+            if e.response['Error']['Code'] not in RETRYABLE_ERRORS:
+                raise
+            stats['throttled'] += 1
+            unprocessed = requests
+        stats[counter] += len(requests) - len(unprocessed)
+        requests = unprocessed
+        if requests and attempt >= max_attempts:
+            stats['unprocessed'].extend(_request_key(request) for request in requests)
+            return
+        if requests:
+            stats['retries'] += 1
+            sleep(backoff(attempt))
+
+
+def batch_write(dynamodb, items, table_name=TABLE_NAME, max_attempts=8, sleep=time.sleep, deletes=()):
+    """Put every item, then delete every key in deletes, with BatchWriteItem.
+
+    Returns written/deleted/requests/retries/throttled counts and the keys
+    left unprocessed. dynamodb is a boto3 DynamoDB resource, so items use
+    the same Python types as table.put_item. When the same key appears more
+    than once the last item wins, as it would with sequential puts. Deletes
+    go last so a rule moving to a new key is never missing in between.
+    """
+    stats = {'written': 0, 'deleted': 0, 'requests': 0, 'retries': 0, 'throttled': 0, 'duplicates': 0,
+             'unprocessed': []}
+    batch = {}
+    for item in items:
+        key = tuple(item[name] for name in KEY_ATTRIBUTES)
+        if key in batch:
+            stats['duplicates'] += 1
+        batch[key] = item
+        if len(batch) == BATCH_SIZE:
+            _write_batch(dynamodb, table_name, [{'PutRequest': {'Item': i}} for i in batch.values()], stats,
+                         max_attempts, sleep)
+            batch = {}
+    if batch:
+        _write_batch(dynamodb, table_name, [{'PutRequest': {'Item': i}} for i in batch.values()], stats,
+                     max_attempts, sleep)
+    keys = list({tuple(key[name] for name in KEY_ATTRIBUTES): key for key in deletes}.values())
+    for start in range(0, len(keys), BATCH_SIZE):
+        _write_batch(dynamodb, table_name, [{'DeleteRequest': {'Key': key}} for key in keys[start:start + BATCH_SIZE]],
+                     stats, max_attempts, sleep, counter='deleted')
+    return stats
+
+
+def projection(fields):
+    """ProjectionExpression kwargs for a list of attribute names, via placeholders so reserved words are safe."""
+    if not fields:
+        return {}
+    names = {f"#p{i}": name for i, name in enumerate(dict.fromkeys(fields))}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, cls=DecimalEncoder).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """The LastEvaluatedKey behind a cursor from encode_cursor(); ValueError if it is not one."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()), parse_float=Decimal)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(key, dict):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def query_args(farm_id=None, stakeholder=None, fields=None, data_type=None):
+    """query() kwargs for a farm (and stakeholder), DataTypeIndex kwargs with a data_type, else scan() kwargs.
+
+    Queries return rules in stakeholder, priority, rule_id order; with a
+    data_type, farms come first.
+    """
+    if data_type is not None:
+        kwargs = {'IndexName': DATA_TYPE_INDEX, 'KeyConditionExpression': 'data_type = :dt',
+                  'ExpressionAttributeValues': {':dt': data_type}}
+        if farm_id is not None:
+            prefix = farm_id + KEY_SEPARATOR + (stakeholder + KEY_SEPARATOR if stakeholder is not None else '')
+            kwargs['KeyConditionExpression'] += ' AND begins_with(type_key, :prefix)'
+            kwargs['ExpressionAttributeValues'][':prefix'] = prefix
+    elif stakeholder is not None:
+        kwargs = {'KeyConditionExpression': 'farm_id = :fid AND begins_with(rule_key, :prefix)',
+                  'ExpressionAttributeValues': {':fid': farm_id, ':prefix': stakeholder + KEY_SEPARATOR}}
+    elif farm_id is not None:
+        kwargs = {'KeyConditionExpression': 'farm_id = :fid', 'ExpressionAttributeValues': {':fid': farm_id}}
+    else:
+        kwargs = {}
+    kwargs.update(projection(fields))
+    return kwargs
+
+
+def query_page(table, farm_id, stakeholder=None, limit=100, cursor=None, fields=None, data_type=None):
+    """One page of at most limit rules and the cursor for the next page (None on the last one)."""
+    kwargs = query_args(farm_id, stakeholder, fields, data_type)
+    kwargs['Limit'] = limit
+    if cursor:
+        kwargs['ExclusiveStartKey'] = decode_cursor(cursor)
+    response = table.query(**kwargs)
+    last_key = response.get('LastEvaluatedKey')
+    return response['Items'], encode_cursor(last_key) if last_key else None
+
+
+def iter_rules(table, farm_id=None, stakeholder=None, fields=None, page_size=None, data_type=None):
+    """Every matching rule, following LastEvaluatedKey; a scan of the whole table without farm_id or data_type."""
+    kwargs = query_args(farm_id, stakeholder, fields, data_type)
+    if page_size:
+        kwargs['Limit'] = page_size
+    read = table.query if farm_id is not None or data_type is not None else table.scan
+    while True:
+        response = read(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def export_lines(table, farm_id=None, stakeholder=None, fields=None, data_type=None):
+    """iter_rules() as NDJSON lines, one rule per line."""
+    for item in iter_rules(table, farm_id, stakeholder, fields, data_type=data_type):
+        yield json.dumps(item, cls=DecimalEncoder) + '\n'
+
+
+def replaced_keys(table, items):
+    """Keys of stored rules that items supersede under another rule_key: same farm, stakeholder and rule_id."""
+    wanted = {}
+    for item in items:
+        wanted.setdefault(item['farm_id'], {})[(item['stakeholder'], item['rule_id'])] = item['rule_key']
+    keys = []
+    for farm_id, rules in wanted.items():
+        # One query per farm; narrowed to the stakeholder when only one is being written
+        stakeholders = {stakeholder for stakeholder, _ in rules}
+        stakeholder = next(iter(stakeholders)) if len(stakeholders) == 1 else None
+        for stored in iter_rules(table, farm_id, stakeholder, ['farm_id', 'rule_key', 'rule_id']):
+            new_key = rules.get((stored['rule_key'].split(KEY_SEPARATOR, 1)[0], stored.get('rule_id')))
+            if new_key is not None and stored['rule_key'] != new_key:
+                keys.append(item_key(stored))
+    return keys
+
+
+def main():
+    import boto3
+    parser = argparse.ArgumentParser(description='Export or import WeatherRules as newline-delimited JSON.')
+    parser.add_argument('--table', default=TABLE_NAME)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='write rules to stdout or --out')
+    export.add_argument('--farm-id')
+    export.add_argument('--stakeholder')
+    export.add_argument('--data-type', choices=['forecast', 'current'])
+    export.add_argument('--out')
+    load = commands.add_parser('import', help='validate and batch-write the rules in an NDJSON file')
+    load.add_argument('file')
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb')
+    if args.command == 'export':
+        out = open(args.out, 'w') if args.out else sys.stdout
+        try:
+            out.writelines(export_lines(dynamodb.Table(args.table), args.farm_id, args.stakeholder,
+                                        data_type=args.data_type))
+        finally:
+            if args.out:
+                out.close()
+        return
+
+    from lambda_function import validate_rule, with_plan
+
+    def rules(lines):
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            rule = json.loads(line)
+            valid, error = validate_rule(rule)
+            if not valid:
+                raise SystemExit(f"{args.file}:{number}: invalid rule: {error}")
+            yield with_plan(rule)
+
+    table = dynamodb.Table(args.table)
+    stats = {}
+    with open(args.file) as lines:
+        items = rules(lines)
+        # A chunk at a time, so the old keys of re-prioritised rules can be looked up and deleted
+        while True:
+            chunk = list(itertools.islice(items, IMPORT_CHUNK))
+            if not chunk:
+                break
+            chunk_stats = batch_write(dynamodb, chunk, args.table, deletes=replaced_keys(table, chunk))
+            for name, value in chunk_stats.items():
+                stats[name] = stats.get(name, type(value)()) + value
+    for name, value in stats.items():
+        print(f"{name}: {value}")
+    if stats.get('unprocessed'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
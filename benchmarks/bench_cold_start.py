@@ -0,0 +1,131 @@
+"""Import time and init memory of each Lambda handler, as a cold start pays them.
+
+    python benchmarks/bench_cold_start.py --runs 10 --json startup.json
+    python benchmarks/bench_cold_start.py --compare startup.json --budget-ms 400
+
+Imports each handler's lambda_function in --runs fresh interpreters and
+reports the median import time and how far ru_maxrss grew over a bare
+interpreter's, then runs it once more under python -X importtime and lists
+the handler's slowest direct imports (cumulative time, children included).
+--first-use also times building the clients the handlers defer to their
+first invocation. --json writes the results, --compare prints the change
+against an earlier file, and --budget-ms exits non-zero when any handler's
+median import time is over budget, so a regression can fail a build.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import INGESTION_SRC, RULE_API_SRC, RULER_SRC
+
+HANDLERS = {'rules_engine': RULER_SRC, 'ingestion': INGESTION_SRC, 'rule_api': RULE_API_SRC}
+
+CHILD = """
+import json, resource, sys, time
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+sys.path.insert(0, {src!r})
+started = time.perf_counter()
+import lambda_function
+import_ms = (time.perf_counter() - started) * 1000
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+first_use_ms = None
+if {first_use!r}:
+    started = time.perf_counter()
+    for name in ('rules_table', 'sns', 'table'):
+        client = getattr(lambda_function, name, None)
+        if client is not None:
+            getattr(client, 'meta', None)
+    if hasattr(lambda_function, 'get_session'):
+        lambda_function.get_session()
+    first_use_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({{'import_ms': import_ms, 'init_rss_mb': (after - before) / 1024, 'first_use_ms': first_use_ms}}))
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+    # Telemetry and caches stay quiet and local
+    env.setdefault('EMF_METRICS', 'false')
+    env.setdefault('CACHE_DIR', '/tmp/bench-cold-start-cache')
+    return env
+
+
+def measure(src, first_use):
+    output = subprocess.run([sys.executable, '-c', CHILD.format(src=src, first_use=first_use)], env=child_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_profile(src, top):
+    """(module, cumulative ms) for the slowest direct imports of lambda_function under -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {src!r}); "
+                             "import lambda_function"], env=child_env(), capture_output=True, text=True, check=True)
+    lines = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        lines.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative) / 1000))
+    # importtime prints a module after everything it imported; lambda_function's children sit one level deeper
+    end = next(i for i in range(len(lines) - 1, -1, -1) if lines[i][1] == 'lambda_function')
+    depth = lines[end][0]
+    start = next((i + 1 for i in range(end - 1, -1, -1) if lines[i][0] <= depth), 0)
+    children = [(name, ms) for indent, name, ms in lines[start:end] if indent == depth + 2]
+    return sorted(children, key=lambda child: -child[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handler', choices=sorted(HANDLERS), action='append',
+                        help='only measure this handler (repeatable; default: all)')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=8, help='slowest direct imports listed per handler')
+    parser.add_argument('--first-use', action='store_true', help='also time building the deferred clients')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='earlier --json output to compare against')
+    parser.add_argument('--budget-ms', type=float, help='fail if a median import time exceeds this')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.handler or sorted(HANDLERS):
+        samples = [measure(HANDLERS[name], args.first_use) for _ in range(args.runs)]
+        results[name] = {
+            'import_ms': statistics.median(s['import_ms'] for s in samples),
+            'init_rss_mb': statistics.median(s['init_rss_mb'] for s in samples),
+            'first_use_ms': statistics.median(s['first_use_ms'] for s in samples) if args.first_use else None,
+            'slowest_imports': import_profile(HANDLERS[name], args.top)
+        }
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print(f"{'handler':>14} {'import_ms':>10} {'init_rss_mb':>12} {'first_use_ms':>13}")
+    for name, result in results.items():
+        first_use = f"{result['first_use_ms']:>13.1f}" if result['first_use_ms'] is not None else f"{'-':>13}"
+        line = f"{name:>14} {result['import_ms']:>10.1f} {result['init_rss_mb']:>12.1f} {first_use}"
+        if name in previous:
+            before = previous[name]
+            line += (f"   (was {before['import_ms']:.1f} ms, {before['init_rss_mb']:.1f} MB: "
+                     f"{result['import_ms'] - before['import_ms']:+.1f} ms, "
+                     f"{result['init_rss_mb'] - before['init_rss_mb']:+.1f} MB)")
+        print(line)
+    for name, result in results.items():
+        print(f"\n{name}: slowest imports (cumulative ms)")
+        for module, ms in result['slowest_imports']:
+            print(f"  {module:<40} {ms:>8.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    over = [name for name, result in results.items() if args.budget_ms and result['import_ms'] > args.budget_ms]
+    if over:
+        raise SystemExit(f"Import time over the {args.budget_ms:.0f} ms budget: {', '.join(over)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Inline per-action SNS publishes vs batched and digest dispatch, against a local SNS stand-in.
+
+    python benchmarks/bench_dispatch.py --farms 50 --alerts 4 --latency 0.05
+
+Simulates a storm run in which every farm triggers --alerts email rules.
+'inline' is the old loop: one synchronous Publish per action. 'batch'
+sends the same messages with PublishBatch from the dispatcher's worker
+pool, and 'digest' merges each farm's alerts into one message first.
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+
+from common import RULER_SRC
+from stub_sns import StubSNS
+
+sys.path.insert(0, RULER_SRC)
+from dispatch import NotificationDispatcher  # noqa: E402
+
+TOPIC_ARN = 'arn:aws:sns:ap-south-1:000000000000:weather-alerts'
+
+
+def triggered(farms, alerts):
+    return [
+        (f"bench_farm{f}", 'field', {'rule_id': f"r{a}", 'name': f"rule {a}"},
+         {'type': 'email', 'message': f"Alert {a} for bench_farm{f}"})
+        for f in range(1, farms + 1) for a in range(alerts)
+    ]
+
+
+def run_inline(client, items):
+    for farm_id, _, rule, action in items:
+        client.publish(TopicArn=TOPIC_ARN, Message=action['message'],
+                       Subject=f"Weather Alert: Rule {rule['name']} Triggered for {farm_id}")
+
+
+def run_dispatcher(client, items, digest, workers):
+    dispatcher = NotificationDispatcher(client, TOPIC_ARN, digest=digest, workers=workers)
+    for farm_id, stakeholder, rule, action in items:
+        dispatcher.collect(farm_id, stakeholder, rule, action)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dispatcher.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=50)
+    parser.add_argument('--alerts', type=int, default=4, help='triggered email rules per farm')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per SNS call')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    stub = StubSNS(latency=args.latency)
+    client = stub.client()
+    items = triggered(args.farms, args.alerts)
+
+    print(f"{'mode':>7} {'actions':>8} {'sns_calls':>10} {'messages':>9} {'wall_s':>8} {'actions/s':>10}")
+    modes = [
+        ('inline', lambda: run_inline(client, items)),
+        ('batch', lambda: run_dispatcher(client, items, False, args.workers)),
+        ('digest', lambda: run_dispatcher(client, items, True, args.workers)),
+    ]
+    for name, run in modes:
+        stub.reset()
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        calls = sum(stub.calls.values())
+        print(f"{name:>7} {len(items):>8} {calls:>10} {stub.messages:>9} {elapsed:>8.2f} {len(items) / elapsed:>10.0f}")
+    stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Serial vs concurrent provider fetching against local stub servers.
+
+    python benchmarks/bench_fetch.py --farms 3 --farms 10
+
+Each provider stub sleeps for a fixed latency per request. Serial wall time
+is the sum of every call; concurrent wall time should track the slowest
+provider (times the rounds forced by its concurrency cap). Farms sit
+--spacing degrees apart; below a provider's grid resolution (e.g.
+--spacing 0.02) nearby farms share one request per cell, and the requests
+column shows the calls actually made.
+"""
+import argparse
+import math
+import os
+import time
+
+from stub_providers import DEFAULT_LATENCY, start_stub_providers
+from common import INGESTION_SRC, load_lambda, make_locations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, action='append', help='number of locations (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--spacing', type=float, default=0.25, help='degrees between neighbouring farms')
+    args = parser.parse_args()
+
+    servers = start_stub_providers()
+    # Measure the fetch pipeline itself, not the response cache
+    os.environ['RESPONSE_CACHE'] = 'false'
+    ingestion = load_lambda(INGESTION_SRC, 'ingestion_lambda')
+    # openweather makes two requests (current + forecast) per location
+    calls = {source: (2 if source == 'openweather' else 1) * DEFAULT_LATENCY[source] for source in DEFAULT_LATENCY}
+
+    print(f"{'farms':>5} {'mode':>10} {'requests':>9} {'saved':>6} {'wall_s':>8} {'sum_calls_s':>11} {'slowest_bound_s':>15}")
+    for farms in args.farms or [1, 3, 10]:
+        locations = make_locations(farms, spacing=args.spacing)
+        plan = ingestion.plan_fetches(locations)
+        cells = {source: sum(1 for _, s, _ in plan if s == source) for source in calls}
+        bound = max(calls[source] * math.ceil(cells[source] / ingestion.PROVIDER_CONCURRENCY[source]) for source in calls)
+        for mode in ('serial', 'concurrent'):
+            best = None
+            for _ in range(args.repeat):
+                before = sum(server.requests for server in servers.values())
+                started = time.perf_counter()
+                results = ingestion.fetch_all(locations, mode=mode)
+                elapsed = time.perf_counter() - started
+                requests = sum(server.requests for server in servers.values()) - before
+                failed = [r for r in results if r[3] is not None]
+                if failed:
+                    raise SystemExit(f"fetch failed: {failed[0][3]}")
+                best = elapsed if best is None else min(best, elapsed)
+            saved = len(results) - len(plan)
+            print(f"{farms:>5} {mode:>10} {requests:>9} {saved:>6} {best:>8.2f} "
+                  f"{sum(calls[source] * cells[source] for source in calls):>11.2f} {bound:>15.2f}")
+
+    for server in servers.values():
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Peak RSS of one ingestion run with parsed row lists vs streamed parsing.
+
+    BENCH_DSN="host=localhost dbname=weather user=postgres" python benchmarks/bench_ingest_memory.py --farms 100 --farms 400
+
+Each configuration runs lambda_handler once in a fresh subprocess against
+zero-latency stub providers and a scratch schema, and reports how far
+ru_maxrss grew over the process's footprint after import. 'lists' is
+STREAM_PARSE=false (every payload parsed into row lists before the write);
+'stream' keeps raw bodies and parses rows as the writer pulls them, with
+ijson when it is installed.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from stub_providers import start_stub_providers
+from common import INGESTION_SRC, load_lambda, make_locations
+from pg import SCHEMA_FILE, ScratchSchema
+
+CONFIGS = {'lists': 'false', 'stream': 'true'}
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(args):
+    servers = start_stub_providers(latency={provider: 0 for provider in ('openweather', 'weatherapi', 'yrno', 'openmeteo')})
+    os.environ.update({'STREAM_PARSE': CONFIGS[args.child], 'RESPONSE_CACHE': 'false'})
+    ingestion = load_lambda(INGESTION_SRC, 'ingestion_lambda')
+    import streaming
+    # Spread farms wider than any provider grid so every farm is its own fetch
+    ingestion.LOCATIONS = make_locations(args.farms, spacing=0.25)
+
+    with ScratchSchema(args.dsn, args.schema_file) as scratch:
+        ingestion.db = ingestion.ConnectionManager(statement_timeout_ms=ingestion.DB_STATEMENT_TIMEOUT_MS,
+                                                   dsn=scratch.dsn, options=f"-c search_path={scratch.name},public",
+                                                   cursor_factory=ingestion.RealDictCursor)
+        baseline = rss_mb()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = ingestion.lambda_handler({}, None)
+        elapsed = time.perf_counter() - started
+        ingestion.db.discard()
+    stats = json.loads(response['body'])['stats']
+    for server in servers.values():
+        server.stop()
+    print(json.dumps({'rows': stats['rows_written'], 'baseline_mb': baseline, 'peak_mb': rss_mb(),
+                      'seconds': elapsed, 'ijson': streaming.ijson is not None}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, action='append', help='number of farms (repeatable)')
+    parser.add_argument('--dsn', default=None)
+    parser.add_argument('--schema-file', default=SCHEMA_FILE)
+    parser.add_argument('--child', choices=sorted(CONFIGS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        args.farms = args.farms[0]
+        return child(args)
+
+    print(f"{'farms':>5} {'config':>12} {'rows':>7} {'rss_growth_mb':>13} {'peak_rss_mb':>11} {'seconds':>8}")
+    for farms in args.farms or [100, 400]:
+        growth = {}
+        for config in CONFIGS:
+            command = [sys.executable, os.path.abspath(__file__), '--child', config, '--farms', str(farms),
+                       '--schema-file', args.schema_file] + (['--dsn', args.dsn] if args.dsn else [])
+            result = json.loads(subprocess.run(command, check=True, capture_output=True, text=True).stdout.splitlines()[-1])
+            growth[config] = result['peak_mb'] - result['baseline_mb']
+            label = f"{config}+ijson" if config == 'stream' and result['ijson'] else config
+            print(f"{farms:>5} {label:>12} {result['rows']:>7} {growth[config]:>13.1f} "
+                  f"{result['peak_mb']:>11.1f} {result['seconds']:>8.2f}")
+        if growth['lists'] > 0:
+            print(f"{farms:>5} streaming cut peak RSS growth by {1 - growth['stream'] / growth['lists']:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Rules-engine query latency on the old heap layout vs the monthly-partitioned layout.
+
+    BENCH_DSN="host=localhost dbname=weather user=postgres" python benchmarks/bench_partitions.py --farms 200 --days 90
+
+Loads farms x 4 sources x hourly rows over --days into the pre-partitioning
+tables (separate farm_id and time B-trees), times the queries the rules
+engine sends and captures their EXPLAIN (ANALYZE, BUFFERS) plans, then runs
+migrations/001_partition_weather_tables.sql on the same data and repeats.
+The defaults load about 1.7M rows per table.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+from common import REPO_ROOT
+from pg import ScratchSchema
+
+MIGRATION_FILE = os.path.join(REPO_ROOT, 'migrations', '001_partition_weather_tables.sql')
+
+# Weather tables as they were before migration 001
+LEGACY_SCHEMA = """
+CREATE TABLE current_weather (
+    id SERIAL PRIMARY KEY,
+    source TEXT NOT NULL,
+    farm_id TEXT NOT NULL,
+    location GEOGRAPHY(Point, 4326) NOT NULL,
+    timestamp TIMESTAMPTZ NOT NULL,
+    temperature_c REAL,
+    humidity_percent REAL,
+    wind_speed_mps REAL,
+    wind_direction_deg REAL,
+    rainfall_mm REAL,
+    solar_radiation_wm2 REAL
+);
+CREATE TABLE forecast_weather (
+    id SERIAL PRIMARY KEY,
+    source TEXT NOT NULL,
+    farm_id TEXT NOT NULL,
+    forecast_for TIMESTAMPTZ NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL,
+    location GEOGRAPHY(Point, 4326) NOT NULL,
+    temperature_c REAL,
+    humidity_percent REAL,
+    wind_speed_mps REAL,
+    wind_direction_deg REAL,
+    rainfall_mm REAL,
+    chance_of_rain_percent REAL
+);
+CREATE INDEX idx_current_weather_farm ON current_weather (farm_id);
+CREATE INDEX idx_current_weather_time ON current_weather (timestamp);
+CREATE INDEX idx_current_weather_location ON current_weather USING GIST (location);
+CREATE INDEX idx_current_source_time ON current_weather (source, timestamp);
+CREATE INDEX idx_forecast_weather_farm ON forecast_weather (farm_id);
+CREATE INDEX idx_forecast_weather_time ON forecast_weather (forecast_for);
+CREATE INDEX idx_forecast_weather_location ON forecast_weather USING GIST (location);
+CREATE INDEX idx_forecast_source_time ON forecast_weather (source, fetched_at);
+ALTER TABLE current_weather ADD CONSTRAINT current_weather_unique UNIQUE (farm_id, source, timestamp);
+ALTER TABLE forecast_weather ADD CONSTRAINT forecast_weather_unique UNIQUE (farm_id, source, forecast_for);
+"""
+
+SOURCES = ['openweather', 'weatherapi', 'yrno', 'openmeteo']
+
+LOAD_SQL = """
+INSERT INTO current_weather (source, farm_id, location, timestamp, temperature_c, humidity_percent,
+                             wind_speed_mps, wind_direction_deg, rainfall_mm, solar_radiation_wm2)
+SELECT s.source, 'farm' || f, ST_SetSRID(ST_MakePoint(75 + f * 0.01, 15 + f * 0.01), 4326), ts,
+       20 + random() * 20, 30 + random() * 60, random() * 10, random() * 360, random() * 5, NULL
+FROM generate_series(1, %(farms)s) f,
+     unnest(%(sources)s::text[]) AS s(source),
+     generate_series(date_trunc('hour', NOW()) - %(days)s * INTERVAL '1 day', date_trunc('hour', NOW()), INTERVAL '1 hour') ts;
+
+INSERT INTO forecast_weather (source, farm_id, location, forecast_for, fetched_at, temperature_c, humidity_percent,
+                              wind_speed_mps, wind_direction_deg, rainfall_mm, chance_of_rain_percent)
+SELECT s.source, 'farm' || f, ST_SetSRID(ST_MakePoint(75 + f * 0.01, 15 + f * 0.01), 4326), ts, ts - INTERVAL '1 day',
+       20 + random() * 20, 30 + random() * 60, random() * 10, random() * 360, random() * 5, random() * 100
+FROM generate_series(1, %(farms)s) f,
+     unnest(%(sources)s::text[]) AS s(source),
+     generate_series(date_trunc('hour', NOW()) - %(days)s * INTERVAL '1 day', date_trunc('hour', NOW()) + INTERVAL '5 days', INTERVAL '1 hour') ts;
+
+ANALYZE current_weather;
+ANALYZE forecast_weather;
+"""
+
+# The statements the rules engine sends, in the shape it sends them
+QUERIES = [
+    ('window forecast (planner, 25 farms)', """
+        SELECT farm_id, source, forecast_for, temperature_c, rainfall_mm FROM forecast_weather
+        WHERE farm_id = ANY(%(farm_ids)s) AND forecast_for >= NOW() - INTERVAL '1 day'
+        ORDER BY farm_id, forecast_for ASC, source ASC
+    """),
+    ('buffer top-up forecast (reading_buffers, 25 farms)', """
+        SELECT w.farm_id, w.source, w.forecast_for, w.fetched_at AS ingested_at, w.temperature_c, w.rainfall_mm
+        FROM forecast_weather w
+        JOIN unnest(%(farm_ids)s::text[]) AS mark(farm_id) ON w.farm_id = mark.farm_id
+        WHERE w.forecast_for >= NOW() - INTERVAL '1 day' AND w.fetched_at >= NOW() - INTERVAL '1 hour'
+        ORDER BY w.forecast_for
+    """),
+    ('window current (planner, 25 farms)', """
+        SELECT farm_id, source, timestamp, temperature_c, rainfall_mm FROM current_weather
+        WHERE farm_id = ANY(%(farm_ids)s) AND timestamp >= NOW() - INTERVAL '1 day'
+        ORDER BY farm_id, timestamp ASC, source ASC
+    """),
+    ('latest current (fetch_latest)', """
+        SELECT temperature_c, humidity_percent, wind_speed_mps, wind_direction_deg, rainfall_mm, solar_radiation_wm2
+        FROM current_weather
+        WHERE timestamp > NOW() - INTERVAL '1 day' AND farm_id = %(farm_id)s
+        ORDER BY timestamp DESC, source DESC LIMIT 1
+    """),
+    ('rate forecast (fetch_rate_pairs)', """
+        SELECT source, temperature_c, forecast_for FROM (
+            SELECT source, temperature_c, forecast_for,
+                   ROW_NUMBER() OVER (PARTITION BY source ORDER BY forecast_for DESC) AS n
+            FROM forecast_weather
+            WHERE farm_id = %(farm_id)s AND temperature_c IS NOT NULL
+            AND forecast_for <= NOW() AND forecast_for > NOW() - INTERVAL '1 day'
+        ) recent
+        WHERE n <= 2
+        ORDER BY source, forecast_for DESC
+    """),
+    ('temporal count (count_matching)', """
+        SELECT COUNT(*) FROM current_weather
+        WHERE temperature_c > 30 AND timestamp > NOW() - INTERVAL '6 hours' AND farm_id = %(farm_id)s
+    """),
+    ('day average (fetch_day_average)', """
+        SELECT AVG(temperature_c) AS avg_value FROM forecast_weather
+        WHERE farm_id = %(farm_id)s
+        AND forecast_for BETWEEN date_trunc('day', NOW()) + INTERVAL '1 day' AND date_trunc('day', NOW()) + INTERVAL '2 days'
+    """),
+    ('7-day range scan, all farms', """
+        SELECT date_trunc('day', timestamp) AS day, AVG(temperature_c) FROM current_weather
+        WHERE timestamp >= NOW() - INTERVAL '7 days'
+        GROUP BY 1
+    """),
+]
+
+
+def params(farms, rng):
+    farm_ids = [f"farm{i}" for i in rng.sample(range(1, farms + 1), min(25, farms))]
+    return {'farm_ids': farm_ids, 'farm_id': farm_ids[0]}
+
+
+def measure(conn, farms, repeats, seed):
+    rng = random.Random(seed)
+    results = {}
+    with conn.cursor() as cursor:
+        for name, sql in QUERIES:
+            timings = []
+            for _ in range(repeats):
+                args = params(farms, rng)
+                started = time.perf_counter()
+                cursor.execute(sql, args)
+                cursor.fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params(farms, rng))
+            plan = [list(row.values())[0] for row in cursor.fetchall()]
+            timings.sort()
+            results[name] = {
+                'p50': statistics.median(timings),
+                'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+                'plan': plan
+            }
+    conn.rollback()
+    return results
+
+
+def plan_summary(plan):
+    """First plan node plus the shared-buffer counts it reports."""
+    top = plan[0].split('  (')[0].strip()
+    buffers = next((line.strip() for line in plan if line.strip().startswith('Buffers:')), '')
+    return f"{top} {buffers}".strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=200)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--dsn', default=None)
+    parser.add_argument('--migration', default=MIGRATION_FILE)
+    parser.add_argument('--explain', action='store_true', help='print the full EXPLAIN ANALYZE output')
+    args = parser.parse_args()
+
+    with ScratchSchema(args.dsn, schema_sql=LEGACY_SCHEMA) as scratch:
+        conn = scratch.connect()
+        started = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute(LOAD_SQL, {'farms': args.farms, 'days': args.days, 'sources': SOURCES})
+            cursor.execute("SELECT (SELECT COUNT(*) FROM current_weather) AS current, "
+                           "(SELECT COUNT(*) FROM forecast_weather) AS forecast")
+            counts = cursor.fetchone()
+        conn.commit()
+        print(f"Loaded {counts['current']} current + {counts['forecast']} forecast rows "
+              f"in {time.perf_counter() - started:.1f}s")
+        legacy = measure(conn, args.farms, args.repeats, seed=1)
+        conn.close()
+
+        started = time.perf_counter()
+        scratch.execute_file(args.migration)
+        print(f"Migration 001 took {time.perf_counter() - started:.1f}s")
+        conn = scratch.connect()
+        partitioned = measure(conn, args.farms, args.repeats, seed=1)
+        conn.close()
+
+    print(f"\n{'query':<38} {'heap p50':>9} {'p95':>8} {'part p50':>9} {'p95':>8} {'speedup':>8}")
+    for name, _ in QUERIES:
+        old, new = legacy[name], partitioned[name]
+        print(f"{name:<38} {old['p50']:>8.2f}ms {old['p95']:>6.2f}ms {new['p50']:>8.2f}ms {new['p95']:>6.2f}ms "
+              f"{old['p50'] / new['p50']:>7.1f}x")
+    for name, _ in QUERIES:
+        print(f"\n{name}\n  heap:        {plan_summary(legacy[name]['plan'])}\n"
+              f"  partitioned: {plan_summary(partitioned[name]['plan'])}")
+        if args.explain:
+            for label, result in (('heap', legacy[name]), ('partitioned', partitioned[name])):
+                print(f"  --- {label} ---")
+                print('\n'.join('    ' + line for line in result['plan']))
+
+
+if __name__ == '__main__':
+    main()
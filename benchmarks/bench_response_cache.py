@@ -0,0 +1,74 @@
+"""Ingestion runs with and without the provider response cache, against stub providers.
+
+    BENCH_DSN="host=localhost dbname=weather user=postgres" python benchmarks/bench_response_cache.py --farms 10
+
+Runs lambda_handler --runs times into a scratch schema. Stub payloads only
+change on the hour, so after the first run the cached configuration should
+serve OpenWeather from its TTL, revalidate yr.no with 304s and skip the
+upserts for every payload that matches what was last written. --update
+bumps one provider's payloads before the last run to show a partial change.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from stub_providers import start_stub_providers
+from common import INGESTION_SRC, load_lambda, make_locations
+from pg import SCHEMA_FILE, ScratchSchema
+
+
+def run_config(name, enabled, args, servers, locations):
+    cache_dir = tempfile.mkdtemp(prefix='bench-cache-')
+    os.environ.update({'RESPONSE_CACHE': 'true' if enabled else 'false', 'CACHE_DIR': cache_dir})
+    ingestion = load_lambda(INGESTION_SRC, f"ingestion_{name}")
+    ingestion.LOCATIONS = locations
+
+    with ScratchSchema(args.dsn, args.schema_file) as scratch:
+        ingestion.db = ingestion.ConnectionManager(statement_timeout_ms=ingestion.DB_STATEMENT_TIMEOUT_MS,
+                                                   dsn=scratch.dsn, options=f"-c search_path={scratch.name},public",
+                                                   cursor_factory=ingestion.RealDictCursor)
+        for run in range(1, args.runs + 1):
+            if args.update and run == args.runs:
+                servers[args.update].revision += 1
+            requests_before = {source: server.requests for source, server in servers.items()}
+            not_modified_before = sum(server.not_modified for server in servers.values())
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = ingestion.lambda_handler({}, None)
+            elapsed = time.perf_counter() - started
+            stats = json.loads(response['body'])['stats']
+            requests = sum(server.requests - requests_before[source] for source, server in servers.items())
+            not_modified = sum(server.not_modified for server in servers.values()) - not_modified_before
+            print(f"{name:>8} {run:>4} {requests:>9} {not_modified:>5} {stats['unchanged_payloads']:>10} "
+                  f"{stats['rows_written']:>6} {stats.get('cache_hit_rate', 0):>9.2f} "
+                  f"{stats.get('cache_bytes_saved', 0):>12} {elapsed:>7.2f}")
+        ingestion.db.discard()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--update', default='openmeteo', help="provider whose payloads change before the last run ('' for none)")
+    parser.add_argument('--dsn', default=None)
+    parser.add_argument('--schema-file', default=SCHEMA_FILE)
+    args = parser.parse_args()
+
+    servers = start_stub_providers()
+    locations = make_locations(args.farms)
+    print(f"{'config':>8} {'run':>4} {'requests':>9} {'304s':>5} {'unchanged':>10} "
+          f"{'rows':>6} {'hit_rate':>9} {'bytes_saved':>12} {'wall_s':>7}")
+    for name, enabled in (('no-cache', False), ('cache', True)):
+        for server in servers.values():
+            server.revision = 0
+        run_config(name, enabled, args, servers, locations)
+    for server in servers.values():
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
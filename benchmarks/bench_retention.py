@@ -0,0 +1,131 @@
+"""Retention job on synthetic history: rows and bytes reclaimed, and temporal query latency before and after.
+
+    BENCH_DSN="host=localhost dbname=weather user=postgres" python benchmarks/bench_retention.py --farms 20 --days 150
+
+Loads --days of current readings every --interval minutes per farm and
+source, plus hourly forecasts over the same span, into a scratch schema.
+Times the rules engine's typical lookups (latest reading, 30-day average,
+next-day forecast), runs RetentionJob with the Lambda's default policy,
+and times them again.
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import sys
+import time
+
+from common import INGESTION_SRC
+from pg import SCHEMA_FILE, ScratchSchema
+
+sys.path.insert(0, INGESTION_SRC)
+from retention import RetentionJob  # noqa: E402
+
+SOURCES = ('openweather', 'weatherapi', 'yrno', 'openmeteo')
+
+LOAD_SQL = """
+SELECT ensure_monthly_partition(t, m)
+FROM unnest(ARRAY['current_weather', 'forecast_weather']) AS t,
+     generate_series(date_trunc('month', NOW() - %(days)s * INTERVAL '1 day'), NOW() + INTERVAL '1 month',
+                     INTERVAL '1 month') AS m;
+
+INSERT INTO current_weather (source, farm_id, location, timestamp, temperature_c, humidity_percent,
+                             wind_speed_mps, wind_direction_deg, rainfall_mm)
+SELECT s, 'bench_farm' || f, ST_SetSRID(ST_MakePoint(73.7, 24.6), 4326), ts,
+       25 + 8 * SIN(EXTRACT(EPOCH FROM ts) / 43200.0) + MOD(f, 3), 40 + random() * 30, random() * 6,
+       random() * 360, CASE WHEN random() < 0.1 THEN random() * 4 ELSE 0 END
+FROM generate_series(1, %(farms)s) AS f,
+     unnest(%(sources)s::TEXT[]) AS s,
+     generate_series(NOW() - %(days)s * INTERVAL '1 day', NOW(), %(interval)s * INTERVAL '1 minute') AS ts;
+
+INSERT INTO forecast_weather (source, farm_id, location, forecast_for, fetched_at, temperature_c,
+                              humidity_percent, wind_speed_mps, wind_direction_deg, rainfall_mm)
+SELECT s, 'bench_farm' || f, ST_SetSRID(ST_MakePoint(73.7, 24.6), 4326), ts, ts - INTERVAL '1 day',
+       26 + random() * 8, 50, 3, 180, 0
+FROM generate_series(1, %(farms)s) AS f,
+     unnest(%(sources)s::TEXT[]) AS s,
+     generate_series(date_trunc('hour', NOW() - %(days)s * INTERVAL '1 day'), NOW() + INTERVAL '5 days',
+                     INTERVAL '1 hour') AS ts;
+ANALYZE current_weather;
+ANALYZE forecast_weather;
+"""
+
+QUERIES = {
+    'latest': """SELECT temperature_c FROM current_weather
+                 WHERE farm_id = %s AND timestamp > NOW() - INTERVAL '1 day' ORDER BY timestamp DESC LIMIT 1""",
+    'avg_30d': """SELECT AVG(temperature_c) FROM current_weather
+                  WHERE farm_id = %s AND timestamp > NOW() - INTERVAL '30 days'""",
+    'forecast_24h': """SELECT MAX(temperature_c) FROM forecast_weather
+                       WHERE farm_id = %s AND forecast_for BETWEEN NOW() AND NOW() + INTERVAL '1 day'"""
+}
+
+
+def table_stats(cursor):
+    cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM current_weather) AS current_rows,
+               (SELECT COUNT(*) FROM forecast_weather) AS forecast_rows
+    """)
+    return cursor.fetchone()
+
+
+def time_queries(conn, farms, repeat):
+    timings = {}
+    with conn.cursor() as cursor:
+        for name, sql in QUERIES.items():
+            samples = []
+            for i in range(repeat):
+                started = time.perf_counter()
+                cursor.execute(sql, (f"bench_farm{i % farms + 1}",))
+                cursor.fetchall()
+                samples.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(samples)
+    conn.commit()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=20)
+    parser.add_argument('--days', type=int, default=150)
+    parser.add_argument('--interval', type=int, default=15, help='minutes between current readings')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--dsn', default=None)
+    parser.add_argument('--schema-file', default=SCHEMA_FILE)
+    args = parser.parse_args()
+
+    with ScratchSchema(args.dsn, args.schema_file) as scratch:
+        conn = scratch.connect()
+        with conn.cursor() as cursor:
+            cursor.execute(LOAD_SQL, {'farms': args.farms, 'days': args.days, 'interval': args.interval,
+                                      'sources': list(SOURCES)})
+        conn.commit()
+
+        with conn.cursor() as cursor:
+            before = table_stats(cursor)
+        timings_before = time_queries(conn, args.farms, args.repeat)
+        job = RetentionJob(conn, batch_size=args.batch_size, max_seconds=3600)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = job.run()
+        elapsed = time.perf_counter() - started
+        with conn.cursor() as cursor:
+            after = table_stats(cursor)
+        timings_after = time_queries(conn, args.farms, args.repeat)
+        conn.close()
+
+    print(f"retention run: {elapsed:.1f}s in {stats['batches']} batches, "
+          f"{stats['partitions_dropped']} partitions dropped")
+    print(f"current_weather rows: {before['current_rows']} -> {after['current_rows']}")
+    print(f"forecast_weather rows: {before['forecast_rows']} -> {after['forecast_rows']}")
+    print(f"rows reclaimed: {stats['rows_reclaimed']} (deleted {stats['rows_deleted']}, "
+          f"downsampled {stats['rows_downsampled']} into {stats['rows_compacted_into']})")
+    print(f"table bytes: {stats['bytes_before'] / 2 ** 20:.1f} MiB -> {stats['bytes_after'] / 2 ** 20:.1f} MiB "
+          f"({stats['bytes_dropped'] / 2 ** 20:.1f} MiB in dropped partitions)")
+    print(f"{'query':>14} {'before_ms':>10} {'after_ms':>10}")
+    for name in QUERIES:
+        print(f"{name:>14} {timings_before[name]:>10.2f} {timings_after[name]:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Rule API import and listing throughput against an in-process DynamoDB stand-in.
+
+    python benchmarks/bench_rule_api.py --farms 20 --stakeholders 25 --latency 0.01
+
+Posts --rules rules for each of --farms x --stakeholders through
+lambda_handler one per request (put_item, the old path) and as JSON arrays
+of --bulk rules (BatchWriteItem), then again with the stand-in throttling
+every fifth BatchWriteItem call and leaving every 20th item unprocessed.
+Every write call costs --latency seconds. Then re-posts every rule with a
+new priority, which moves it to a new key and deletes the old item, reads
+everything back per farm as NDJSON exports and through paged GETs, and
+checks that every rule was stored once and comes back in priority order.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+from common import RULE_API_SRC, load_lambda
+from stub_rules import StubDynamoDB
+
+
+def make_rules(farms, stakeholders, per_stakeholder, shift=0):
+    return [
+        {'farm_id': f"bench_farm{f}", 'stakeholder': f"stakeholder{s}", 'rule_id': f"bench_rule_{f}_{s}_{r}",
+         'name': f"heat {f}/{s}/{r}", 'data_type': 'forecast' if r % 2 == 0 else 'current',
+         'priority': (s + r + shift) % 10 + 1, 'stop_on_match': False,
+         'conditions': {'metric': 'temperature_c', 'operator': '>', 'value': 30 + s / 10},
+         'actions': [{'type': 'email', 'message': f"Heat alert for bench_farm{f}"}]}
+        for f in range(1, farms + 1) for s in range(1, stakeholders + 1) for r in range(per_stakeholder)
+    ]
+
+
+def post(api, body):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = api.lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"POST failed: {response['body'][:200]}")
+    return response
+
+
+def get(api, params):
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = api.lambda_handler({'httpMethod': 'GET', 'queryStringParameters': params}, None)
+    if response['statusCode'] != 200:
+        raise RuntimeError(f"GET failed: {response['body'][:200]}")
+    return response['body']
+
+
+def run_writes(api, rules, bulk):
+    started = time.perf_counter()
+    if bulk:
+        for i in range(0, len(rules), bulk):
+            post(api, rules[i:i + bulk])
+    else:
+        for rule in rules:
+            post(api, rule)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=20)
+    parser.add_argument('--stakeholders', type=int, default=25)
+    parser.add_argument('--rules', type=int, default=2, help='rules per farm and stakeholder')
+    parser.add_argument('--bulk', type=int, default=500, help='rules per bulk POST')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds per DynamoDB write call')
+    parser.add_argument('--page', type=int, default=100, help='limit for the paged GETs')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+    api = load_lambda(RULE_API_SRC, 'rule_api')
+    rules = make_rules(args.farms, args.stakeholders, args.rules)
+
+    print(f"{'mode':>16} {'rules':>6} {'calls':>6} {'retries':>8} {'wall_s':>7} {'rules/s':>8}")
+    configs = [('put_item', 0, {}, True), ('batch', args.bulk, {}, True), ('reprioritise', args.bulk, {}, False),
+               ('batch+throttle', args.bulk, {'throttle_every': 5, 'unprocessed_every': 20}, True)]
+    for name, bulk, faults, fresh in configs:
+        if fresh:
+            stub = StubDynamoDB(latency=args.latency, **faults)
+            api.dynamodb, api.table = stub, stub.Table(api.RULES_TABLE)
+        else:
+            rules = make_rules(args.farms, args.stakeholders, args.rules, shift=3)
+            stub.calls['batch_write_item'] = 0
+        api.table.calls['put_item'] = api.table.calls['query'] = 0
+        retries = []
+        sink = lambda record: retries.append(record.get('batch_write_retries', 0))
+        api.telemetry.add_sink(sink)
+        elapsed = run_writes(api, rules, bulk)
+        api.telemetry.remove_sink(sink)
+        stored = [(item['farm_id'], item['rule_id'], item['priority']) for item in api.table.items]
+        if sorted(stored) != sorted((rule['farm_id'], rule['rule_id'], rule['priority']) for rule in rules):
+            raise SystemExit(f"{name}: {len(stored)} items stored for {len(rules)} rules")
+        calls = stub.calls['batch_write_item'] + api.table.calls['put_item'] + api.table.calls['query']
+        print(f"{name:>16} {len(rules):>6} {calls:>6} {sum(retries):>8} {elapsed:>7.2f} {len(rules) / elapsed:>8.0f}")
+
+    print(f"{'read':>16} {'rules':>6} {'calls':>6} {'wall_s':>7} {'rules/s':>8}")
+    for name in ('export', 'paged'):
+        api.table.calls['query'] = 0
+        started = time.perf_counter()
+        count = 0
+        for f in range(1, args.farms + 1):
+            if name == 'export':
+                count += get(api, {'farm_id': f"bench_farm{f}", 'format': 'ndjson'}).count('\n')
+                continue
+            for s in range(1, args.stakeholders + 1):
+                params = {'farm_id': f"bench_farm{f}", 'stakeholder': f"stakeholder{s}", 'limit': str(args.page)}
+                priorities = []
+                while True:
+                    page = json.loads(get(api, params))
+                    priorities.extend(item['priority'] for item in page['items'])
+                    if not page['next_cursor']:
+                        break
+                    params['cursor'] = page['next_cursor']
+                if priorities != sorted(priorities):
+                    raise SystemExit(f"bench_farm{f}/stakeholder{s}: rules not in priority order: {priorities}")
+                count += len(priorities)
+        elapsed = time.perf_counter() - started
+        if count != len(rules):
+            raise SystemExit(f"{name}: read {count} of {len(rules)} rules")
+        print(f"{name:>16} {count:>6} {api.table.calls['query']:>6} {elapsed:>7.2f} {count / elapsed:>8.0f}")
+
+
+if __name__ == '__main__':
+    main()
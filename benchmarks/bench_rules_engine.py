@@ -0,0 +1,363 @@
+"""End-to-end rules engine benchmark: lambda_handler against local Postgres and in-process AWS stand-ins.
+
+    BENCH_DSN="host=localhost dbname=weather user=postgres" python benchmarks/bench_rules_engine.py \\
+        --farms 50 --days 14 --rules 12 --runs 30 --json results.json
+    PG_BIN=/usr/lib/postgresql/16/bin python benchmarks/bench_rules_engine.py --start-postgres
+
+Loads the postgresql_schema tables into a scratch schema (or a temporary
+cluster with --start-postgres) and fills them with hourly history for
+--farms x --sources over --days, plus five days of forecasts, the daily
+rollups and ingestion watermarks. WeatherRules is replaced by stub_rules,
+SNS by an in-process recorder. Every (farm, stakeholder) gets --rules
+rules cycling through every operator the engine supports, stored with the
+plan the rule API would compile for them.
+
+Each scenario runs lambda_handler({'all_farms': True}) --runs times after
+a cold first run. Before every run --churn of the farms get new data, as
+if ingestion had run, so incremental evaluation sees a realistic mix.
+Reports p50/p95/p99 latency, SQL queries per invocation and the Python
+heap peak of one extra run under tracemalloc; the JSON also carries the
+span and counter totals read from the engine's telemetry sink (time in
+SQL, evaluate_conditions, rule loads, SNS). --rtt-ms adds a simulated
+round trip to every SQL statement, which a localhost server hides. --json
+writes the results, --compare prints the change against an earlier file.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+from common import INGESTION_SRC, RULE_API_SRC, RULER_SRC, load_lambda
+from pg import SCHEMA_FILE, LocalPostgres, ScratchSchema
+from stub_rules import StubRulesTable
+from stub_sns import InProcessSNS
+
+sys.path.insert(0, RULER_SRC)
+import telemetry  # noqa: E402
+
+SOURCES = ['openweather', 'weatherapi', 'yrno', 'openmeteo', 'openmeteo_ecmwf', 'visualcrossing']
+STAKEHOLDERS = ['field', 'owner', 'agronomist']
+FORECAST_DAYS = 5
+
+# Module settings each scenario overrides on the loaded Ruler; anything else keeps its env default
+SCENARIOS = {
+    'baseline': {'USE_QUERY_PLANNER': False, 'USE_VECTOR_EVAL': False, 'DAILY_ROLLUPS': False,
+                 'INCREMENTAL_EVAL': False, 'ALERT_STATE': False, 'RULE_CACHE_TTL_SECONDS': 0,
+                 'USE_RULE_PLANS': False, 'COST_ORDERING': False, 'READING_BUFFERS': False},
+    'default': {},
+}
+
+LOAD_SQL = """
+SELECT ensure_monthly_partition(t, m)
+FROM unnest(ARRAY['current_weather', 'forecast_weather']) AS t,
+     generate_series(date_trunc('month', NOW() - %(days)s * INTERVAL '1 day'),
+                     NOW() + %(forecast_days)s * INTERVAL '1 day', INTERVAL '1 month') AS m;
+
+INSERT INTO current_weather (source, farm_id, location, timestamp, temperature_c, humidity_percent,
+                             wind_speed_mps, wind_direction_deg, rainfall_mm, solar_radiation_wm2)
+SELECT s.source, 'bench_farm' || f, ST_SetSRID(ST_MakePoint(73.7 + f * 0.01, 24.5 + f * 0.01), 4326), ts,
+       24 + 8 * sin(extract(hour FROM ts) * pi() / 12) + random() * 6,
+       30 + random() * 60, random() * 10, random() * 360,
+       CASE WHEN random() < 0.1 THEN random() * 5 ELSE 0 END,
+       GREATEST(0, 900 * sin((extract(hour FROM ts) - 6) * pi() / 12))
+FROM generate_series(1, %(farms)s) f,
+     unnest(%(sources)s::text[]) AS s(source),
+     generate_series(date_trunc('hour', NOW()) - %(days)s * INTERVAL '1 day', date_trunc('hour', NOW()),
+                     INTERVAL '1 hour') ts;
+
+INSERT INTO forecast_weather (source, farm_id, location, forecast_for, fetched_at, temperature_c, humidity_percent,
+                              wind_speed_mps, wind_direction_deg, rainfall_mm, chance_of_rain_percent)
+SELECT s.source, 'bench_farm' || f, ST_SetSRID(ST_MakePoint(73.7 + f * 0.01, 24.5 + f * 0.01), 4326), ts,
+       LEAST(ts, date_trunc('hour', NOW())) - INTERVAL '1 hour',
+       24 + 8 * sin(extract(hour FROM ts) * pi() / 12) + random() * 6,
+       30 + random() * 60, random() * 10, random() * 360,
+       CASE WHEN random() < 0.15 THEN random() * 8 ELSE 0 END, random() * 100
+FROM generate_series(1, %(farms)s) f,
+     unnest(%(sources)s::text[]) AS s(source),
+     generate_series(date_trunc('hour', NOW()) - %(days)s * INTERVAL '1 day',
+                     date_trunc('hour', NOW()) + %(forecast_days)s * INTERVAL '1 day', INTERVAL '1 hour') ts;
+
+INSERT INTO ingestion_watermarks (farm_id, table_name, watermark)
+SELECT 'bench_farm' || f, t, NOW()
+FROM generate_series(1, %(farms)s) f, unnest(ARRAY['current_weather', 'forecast_weather']) AS t;
+
+ANALYZE current_weather;
+ANALYZE forecast_weather;
+"""
+
+# Stand-in for an ingestion run touching some farms
+CHURN_SQL = """
+UPDATE ingestion_watermarks
+SET watermark = GREATEST(watermark, NOW()), revision = revision + 1, updated_at = NOW()
+WHERE farm_id = ANY(%s)
+"""
+
+RESET_SQL = "TRUNCATE rule_evaluations, alert_state"
+
+# Per-invocation telemetry fields averaged into the results
+TELEMETRY_FIELDS = ['sql_ms', 'sql_count', 'rows_fetched', 'evaluate_conditions_ms', 'evaluate_conditions_count',
+                    'rule_load_ms', 'sns_publish_ms', 'rules_triggered']
+
+# One template per operator family; rule i of every (farm, stakeholder) uses KINDS[i % len(KINDS)]
+KINDS = ['>', '<', '=', 'temporal', 'RATE>', 'DAY_DIFF>', 'AND', 'OR', 'NOT', 'SEQUENCE']
+
+
+def leaf(rnd, metric, kind):
+    value = Decimal(str(round(rnd.uniform(5, 40), 1)))
+    if kind in ('>', '<'):
+        return {'metric': metric, 'operator': kind, 'value': value}
+    if kind == '=':
+        return {'metric': 'rainfall_mm', 'operator': '=', 'value': Decimal('0')}
+    if kind == 'temporal':
+        return {'metric': metric, 'operator': rnd.choice(['>', '<', '>=', '<=']), 'value': value,
+                'temporal': {'duration': rnd.choice(['30 minutes', '2 hours', '6 hours'])}}
+    if kind == 'RATE>':
+        return {'metric': metric, 'operator': 'RATE>', 'value': Decimal(str(round(rnd.uniform(-2, 2), 1))),
+                'temporal': {'interval': rnd.choice(['30 minutes', '1 hour']), 'duration': '1 hour'}}
+    return {'metric': metric, 'operator': 'DAY_DIFF>', 'value': Decimal(str(round(rnd.uniform(-2, 2), 1))),
+            'temporal': {'day1': 'today', 'day2': rnd.choice(['tomorrow', 'day_2', 'day_3'])}}
+
+
+def conditions(rnd, metrics, kind, leaf_kinds):
+    pick = lambda: rnd.choice(metrics)
+    if kind in ('AND', 'OR'):
+        return {'operator': kind, 'sub_conditions': [leaf(rnd, pick(), k) for k in rnd.sample(leaf_kinds, 3)]}
+    if kind == 'NOT':
+        return {'operator': 'NOT', 'sub_conditions': [leaf(rnd, pick(), rnd.choice(['>', 'temporal']))]}
+    if kind == 'SEQUENCE':
+        return {'operator': 'SEQUENCE', 'sub_conditions': [
+            {'metric': 'rainfall_mm', 'operator': '>', 'value': Decimal('1'), 'within': '180 minutes'},
+            {'metric': 'temperature_c', 'operator': '>=', 'value': Decimal(str(round(rnd.uniform(20, 35), 1)))}]}
+    return leaf(rnd, pick(), kind)
+
+
+def generate_rules(table_metrics, farms, stakeholders, per_target, seed):
+    """WeatherRules items for every (farm, stakeholder); every third rule reads current_weather."""
+    from rule_plan import compile_rule
+    sys.path.insert(0, RULE_API_SRC)
+    from rule_store import with_keys
+    rnd = random.Random(seed)
+    items = []
+    for f in range(1, farms + 1):
+        for stakeholder in stakeholders:
+            for i in range(per_target):
+                kind = KINDS[i % len(KINDS)]
+                # DAY_DIFF> compares future days, which only forecasts have
+                data_type = 'current' if i % 3 == 2 and kind != 'DAY_DIFF>' else 'forecast'
+                leaf_kinds = KINDS[:6] if data_type == 'forecast' else KINDS[:5]
+                metrics = [m for m in table_metrics[f"{data_type}_weather"] if m != 'wind_direction_deg']
+                items.append({
+                    'rule_id': f"bench_{stakeholder}_{i}", 'farm_id': f"bench_farm{f}", 'stakeholder': stakeholder,
+                    'data_type': data_type, 'priority': Decimal(i + 1), 'name': f"{kind} rule {i}",
+                    'stop_on_match': False, 'conditions': conditions(rnd, metrics, kind, leaf_kinds),
+                    'actions': [{'type': rnd.choice(['email', 'sms']), 'message': f"{kind} rule {i} triggered"}]
+                })
+                # As stored by the rule API: numbers come back from DynamoDB as Decimal
+                items[-1]['plan'] = json.loads(json.dumps(compile_rule(items[-1]), default=str), parse_float=Decimal)
+                items[-1] = with_keys(items[-1])
+    return items
+
+
+def load_history(scratch, args):
+    conn = scratch.connect()
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        cursor.execute(LOAD_SQL, {'farms': args.farms, 'days': args.days, 'forecast_days': FORECAST_DAYS,
+                                  'sources': SOURCES[:args.sources]})
+        cursor.execute("SELECT (SELECT COUNT(*) FROM current_weather) AS current, "
+                       "(SELECT COUNT(*) FROM forecast_weather) AS forecast, NOW()::DATE AS today")
+        counts = cursor.fetchone()
+    conn.commit()
+    sys.path.insert(0, INGESTION_SRC)
+    from rollups import TIME_COLUMNS, rebuild_daily_rollups
+    with contextlib.redirect_stdout(io.StringIO()):
+        for table in TIME_COLUMNS:
+            rebuild_daily_rollups(conn, table, counts['today'] - timedelta(days=args.days + 1),
+                                  counts['today'] + timedelta(days=FORECAST_DAYS + 1))
+    conn.close()
+    print(f"Loaded {counts['current']} current + {counts['forecast']} forecast rows and rollups "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def latency_cursor(base, rtt_ms):
+    """Cursor class that waits rtt_ms before each statement, standing in for the Lambda-to-RDS round trip."""
+    class LatencyCursor(base):
+        def execute(self, query, vars=None):
+            time.sleep(rtt_ms / 1000)
+            return super().execute(query, vars)
+    return LatencyCursor
+
+
+def invoke(engine, event):
+    """Run the handler once; returns (ms, response stats, the telemetry record it flushed)."""
+    records = []
+    telemetry.add_sink(records.append)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            response = engine.lambda_handler(event, None)
+            elapsed = time.perf_counter() - started
+    finally:
+        telemetry.remove_sink(records.append)
+    if response['statusCode'] != 200:
+        raise SystemExit(f"lambda_handler failed: {response['body']}")
+    record = next((r for r in records if set(r['_aws']['CloudWatchMetrics'][0]['Dimensions'][0]) == {'Service'}), {})
+    return elapsed * 1000, response['stats'], record
+
+
+def run_scenario(engine, scratch, name, overrides, args, items):
+    for setting, value in overrides.items():
+        setattr(engine, setting, value)
+    engine.rule_cache = engine.RuleCache(ttl=engine.RULE_CACHE_TTL_SECONDS, max_entries=engine.RULE_CACHE_MAX_ENTRIES)
+    engine.condition_order = engine.ConditionOrder(enabled=engine.COST_ORDERING, max_nodes=engine.SELECTIVITY_MAX_NODES)
+    engine.reading_store = engine.ReadingStore(enabled=engine.READING_BUFFERS, hours=engine.READING_BUFFER_HOURS,
+                                               max_readings=engine.READING_BUFFER_MAX_READINGS)
+    engine.rules_table = StubRulesTable(items)
+    engine.sns = InProcessSNS()
+    conn = scratch.connect()
+    with conn.cursor() as cursor:
+        cursor.execute(RESET_SQL)
+    conn.commit()
+
+    rnd = random.Random(args.seed)
+    farm_ids = [f"bench_farm{f}" for f in range(1, args.farms + 1)]
+
+    def churn():
+        changed = rnd.sample(farm_ids, round(len(farm_ids) * args.churn))
+        with conn.cursor() as cursor:
+            cursor.execute(CHURN_SQL, (changed,))
+        conn.commit()
+
+    event = {'all_farms': True}
+    cold_ms, _, _ = invoke(engine, event)
+    latencies, queries, evaluated, notified, skipped, records = [], [], [], [], [], []
+    for _ in range(args.runs):
+        churn()
+        elapsed, stats, record = invoke(engine, event)
+        latencies.append(elapsed)
+        queries.append(stats['queries'])
+        evaluated.append(stats.get('rules_evaluated', 0))
+        notified.append(stats.get('notifications_sent', 0))
+        skipped.append(stats.get('expensive_nodes_skipped', 0))
+        records.append(record)
+
+    churn()
+    tracemalloc.start()
+    invoke(engine, event)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    conn.close()
+
+    return {
+        'cold_ms': round(cold_ms, 2),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(statistics.mean(latencies), 2),
+        'queries_per_invocation': round(statistics.mean(queries), 1),
+        'max_queries': max(queries),
+        'rules_evaluated': round(statistics.mean(evaluated), 1),
+        'notifications': round(statistics.mean(notified), 1),
+        'expensive_nodes_skipped': round(statistics.mean(skipped), 1),
+        'dynamodb_calls': dict(engine.rules_table.calls),
+        'heap_peak_mb': round(peak / 2 ** 20, 2),
+        'maxrss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'telemetry': {field: round(statistics.mean(r.get(field, 0) for r in records), 3) for field in TELEMETRY_FIELDS},
+    }
+
+
+def report(results, previous=None):
+    columns = ['cold_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_invocation', 'heap_peak_mb']
+    print(f"\n{'scenario':<10} " + ' '.join(f"{c:>22}" for c in columns))
+    for name, result in results.items():
+        cells = []
+        for column in columns:
+            cell = f"{result[column]:g}"
+            old = (previous or {}).get(name, {}).get(column)
+            if old:
+                cell += f" ({(result[column] - old) / old * 100:+.0f}%)"
+            cells.append(f"{cell:>22}")
+        print(f"{name:<10} " + ' '.join(cells))
+
+
+def parse_override(text):
+    name, _, value = text.partition('=')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=50)
+    parser.add_argument('--days', type=int, default=14, help='days of history before now')
+    parser.add_argument('--sources', type=int, default=4, choices=range(1, len(SOURCES) + 1))
+    parser.add_argument('--rules', type=int, default=12, help='rules per (farm, stakeholder)')
+    parser.add_argument('--stakeholders', type=int, default=2, choices=range(1, len(STAKEHOLDERS) + 1))
+    parser.add_argument('--runs', type=int, default=30, help='timed invocations per scenario')
+    parser.add_argument('--churn', type=float, default=0.5, help='fraction of farms with new data before each run')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append',
+                        help='run only this scenario (repeatable; default: all)')
+    parser.add_argument('--set', dest='overrides', type=parse_override, action='append', default=[],
+                        metavar='NAME=VALUE', help='override a Ruler setting in every scenario, e.g. FARM_BATCH_SIZE=50')
+    parser.add_argument('--rtt-ms', type=float, default=0.0,
+                        help='simulated network round trip per SQL statement (localhost has almost none)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--dsn', default=None)
+    parser.add_argument('--schema-file', default=SCHEMA_FILE)
+    parser.add_argument('--start-postgres', action='store_true', help='run against a temporary local cluster')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='earlier --json file to compare against')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = load_lambda(RULER_SRC, 'rules_engine')
+    import planner
+    items = generate_rules(planner.TABLE_METRICS, args.farms, STAKEHOLDERS[:args.stakeholders], args.rules, args.seed)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['scenarios']
+
+    with contextlib.ExitStack() as stack:
+        dsn = args.dsn
+        if args.start_postgres:
+            dsn = stack.enter_context(LocalPostgres()).dsn
+        scratch = stack.enter_context(ScratchSchema(dsn, schema_file=args.schema_file))
+        load_history(scratch, args)
+        engine.db = engine.ConnectionManager(statement_timeout_ms=engine.DB_STATEMENT_TIMEOUT_MS, dsn=scratch.dsn,
+                                             options=f"-c search_path={scratch.name},public",
+                                             cursor_factory=latency_cursor(engine.RealDictCursor, args.rtt_ms))
+        defaults = {setting: getattr(engine, setting) for scenario in SCENARIOS.values() for setting in scenario}
+        results = {}
+        for name in args.scenario or list(SCENARIOS):
+            overrides = {**defaults, **SCENARIOS[name], **dict(args.overrides)}
+            print(f"Running {name}: {len(items)} rules, {args.runs} runs")
+            results[name] = run_scenario(engine, scratch, name, overrides, args, items)
+        engine.db.discard()
+
+    report(results, previous)
+    if args.json:
+        config = {key: value for key, value in vars(args).items() if key not in ('json', 'compare', 'dsn')}
+        with open(args.json, 'w') as f:
+            json.dump({'config': config, 'scenarios': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
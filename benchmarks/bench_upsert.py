@@ -0,0 +1,103 @@
+"""Per-row vs batched vs COPY upserts into forecast_weather/current_weather.
+
+    BENCH_DSN="host=localhost dbname=weather user=postgres" python benchmarks/bench_upsert.py --farms 10
+
+Each mode writes the same synthetic run (farms x 4 sources x --hours forecast
+rows plus one current row each) three times: into empty tables (insert),
+over the same keys with identical values (same), and with --changed of the
+forecast values moved (changed). Every mode runs with SKIP_UNCHANGED_ROWS
+off and on, and reports the WAL bytes each phase generated.
+"""
+import argparse
+import contextlib
+import io
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import INGESTION_SRC, load_lambda, make_locations
+from pg import SCHEMA_FILE, ScratchSchema
+
+
+def synthetic_results(ingestion, locations, hours, changed=0.0):
+    start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    step = round(1 / changed) if changed else 0
+    results = []
+    for location in locations:
+        for source, fetcher in ingestion.PROVIDERS.items():
+            current = {'temperature_c': 30.5, 'humidity_percent': 40.0, 'wind_speed_mps': 3.0,
+                       'wind_direction_deg': 180.0, 'rainfall_mm': 0.0, 'solar_radiation_wm2': None}
+            forecast = [{'forecast_for': start + timedelta(hours=h),
+                         'temperature_c': 28 + h % 7 + (0.5 if step and h % step == 0 else 0),
+                         'humidity_percent': 50.0, 'wind_speed_mps': 2.5, 'wind_direction_deg': 200.0,
+                         'rainfall_mm': 0.1 * (h % 3), 'chance_of_rain_percent': 20.0}
+                        for h in range(hours)]
+            results.append((location, fetcher, {'source': source, 'current': current, 'forecast': forecast}, None))
+    return results
+
+
+def wal_lsn(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_current_wal_lsn() AS lsn")
+        return cursor.fetchone()['lsn']
+
+
+def wal_bytes(conn, since):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s) AS bytes", (since,))
+        return int(cursor.fetchone()['bytes'])
+
+
+def run(ingestion, conn, mode, results, timestamp):
+    cursor = conn.cursor()
+    errors = []
+    counts = {}
+    lsn = wal_lsn(conn)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == 'row':
+            written = ingestion.write_results_per_row(conn, cursor, results, timestamp, errors, counts=counts)
+        else:
+            written = ingestion.write_results_bulk(conn, cursor, results, timestamp, errors, mode=mode, counts=counts)
+    elapsed = time.perf_counter() - started
+    wal = wal_bytes(conn, lsn)
+    conn.commit()
+    cursor.close()
+    if errors:
+        raise SystemExit(f"{mode} failed: {errors[0]}")
+    totals = {name: sum(c[name] for c in counts.values()) for name in ('inserted', 'updated', 'skipped')}
+    return written, elapsed, wal, totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=3)
+    parser.add_argument('--hours', type=int, default=120)
+    parser.add_argument('--changed', type=float, default=0.1, help='share of forecast values changed in the last phase')
+    parser.add_argument('--dsn', default=None)
+    parser.add_argument('--schema-file', default=SCHEMA_FILE)
+    args = parser.parse_args()
+
+    ingestion = load_lambda(INGESTION_SRC, 'ingestion_lambda')
+    locations = make_locations(args.farms)
+    phases = [('insert', synthetic_results(ingestion, locations, args.hours)),
+              ('same', synthetic_results(ingestion, locations, args.hours)),
+              ('changed', synthetic_results(ingestion, locations, args.hours, args.changed))]
+
+    print(f"{'mode':>6} {'skip':>5} {'phase':>7} {'rows':>7} {'inserted':>8} {'updated':>8} {'skipped':>8} "
+          f"{'seconds':>8} {'rows/s':>9} {'wal_kb':>9}")
+    for mode in ('row', 'batch', 'copy'):
+        for skip in (False, True):
+            ingestion.SKIP_UNCHANGED_ROWS = skip
+            with ScratchSchema(args.dsn, args.schema_file) as scratch:
+                conn = scratch.connect()
+                # current_weather is keyed by run timestamp, so reuse one to make the phases overwrite each other
+                timestamp = datetime.now(timezone.utc)
+                for phase, results in phases:
+                    written, elapsed, wal, totals = run(ingestion, conn, mode, results, timestamp)
+                    print(f"{mode:>6} {'on' if skip else 'off':>5} {phase:>7} {written:>7} {totals['inserted']:>8} "
+                          f"{totals['updated']:>8} {totals['skipped']:>8} {elapsed:>8.3f} {written / elapsed:>9.0f} "
+                          f"{wal / 1024:>9.0f}")
+                conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Scalar (raw conditions and compiled plans) vs vectorized (NumPy) rule evaluation over synthetic forecast windows.
+
+    python benchmarks/bench_vector_eval.py --farms 25 --rules 2000
+
+Builds in-memory windows shaped like the planner's (4 sources x hourly rows
+from a day back to 5 days ahead per farm), generates rules covering every
+operator, evaluates each (rule, farm) pair with the scalar evaluator on the
+raw conditions, on the plan rule_plan.compile_rule() stores with each rule,
+and with the vector evaluator. Fails if any verdict or the planned window
+differs, and reports the time each one took and the scalar cost per rule.
+
+The vector path does the array work for a leaf once for the whole batch,
+so its advantage grows with --farms and --rules: about 1x at --farms 10
+--rules 300, 3x at 25 x 1000 (the engine's default batch of 25 farms),
+5x at 25 x 2000 and 7x at 50 x 2000.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import RULER_SRC, load_lambda
+
+SOURCES = ['openweather', 'weatherapi', 'yrno', 'openmeteo']
+
+
+def synthetic_windows(planner, farms, now, rnd):
+    plan = {'table': 'forecast_weather', 'metrics': list(planner.TABLE_METRICS['forecast_weather']),
+            'since': now - timedelta(days=1), 'now': now}
+    start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=23)
+    windows = {}
+    for f in range(farms):
+        rows = []
+        for h in range(24 + 120):
+            for source in SOURCES:
+                rows.append({
+                    'source': source,
+                    'forecast_for': start + timedelta(hours=h),
+                    'temperature_c': round(24 + 12 * rnd.random(), 1),
+                    'humidity_percent': None if rnd.random() < 0.02 else round(20 + 70 * rnd.random(), 1),
+                    'wind_speed_mps': round(10 * rnd.random(), 2),
+                    'wind_direction_deg': round(360 * rnd.random()),
+                    'rainfall_mm': rnd.choice([0.0, 0.0, 0.0, 0.2, 1.0, 4.0]),
+                    'chance_of_rain_percent': round(100 * rnd.random())
+                })
+        windows[f'farm{f}'] = planner.WeatherWindow('forecast_weather', f'farm{f}', plan['metrics'],
+                                                    plan['since'], rows, now)
+    return plan, windows
+
+
+def random_leaf(rnd, metrics):
+    metric = rnd.choice(metrics)
+    kind = rnd.random()
+    if kind < 0.3:
+        return {'metric': metric, 'operator': rnd.choice(['>', '<', '>=', '<=', '=']), 'value': round(rnd.uniform(0, 60), 1)}
+    if kind < 0.55:
+        return {'metric': metric, 'operator': rnd.choice(['>', '<', '>=', '<=']), 'value': round(rnd.uniform(0, 60), 1),
+                'temporal': {'duration': rnd.choice(['30 minutes', '2 hours', '6 hours', '1 day'])}}
+    if kind < 0.75:
+        return {'metric': metric, 'operator': 'RATE>', 'value': round(rnd.uniform(-5, 5), 1),
+                'temporal': {'interval': rnd.choice(['30 minutes', '1 hour', '3 hours']), 'duration': '1 hour'}}
+    return {'metric': metric, 'operator': 'DAY_DIFF>', 'value': round(rnd.uniform(-3, 3), 1),
+            'temporal': {'day1': 'today', 'day2': rnd.choice(['tomorrow', 'day_2', 'day_3'])}}
+
+
+def random_conditions(rnd, metrics, depth=0):
+    kind = rnd.random()
+    if depth >= 2 or kind < 0.35:
+        return random_leaf(rnd, metrics)
+    if kind < 0.5:
+        return {'operator': 'SEQUENCE', 'sub_conditions': [
+            {'metric': rnd.choice(metrics), 'operator': rnd.choice(['>', '<', '>=']),
+             'value': round(rnd.uniform(0, 60), 1), 'within': rnd.choice(['60 minutes', '180 minutes'])}
+            for _ in range(rnd.randint(2, 3))]}
+    if kind < 0.6:
+        return {'operator': 'NOT', 'sub_conditions': [random_conditions(rnd, metrics, depth + 1)]}
+    return {'operator': rnd.choice(['AND', 'OR']),
+            'sub_conditions': [random_conditions(rnd, metrics, depth + 1) for _ in range(rnd.randint(2, 4))]}
+
+
+def scalar_verdict(engine, window, rule, farm_id, plan=None):
+    try:
+        if plan is not None:
+            return engine.evaluate_plan(window.latest(), plan['root'], 'forecast_weather', farm_id, NoSQL(), window)
+        return engine.evaluate_conditions(window.latest(), rule, 'forecast_weather', farm_id, NoSQL(), window)
+    except TypeError:
+        # Reported as scalar_errors: a reading the scalar path could not compare
+        return None
+
+
+class NoSQL:
+    """Cursor stand-in: the windows are complete, so any SQL fallback is a bug."""
+
+    def execute(self, *args, **kwargs):
+        raise AssertionError('scalar evaluator fell back to SQL')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--farms', type=int, default=25)
+    parser.add_argument('--rules', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+    engine = load_lambda(RULER_SRC, 'rules_engine')
+    import planner
+    import vector_eval
+    import rule_plan
+
+    rnd = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    plan, windows = synthetic_windows(planner, args.farms, now, rnd)
+    rules = [random_conditions(rnd, plan['metrics']) for _ in range(args.rules)]
+    farm_ids = list(windows)
+    plans = [rule_plan.compile_rule({'data_type': 'forecast', 'conditions': rule}) for rule in rules]
+    for daily in (False, True):
+        raw_window = planner.plan_window([{'data_type': 'forecast', 'conditions': rule} for rule in rules],
+                                         'forecast', now, daily)
+        planned_window = planner.plan_window([{'data_type': 'forecast', 'conditions': rule, 'plan': plan}
+                                              for rule, plan in zip(rules, plans)], 'forecast', now, daily)
+        if raw_window != planned_window:
+            raise SystemExit(f"planned window differs (daily={daily}): {raw_window} vs {planned_window}")
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        scalar = {(f, i): scalar_verdict(engine, windows[f], rule, f) for f in farm_ids for i, rule in enumerate(rules)}
+    scalar_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        compiled = {(f, i): scalar_verdict(engine, windows[f], rule, f, plans[i])
+                    for f in farm_ids for i, rule in enumerate(rules)}
+    compiled_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    evaluator = vector_eval.build_evaluator(windows, farm_ids)
+    vector = {(f, i): evaluator.verdict(rule, f) for f in farm_ids for i, rule in enumerate(rules)}
+    vector_seconds = time.perf_counter() - started
+
+    undecided = [key for key, verdict in vector.items() if verdict is None]
+    mismatches = [key for key, verdict in vector.items() if verdict is not None and verdict != scalar[key]]
+    errors = [key for key, verdict in scalar.items() if verdict is None]
+    compiled_mismatches = [key for key, verdict in compiled.items() if verdict != scalar[key]]
+    pairs = len(scalar)
+    print(f"rows/farm={len(windows[farm_ids[0]].rows)} farms={args.farms} rules={args.rules} pairs={pairs}")
+    print(f"triggered={sum(1 for v in scalar.values() if v)} scalar_errors={len(errors)} "
+          f"undecided_by_vector={len(undecided)} mismatches={len(mismatches)} "
+          f"compiled_mismatches={len(compiled_mismatches)}")
+    print(f"scalar: {scalar_seconds * 1000:.1f} ms ({scalar_seconds / pairs * 1e6:.1f} us/rule)  "
+          f"compiled: {compiled_seconds * 1000:.1f} ms ({compiled_seconds / pairs * 1e6:.1f} us/rule)  "
+          f"vector: {vector_seconds * 1000:.1f} ms  speedup: {scalar_seconds / vector_seconds:.1f}x")
+    if compiled_mismatches:
+        farm_id, i = compiled_mismatches[0]
+        raise SystemExit(f"compiled mismatch for {farm_id}: {rules[i]} raw={scalar[compiled_mismatches[0]]} "
+                         f"compiled={compiled[compiled_mismatches[0]]}")
+    if mismatches:
+        farm_id, i = mismatches[0]
+        raise SystemExit(f"mismatch for {farm_id}: {rules[i]} scalar={scalar[mismatches[0]]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""Helpers shared by the benchmark scripts."""
+import importlib.util
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INGESTION_SRC = os.path.join(REPO_ROOT, 'lambda', 'Lambda_ingestion', 'src')
+RULER_SRC = os.path.join(REPO_ROOT, 'lambda', 'Lambda_Ruler', 'src')
+RULE_API_SRC = os.path.join(REPO_ROOT, 'Dynamo_Rule_Define')
+
+
+def load_lambda(src_dir, name):
+    """Import a Lambda's lambda_function.py under a unique module name.
+
+    Each Lambda ships a lambda_function.py, so they cannot share the plain
+    module name; their sibling modules are importable via sys.path as in AWS.
+    """
+    if src_dir not in sys.path:
+        sys.path.insert(0, src_dir)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(src_dir, 'lambda_function.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_locations(count, lat=24.5854, lon=73.7125, spacing=0.25):
+    """Synthetic farms laid out on a grid around Udaipur."""
+    side = max(1, int(count ** 0.5))
+    return [
+        {'lat': round(lat + (i // side) * spacing, 4), 'lon': round(lon + (i % side) * spacing, 4),
+         'farm_id': f'bench_farm{i + 1}'}
+        for i in range(count)
+    ]
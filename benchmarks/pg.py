@@ -0,0 +1,128 @@
+"""Scratch Postgres schemas for benchmarks.
+
+Benchmarks connect with BENCH_DSN (default: the DB_* variables the Lambdas
+use) and work inside a throwaway schema so they never touch real tables.
+The database needs PostGIS, like the RDS instance. LocalPostgres starts a
+throwaway cluster for runs on a machine without a database server.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import uuid
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from common import REPO_ROOT
+
+SCHEMA_FILE = os.path.join(REPO_ROOT, 'postgresql_schema')
+
+
+def default_dsn():
+    return os.environ.get('BENCH_DSN') or (
+        f"host={os.environ.get('DB_HOST', 'localhost')} port={os.environ.get('DB_PORT', '5432')} "
+        f"dbname={os.environ.get('DB_NAME', 'postgres')} user={os.environ.get('DB_USER', 'postgres')} "
+        f"password={os.environ.get('DB_PASS', '')}"
+    )
+
+
+class ScratchSchema:
+    """Create a uniquely named schema, load the weather tables into it, drop it on exit.
+
+    schema_sql, when given, is loaded instead of schema_file.
+    """
+
+    def __init__(self, dsn=None, schema_file=SCHEMA_FILE, schema_sql=None):
+        self.dsn = dsn or default_dsn()
+        self.schema_file = schema_file
+        self.schema_sql = schema_sql
+        self.name = f"bench_{uuid.uuid4().hex[:8]}"
+
+    def connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor,
+                                options=f"-c search_path={self.name},public")
+        return conn
+
+    def execute_file(self, path):
+        """Run a SQL file (e.g. a migration) inside the scratch schema."""
+        with open(path) as f:
+            self._execute(f.read())
+
+    def _execute(self, sql):
+        conn = psycopg2.connect(self.dsn, options=f"-c search_path={self.name},public")
+        # autocommit so files with their own BEGIN/COMMIT run as written
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+        conn.close()
+
+    def __enter__(self):
+        conn = psycopg2.connect(self.dsn)
+        with conn, conn.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA {self.name}")
+        conn.close()
+        if self.schema_sql is not None:
+            self._execute(self.schema_sql)
+        else:
+            self.execute_file(self.schema_file)
+        return self
+
+    def __exit__(self, *exc):
+        conn = psycopg2.connect(self.dsn)
+        with conn, conn.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {self.name} CASCADE")
+        conn.close()
+
+
+class LocalPostgres:
+    """Start a temporary Postgres cluster on a free port; stop and delete it on exit.
+
+    initdb and pg_ctl come from bin_dir, PG_BIN or PATH. The build needs the
+    PostGIS extension for the weather tables.
+    """
+
+    def __init__(self, bin_dir=None):
+        self.bin_dir = bin_dir or os.environ.get('PG_BIN')
+        self.dsn = None
+
+    def _bin(self, name):
+        path = os.path.join(self.bin_dir, name) if self.bin_dir else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise RuntimeError(f"{name} not found; set PG_BIN to the Postgres bin directory")
+        return path
+
+    def __enter__(self):
+        self.dir = tempfile.mkdtemp(prefix='bench_pg_')
+        self.data = os.path.join(self.dir, 'data')
+        try:
+            self._start()
+        except Exception:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            raise
+        return self
+
+    def _start(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        subprocess.run([self._bin('initdb'), '-D', self.data, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self._bin('pg_ctl'), '-D', self.data, '-l', os.path.join(self.dir, 'postgres.log'), '-w',
+                        '-o', f"-p {port} -k {self.dir} -c listen_addresses=127.0.0.1", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        self.dsn = f"host=127.0.0.1 port={port} dbname=postgres user=postgres"
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+        except psycopg2.Error as e:
+            print(f"PostGIS is not available in this build: {e}")
+        conn.close()
+
+    def __exit__(self, *exc):
+        subprocess.run([self._bin('pg_ctl'), '-D', self.data, '-m', 'fast', 'stop'],
+                       check=False, stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.dir, ignore_errors=True)
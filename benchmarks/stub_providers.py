@@ -0,0 +1,154 @@
+"""Local stand-ins for the four weather providers, with injected latency.
+
+Each provider gets its own threaded HTTP server that returns a small but
+well-formed payload after sleeping for the configured latency. Call
+``start_stub_providers`` before importing the ingestion Lambda so its
+``*_BASE_URL`` settings point at the stubs.
+
+Payloads only change on the hour or when a server's ``revision`` is
+bumped. Like the real API, the yr.no stub sends Last-Modified and Expires
+and answers If-Modified-Since with 304 Not Modified.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_LATENCY = {
+    'openweather': 0.20,
+    'weatherapi': 0.40,
+    'yrno': 0.60,
+    'openmeteo': 0.30
+}
+
+
+def _hours(count):
+    start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return [start + timedelta(hours=h) for h in range(count)]
+
+
+def openweather_payload(path):
+    if path.startswith('/weather'):
+        return {'main': {'temp': 31.5, 'humidity': 40}, 'wind': {'speed': 3.2, 'deg': 270}, 'rain': {'1h': 0.0}}
+    return {'list': [
+        {'dt': int(ts.timestamp()), 'main': {'temp': 30 + i % 5, 'humidity': 45}, 'wind': {'speed': 2.5, 'deg': 200},
+         'rain': {'3h': 0.1 * (i % 3)}, 'pop': 0.2}
+        for i, ts in enumerate(_hours(120)[::3])
+    ]}
+
+
+def weatherapi_payload(path):
+    hours = _hours(120)
+    days = {}
+    for i, ts in enumerate(hours):
+        days.setdefault(ts.date(), []).append({
+            'time': ts.strftime('%Y-%m-%d %H:%M'), 'temp_c': 29 + i % 6, 'humidity': 50, 'wind_kph': 12.0,
+            'wind_degree': 180, 'precip_mm': 0.0, 'chance_of_rain': 10
+        })
+    return {
+        'current': {'temp_c': 30.1, 'humidity': 48, 'wind_kph': 11.0, 'wind_degree': 190, 'precip_mm': 0.0},
+        'forecast': {'forecastday': [{'hour': hours_of_day} for hours_of_day in days.values()]}
+    }
+
+
+def yrno_payload(path):
+    return {'properties': {'timeseries': [
+        {'time': ts.strftime('%Y-%m-%dT%H:%M:%SZ'),
+         'data': {'instant': {'details': {'air_temperature': 28 + i % 7, 'relative_humidity': 55.0,
+                                          'wind_speed': 2.0, 'wind_from_direction': 160.0}},
+                  'next_1_hours': {'details': {'precipitation_amount': 0.0}}}}
+        for i, ts in enumerate(_hours(110))
+    ]}}
+
+
+def openmeteo_payload(path):
+    hours = _hours(120)
+    return {
+        'current': {'temperature_2m': 30.4, 'relative_humidity_2m': 47, 'wind_speed_10m': 3.1,
+                    'wind_direction_10m': 210, 'precipitation': 0.0},
+        'hourly': {
+            'time': [ts.strftime('%Y-%m-%dT%H:%M') for ts in hours],
+            'temperature_2m': [29 + i % 4 for i in range(len(hours))],
+            'relative_humidity_2m': [50] * len(hours),
+            'wind_speed_10m': [2.7] * len(hours),
+            'wind_direction_10m': [200] * len(hours),
+            'precipitation': [0.0] * len(hours)
+        }
+    }
+
+
+PAYLOADS = {
+    'openweather': openweather_payload,
+    'weatherapi': weatherapi_payload,
+    'yrno': yrno_payload,
+    'openmeteo': openmeteo_payload
+}
+
+
+class StubServer:
+    """One provider's HTTP server running on a background thread."""
+
+    def __init__(self, provider, latency, expires=0):
+        self.provider = provider
+        self.latency = latency
+        self.expires = expires
+        self.revision = 0
+        self.requests = 0
+        self.not_modified = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                headers = {'Content-Type': 'application/json'}
+                if stub.provider == 'yrno':
+                    hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+                    modified = formatdate(hour.timestamp() + stub.revision, usegmt=True)
+                    headers['Last-Modified'] = modified
+                    headers['Expires'] = formatdate(time.time() + stub.expires, usegmt=True)
+                    if self.headers.get('If-Modified-Since') == modified:
+                        stub.not_modified += 1
+                        self.send_response(304)
+                        for name, value in headers.items():
+                            self.send_header(name, value)
+                        self.end_headers()
+                        return
+                payload = PAYLOADS[stub.provider](self.path)
+                if stub.revision:
+                    payload['stub_revision'] = stub.revision
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_stub_providers(latency=None):
+    """Start all four stubs and export the env vars the ingestion Lambda reads."""
+    latency = {**DEFAULT_LATENCY, **(latency or {})}
+    servers = {provider: StubServer(provider, latency[provider]) for provider in PAYLOADS}
+    os.environ['OPENWEATHER_BASE_URL'] = servers['openweather'].url
+    os.environ['WEATHERAPI_BASE_URL'] = servers['weatherapi'].url
+    os.environ['YR_NO_BASE_URL'] = servers['yrno'].url
+    os.environ['OPEN_METEO_URL'] = servers['openmeteo'].url + '/v1/forecast'
+    os.environ.setdefault('OPENWEATHER_API_KEY', 'stub')
+    os.environ.setdefault('WEATHERAPI_API_KEY', 'stub')
+    return servers
@@ -0,0 +1,173 @@
+"""In-process stand-in for the WeatherRules DynamoDB table.
+
+Answers the calls the rules engine and the rule API make: query (on the
+farm_id/rule_key key or DataTypeIndex, with an optional begins_with prefix
+on the sort key, Limit, ExclusiveStartKey and a projection), a paginated,
+projected scan, put_item, delete_item and, through StubDynamoDB,
+BatchWriteItem. Queries return items in sort key order and key conditions
+are read from the :fid, :dt and :prefix values rather than parsed from the
+expression. Items keep their numbers as Decimal the way
+boto3 returns them, pages stop at DynamoDB's 1 MB limit and
+ConsumedCapacity is estimated from item size. StubDynamoDB adds a fixed
+latency per write call and can throttle or leave items unprocessed, to
+exercise the retry paths.
+"""
+import json
+import math
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+PAGE_BYTES = 1024 * 1024
+# (hash, range) key attributes of the table and its indexes
+KEYS = {None: ('farm_id', 'rule_key'), 'DataTypeIndex': ('data_type', 'type_key')}
+
+
+def _size(item):
+    return len(json.dumps(item, default=str))
+
+
+def _capacity(size):
+    """Eventually consistent read units: half a unit per 4 KB."""
+    return math.ceil(max(size, 1) / 4096) * 0.5
+
+
+class StubRulesTable:
+    def __init__(self, items=(), name='WeatherRules'):
+        self.name = name
+        self.items = list(items)
+        self.calls = {'query': 0, 'scan': 0}
+        self.on_write = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _project(self, item, ProjectionExpression=None, ExpressionAttributeNames=None):
+        if not ProjectionExpression:
+            return item
+        names = ExpressionAttributeNames or {}
+        attributes = [names.get(a.strip(), a.strip()) for a in ProjectionExpression.split(',')]
+        return {a: item[a] for a in attributes if a in item}
+
+    def query(self, IndexName=None, KeyConditionExpression=None, ExpressionAttributeValues=None, Limit=None,
+              ExclusiveStartKey=None, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self.calls['query'] += 1
+        values = ExpressionAttributeValues or {}
+        hash_key, range_key = KEYS[IndexName]
+        hash_value = values.get(':dt' if IndexName else ':fid')
+        prefix = values.get(':prefix', '')
+        items = sorted((item for item in self.items
+                        if item.get(hash_key) == hash_value and item.get(range_key, '').startswith(prefix)),
+                       key=lambda item: item[range_key])
+        start = ExclusiveStartKey['index'] if ExclusiveStartKey else 0
+        end = min(len(items), start + Limit) if Limit else len(items)
+        page = items[start:end]
+        response = {'Items': [self._project(item, ProjectionExpression, ExpressionAttributeNames) for item in page],
+                    'Count': len(page),
+                    'ConsumedCapacity': {'TableName': 'WeatherRules',
+                                         'CapacityUnits': _capacity(sum(_size(item) for item in page))}}
+        if end < len(items):
+            response['LastEvaluatedKey'] = {'index': end}
+        return response
+
+    def put_item(self, Item, **kwargs):
+        self.calls['put_item'] = self.calls.get('put_item', 0) + 1
+        if self.on_write:
+            self.on_write()
+        self.store(Item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self.calls['delete_item'] = self.calls.get('delete_item', 0) + 1
+        if self.on_write:
+            self.on_write()
+        self.remove(Key)
+        return {}
+
+    def store(self, item):
+        """Insert item, replacing the one with the same farm_id and rule_key as DynamoDB would."""
+        with self._lock:
+            if self._index is None:
+                self._index = {(i['farm_id'], i['rule_key']): n for n, i in enumerate(self.items)}
+            key = (item['farm_id'], item['rule_key'])
+            if key in self._index:
+                self.items[self._index[key]] = item
+            else:
+                self._index[key] = len(self.items)
+                self.items.append(item)
+
+    def remove(self, key):
+        with self._lock:
+            self.items = [i for i in self.items if (i['farm_id'], i['rule_key']) != (key['farm_id'], key['rule_key'])]
+            self._index = None
+
+    def scan(self, ProjectionExpression=None, ExclusiveStartKey=None, **kwargs):
+        self.calls['scan'] += 1
+        start = ExclusiveStartKey['index'] if ExclusiveStartKey else 0
+        attributes = [a.strip() for a in ProjectionExpression.split(',')] if ProjectionExpression else None
+        page, read = [], 0
+        index = start
+        while index < len(self.items) and read < PAGE_BYTES:
+            item = self.items[index]
+            read += _size(item)
+            page.append({a: item[a] for a in attributes if a in item} if attributes else item)
+            index += 1
+        response = {'Items': page, 'Count': len(page),
+                    'ConsumedCapacity': {'TableName': 'WeatherRules', 'CapacityUnits': _capacity(read)}}
+        if index < len(self.items):
+            response['LastEvaluatedKey'] = {'index': index}
+        return response
+
+
+class StubDynamoDB:
+    """Stand-in for boto3.resource('dynamodb') holding StubRulesTables.
+
+    Every put_item, delete_item and batch_write_item call sleeps for latency seconds.
+    Every throttle_every-th BatchWriteItem call fails with
+    ProvisionedThroughputExceededException and every unprocessed_every-th
+    item comes back in UnprocessedItems, as DynamoDB does under load.
+    """
+
+    def __init__(self, latency=0.01, throttle_every=0, unprocessed_every=0):
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.unprocessed_every = unprocessed_every
+        self.tables = {}
+        self.calls = {'batch_write_item': 0}
+        self._items_seen = 0
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = StubRulesTable(name=name)
+            self.tables[name].on_write = lambda: time.sleep(self.latency)
+        return self.tables[name]
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.calls['batch_write_item'] += 1
+        time.sleep(self.latency)
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise ClientError({'Error': {'Code': 'ValidationException',
+                                         'Message': 'Too many items requested for the BatchWriteItem call'}},
+                              'BatchWriteItem')
+        if self.throttle_every and self.calls['batch_write_item'] % self.throttle_every == 0:
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'stub throttle'}},
+                              'BatchWriteItem')
+        unprocessed = {}
+        for name, requests in RequestItems.items():
+            table = self.Table(name)
+            keys = [(key['farm_id'], key['rule_key'])
+                    for key in (r['PutRequest']['Item'] if 'PutRequest' in r else r['DeleteRequest']['Key']
+                                for r in requests)]
+            if len(set(keys)) < len(keys):
+                raise ClientError({'Error': {'Code': 'ValidationException',
+                                             'Message': 'Provided list of item keys contains duplicates'}},
+                                  'BatchWriteItem')
+            for request in requests:
+                self._items_seen += 1
+                if self.unprocessed_every and self._items_seen % self.unprocessed_every == 0:
+                    unprocessed.setdefault(name, []).append(request)
+                elif 'PutRequest' in request:
+                    table.store(request['PutRequest']['Item'])
+                else:
+                    table.remove(request['DeleteRequest']['Key'])
+        return {'UnprocessedItems': unprocessed}
@@ -0,0 +1,113 @@
+"""Local stand-in for the SNS query API, with injected per-call latency.
+
+Handles Publish and PublishBatch the way boto3 sends them (form-encoded
+POST, XML response), so a real ``boto3.client('sns', endpoint_url=...)``
+can be pointed at it and every serialisation and HTTP cost is still paid.
+Counts calls and messages; ``fail_every`` makes every Nth batch entry fail
+to exercise the partial-failure path. InProcessSNS skips HTTP entirely.
+"""
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import boto3
+
+NAMESPACE = 'http://sns.amazonaws.com/doc/2010-03-31/'
+
+
+class StubSNS:
+    def __init__(self, latency=0.05, fail_every=0):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.calls = {'Publish': 0, 'PublishBatch': 0}
+        self.messages = 0
+        self._entries = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+                action = form['Action'][0]
+                time.sleep(stub.latency)
+                body = stub.respond(action, form).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def respond(self, action, form):
+        request_id = f"<ResponseMetadata><RequestId>{uuid.uuid4()}</RequestId></ResponseMetadata>"
+        with self._lock:
+            self.calls[action] = self.calls.get(action, 0) + 1
+        if action == 'Publish':
+            with self._lock:
+                self.messages += 1
+            return (f'<PublishResponse xmlns="{NAMESPACE}"><PublishResult><MessageId>{uuid.uuid4()}</MessageId>'
+                    f'</PublishResult>{request_id}</PublishResponse>')
+
+        ids = [form[key][0] for key in sorted(form) if key.startswith('PublishBatchRequestEntries.member.')
+               and key.endswith('.Id')]
+        successful, failed = [], []
+        for entry_id in ids:
+            with self._lock:
+                self._entries += 1
+                fail = self.fail_every and self._entries % self.fail_every == 0
+                if not fail:
+                    self.messages += 1
+            if fail:
+                failed.append(f"<member><Id>{entry_id}</Id><Code>InternalError</Code><Message>stub failure</Message>"
+                              f"<SenderFault>false</SenderFault></member>")
+            else:
+                successful.append(f"<member><Id>{entry_id}</Id><MessageId>{uuid.uuid4()}</MessageId></member>")
+        return (f'<PublishBatchResponse xmlns="{NAMESPACE}"><PublishBatchResult>'
+                f'<Successful>{"".join(successful)}</Successful><Failed>{"".join(failed)}</Failed>'
+                f'</PublishBatchResult>{request_id}</PublishBatchResponse>')
+
+    def client(self):
+        """A boto3 SNS client talking to this stub."""
+        return boto3.client('sns', endpoint_url=self.url, region_name='ap-south-1',
+                            aws_access_key_id='stub', aws_secret_access_key='stub')
+
+    def reset(self):
+        with self._lock:
+            self.calls = {'Publish': 0, 'PublishBatch': 0}
+            self.messages = 0
+            self._entries = 0
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class InProcessSNS:
+    """SNS client stand-in that records calls in memory, for benchmarks that time the caller, not HTTP."""
+
+    def __init__(self):
+        self.calls = {'Publish': 0, 'PublishBatch': 0}
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def publish(self, **kwargs):
+        with self._lock:
+            self.calls['Publish'] += 1
+            self.messages += 1
+        return {'MessageId': str(uuid.uuid4())}
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        with self._lock:
+            self.calls['PublishBatch'] += 1
+            self.messages += len(PublishBatchRequestEntries)
+        return {'Successful': [{'Id': entry['Id'], 'MessageId': str(uuid.uuid4())}
+                               for entry in PublishBatchRequestEntries], 'Failed': []}
@@ -0,0 +1,186 @@
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+import psycopg2
+from psycopg2.extras import execute_values
+
+import telemetry
+from planner import THRESHOLD_OPERATORS, to_number
+
+_COLUMNS = ('rule_id', 'farm_id', 'stakeholder', 'active', 'first_fired_at', 'last_fired_at', 'last_notified_at',
+            'consecutive', 'fingerprint', 'severity', 'notify_count')
+# Written when a rule notifies, restored if the notification was not delivered
+_NOTIFY_FIELDS = ('last_notified_at', 'severity', 'fingerprint', 'notify_count')
+
+
+def _threshold_leaves(conditions):
+    """Latest-value leaves (no temporal clause) whose exceedance can be measured."""
+    if isinstance(conditions, list):
+        for cond in conditions:
+            yield from _threshold_leaves(cond)
+    elif isinstance(conditions, dict):
+        if 'metric' in conditions:
+            if conditions.get('operator') in THRESHOLD_OPERATORS and not conditions.get('temporal'):
+                yield conditions
+        elif conditions.get('operator') in ('AND', 'OR'):
+            yield from _threshold_leaves(conditions.get('sub_conditions', []))
+
+
+def severity(conditions, data):
+    """How far the latest values sit beyond their thresholds, relative to each threshold; None if unmeasurable."""
+    worst = None
+    for leaf in _threshold_leaves(conditions):
+        value, threshold = data.get(leaf['metric']), to_number(leaf.get('value'))
+        if value is None or not isinstance(threshold, (int, float)):
+            continue
+        if leaf['operator'] in ('>', '>='):
+            excess = value - threshold
+        elif leaf['operator'] in ('<', '<='):
+            excess = threshold - value
+        else:
+            continue
+        excess /= max(abs(threshold), 1.0)
+        worst = excess if worst is None else max(worst, excess)
+    return worst
+
+
+def values_fingerprint(conditions, data):
+    values = {}
+    for leaf in _threshold_leaves(conditions):
+        value = data.get(leaf['metric'])
+        values[leaf['metric']] = round(float(value), 2) if value is not None else None
+    payload = json.dumps(values, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class AlertStateStore:
+    """Decides whether a triggered rule should notify, from the alert_state table.
+
+    A rule notifies when it enters the alert state (after debounce_runs
+    consecutive matching runs), when its latest values move at least
+    escalation_step further past their thresholds than at the last
+    notification, or when cooldown has passed since it last notified. A run
+    in which the rule does not match resolves the alert. States for every
+    farm in the invocation are read with one query and written back with
+    one batched upsert, after dispatch, so notifications SNS did not accept
+    are retried on the next run. If the table is missing, every match
+    notifies.
+    """
+
+    def __init__(self, enabled=True, cooldown_minutes=360, debounce_runs=1, escalation_step=0.1):
+        self.enabled = enabled
+        self.cooldown = timedelta(minutes=cooldown_minutes)
+        self.debounce_runs = max(1, debounce_runs)
+        self.escalation_step = escalation_step
+        self.now = datetime.now(timezone.utc)
+        self.states = {}
+        self.dirty = set()
+        self.previous = {}
+        self.notified = 0
+        self.suppressed = 0
+        self.resolved = 0
+
+    def load(self, cursor, farm_ids):
+        if not self.enabled or not farm_ids:
+            return
+        try:
+            cursor.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM alert_state WHERE farm_id = ANY(%s)",
+                (list(farm_ids),)
+            )
+            for row in cursor.fetchall():
+                self.states[(row['rule_id'], row['farm_id'], row['stakeholder'])] = dict(row)
+        except psycopg2.Error as e:
+            telemetry.warning("Alert state disabled: %s", e)
+            cursor.connection.rollback()
+            self.enabled = False
+
+    def should_notify(self, rule, farm_id, stakeholder, data):
+        if not self.enabled:
+            return True
+        key = (rule['rule_id'], farm_id, stakeholder)
+        state = self.states.get(key)
+        if state is None or not state['active']:
+            previous = state or {'last_notified_at': None, 'notify_count': 0}
+            state = {
+                'rule_id': rule['rule_id'], 'farm_id': farm_id, 'stakeholder': stakeholder, 'active': True,
+                'first_fired_at': self.now, 'last_notified_at': previous['last_notified_at'], 'consecutive': 0,
+                'fingerprint': None, 'severity': None, 'notify_count': previous['notify_count']
+            }
+            self.states[key] = state
+        state['consecutive'] += 1
+        state['last_fired_at'] = self.now
+        self.dirty.add(key)
+
+        conditions = rule.get('conditions', [])
+        level = severity(conditions, data) if data else None
+        notified_this_episode = (state['last_notified_at'] is not None
+                                 and state['last_notified_at'] >= state['first_fired_at'])
+        if not notified_this_episode:
+            reason = 'new' if state['consecutive'] >= self.debounce_runs else None
+        elif level is not None and state['severity'] is not None and level >= state['severity'] + self.escalation_step:
+            reason = 'escalation'
+        elif self.now - state['last_notified_at'] >= self.cooldown:
+            reason = 'cooldown'
+        else:
+            reason = None
+
+        if reason is None:
+            self.suppressed += 1
+            telemetry.debug("Rule %s still active for %s/%s: notification suppressed", rule['rule_id'], farm_id, stakeholder)
+            return False
+        telemetry.info("Rule %s notifying for %s/%s (%s)", rule['rule_id'], farm_id, stakeholder, reason)
+        self.previous[key] = {field: state[field] for field in _NOTIFY_FIELDS}
+        state['last_notified_at'] = self.now
+        state['severity'] = level
+        state['fingerprint'] = values_fingerprint(conditions, data or {})
+        state['notify_count'] += 1
+        self.notified += 1
+        return True
+
+    def resolve(self, rule, farm_id, stakeholder):
+        """The rule did not match: the next match is a fresh alert."""
+        if not self.enabled:
+            return
+        key = (rule['rule_id'], farm_id, stakeholder)
+        state = self.states.get(key)
+        if state is not None and state['active']:
+            state['active'] = False
+            state['consecutive'] = 0
+            self.dirty.add(key)
+            self.resolved += 1
+
+    def not_delivered(self, items):
+        """Undo the notification record for dispatcher items SNS did not accept."""
+        for item in items:
+            key = (item['rule']['rule_id'], item['farm_id'], item['stakeholder'])
+            previous = self.previous.pop(key, None)
+            if previous is not None:
+                self.states[key].update(previous)
+                self.notified -= 1
+                telemetry.warning("Rule %s notification for %s/%s not delivered: will retry", *key)
+
+    def save(self, cursor):
+        if not self.enabled or not self.dirty:
+            return
+        rows = [tuple(self.states[key][column] for column in _COLUMNS) for key in sorted(self.dirty)]
+        try:
+            execute_values(
+                cursor,
+                f"""
+                INSERT INTO alert_state ({', '.join(_COLUMNS)})
+                VALUES %s
+                ON CONFLICT (rule_id, farm_id, stakeholder) DO UPDATE SET
+                    {', '.join(f'{c} = EXCLUDED.{c}' for c in _COLUMNS[3:])}
+                """,
+                rows,
+                page_size=500
+            )
+            cursor.connection.commit()
+        except psycopg2.Error as e:
+            telemetry.error("Failed to save alert state: %s", e)
+            cursor.connection.rollback()
+        self.dirty = set()
+
+    def stats(self):
+        return {'alerts_notified': self.notified, 'alerts_suppressed': self.suppressed, 'alerts_resolved': self.resolved}
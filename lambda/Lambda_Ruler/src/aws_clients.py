@@ -0,0 +1,76 @@
+"""AWS clients built on first use instead of at import.
+
+Importing boto3 and building a DynamoDB resource and an SNS client is a
+large share of a 128 MB cold start, and invocations served from the rule
+cache never need DynamoDB (nor SNS when nothing triggers). Lazy() stands
+in for a client until an attribute is first read, so the module-level
+names keep working, including being replaced by stand-ins in benchmarks.
+
+rules_table() returns the boto3 Table resource or, by default, ClientTable:
+the same query() calls answered by the low-level client, which skips
+loading the resource model. Values go through boto3's own serializer and
+deserializer, so items come back with the same types (numbers as Decimal).
+"""
+import threading
+
+
+class Lazy:
+    """Proxy for the object factory() returns, built on first attribute access."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self):
+        return self._target is not None
+
+    def __getattr__(self, name):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return getattr(self._target, name)
+
+
+def client(service):
+    import boto3
+    return boto3.client(service)
+
+
+class ClientTable:
+    """The query() of a boto3 Table resource on top of the low-level DynamoDB client."""
+
+    def __init__(self, name, dynamodb=None):
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+        self.name = name
+        self.client = dynamodb or client('dynamodb')
+        self._serialize = TypeSerializer().serialize
+        self._deserialize = TypeDeserializer().deserialize
+
+    def _to_wire(self, values):
+        return {k: self._serialize(v) for k, v in values.items()}
+
+    def _from_wire(self, item):
+        return {k: self._deserialize(v) for k, v in item.items()}
+
+    def query(self, **kwargs):
+        for name in ('ExpressionAttributeValues', 'ExclusiveStartKey'):
+            if name in kwargs:
+                kwargs[name] = self._to_wire(kwargs[name])
+        response = self.client.query(TableName=self.name, **kwargs)
+        response['Items'] = [self._from_wire(item) for item in response.get('Items', [])]
+        if 'LastEvaluatedKey' in response:
+            response['LastEvaluatedKey'] = self._from_wire(response['LastEvaluatedKey'])
+        return response
+
+
+def rules_table(name, api='client'):
+    """Lazy ClientTable for name, or the boto3 Table resource when api is 'resource'."""
+    if api == 'resource':
+        def factory():
+            import boto3
+            return boto3.resource('dynamodb').Table(name)
+        return Lazy(factory)
+    return Lazy(lambda: ClientTable(name))
@@ -0,0 +1,144 @@
+"""Cost-aware evaluation order for the children of AND / OR nodes.
+
+Every condition node gets a cost class: a scalar comparison against the
+latest row, a windowed aggregate (temporal COUNT, RATE>, DAY_DIFF> day
+averages) or a multi-query SEQUENCE, each with a relative cost. Within an
+AND the children run in ascending cost / P(false), within an OR in
+ascending cost / P(true), so whatever is cheapest and most likely to
+decide the group runs first and the rest is skipped. P is the smoothed
+fraction of evaluations in which the node matched for that farm, kept in a
+bounded LRU at module level so it is refined across warm invocations;
+without history the order is by cost alone, ties in the authored order.
+
+Leaves have no side effects beyond their queries, so the verdict does not
+depend on the order; only which children get evaluated does.
+"""
+import json
+from collections import OrderedDict
+
+import telemetry
+
+# Relative cost of one evaluation per node kind; SEQUENCE is per step
+NODE_COSTS = {'false': 0, 'latest': 1, 'rate': 10, 'count': 20, 'day_diff': 40, 'seq': 50}
+COST_CLASSES = {'false': 'scalar', 'latest': 'scalar', 'rate': 'aggregate', 'count': 'aggregate',
+                'day_diff': 'aggregate', 'seq': 'sequence'}
+_CLASS_RANK = {'scalar': 0, 'aggregate': 1, 'sequence': 2}
+
+
+def _raw_kind(condition):
+    """The plan node kind a raw condition compiles to (see rule_plan.py)."""
+    if 'metric' in condition:
+        operator = condition.get('operator')
+        if operator == 'RATE>':
+            return 'rate'
+        if operator == 'DAY_DIFF>':
+            return 'day_diff'
+        return 'count' if condition.get('temporal') else 'latest'
+    return {'AND': 'all', 'OR': 'any', 'NOT': 'not', 'SEQUENCE': 'seq'}.get(condition.get('operator'), 'false')
+
+
+def node_cost(node, raw=False):
+    """(relative cost, cost class) of a compiled plan node, or of a raw condition when raw."""
+    if raw and isinstance(node, list):
+        children, kind = node, 'all'
+    else:
+        kind = _raw_kind(node) if raw else node['op']
+        if kind in ('all', 'any'):
+            children = node.get('sub_conditions', []) if raw else node['args']
+        elif kind == 'not':
+            sub_conditions = node.get('sub_conditions', [])
+            if raw and not sub_conditions:
+                return 0, 'scalar'
+            return node_cost(sub_conditions[0] if raw else node['arg'], raw)
+        elif kind == 'seq':
+            steps = len(node.get('sub_conditions', []) if raw else node['steps'])
+            return NODE_COSTS['seq'] * max(steps, 1), 'sequence'
+        else:
+            return NODE_COSTS[kind], COST_CLASSES[kind]
+    costs = [node_cost(child, raw) for child in children]
+    return sum(cost for cost, _ in costs), max((cls for _, cls in costs), key=_CLASS_RANK.get, default='scalar')
+
+
+class ConditionOrder:
+    """Orders AND / OR children by cost and observed selectivity, and counts the expensive nodes it skipped.
+
+    Node keys and costs are memoized per node object, which lives as long
+    as its rule stays in the rule cache; selectivity is keyed by farm and
+    node content, so it outlives rule cache refreshes.
+    """
+
+    def __init__(self, enabled=True, max_nodes=4096):
+        self.enabled = enabled
+        self.max_nodes = max_nodes
+        self._selectivity = OrderedDict()
+        self._nodes = {}
+        self.begin()
+
+    def begin(self):
+        """Reset the per-invocation counters; selectivity is kept."""
+        self.groups_reordered = 0
+        self.nodes_skipped = 0
+        self.expensive_nodes_skipped = 0
+
+    def _info(self, node, raw):
+        entry = self._nodes.get(id(node))
+        if entry is None or entry[0] is not node:
+            if len(self._nodes) >= 4 * self.max_nodes:
+                self._nodes.clear()
+            cost, cls = node_cost(node, raw)
+            entry = (node, json.dumps(node, sort_keys=True, default=str), cost, cls)
+            self._nodes[id(node)] = entry
+        return entry
+
+    def _match_rate(self, key):
+        evaluations, matches = self._selectivity.get(key, (0, 0))
+        return (matches + 1) / (evaluations + 2)
+
+    def order(self, children, conjunction, farm_id, raw=False):
+        """children in evaluation order for an AND (conjunction) or OR node."""
+        def rank(indexed):
+            index, child = indexed
+            _, content, cost, _ = self._info(child, raw)
+            match_rate = self._match_rate((farm_id, content))
+            decides = 1 - match_rate if conjunction else match_rate
+            return cost / decides, index
+
+        ordered = [child for _, child in sorted(enumerate(children), key=rank)]
+        if any(a is not b for a, b in zip(ordered, children)):
+            self.groups_reordered += 1
+        return ordered
+
+    def record(self, child, farm_id, matched, raw=False):
+        key = (farm_id, self._info(child, raw)[1])
+        evaluations, matches = self._selectivity.pop(key, (0, 0))
+        self._selectivity[key] = (evaluations + 1, matches + bool(matched))
+        while len(self._selectivity) > self.max_nodes:
+            self._selectivity.popitem(last=False)
+
+    def evaluate(self, children, conjunction, farm_id, evaluate, raw=False):
+        """all() (conjunction) or any() of evaluate(child) over children, in cost order, recording each outcome."""
+        ordered = self.order(children, conjunction, farm_id, raw) if self.enabled and len(children) > 1 else children
+        for i, child in enumerate(ordered):
+            matched = bool(evaluate(child))
+            if self.enabled:
+                self.record(child, farm_id, matched, raw)
+            if matched != conjunction:
+                self._skipped(ordered[i + 1:], raw)
+                return matched
+        return conjunction
+
+    def _skipped(self, children, raw):
+        if not children:
+            return
+        expensive = sum(1 for child in children if self._info(child, raw)[3] != 'scalar')
+        self.nodes_skipped += len(children)
+        self.expensive_nodes_skipped += expensive
+        telemetry.count('expensive_nodes_skipped', expensive)
+
+    def stats(self):
+        return {
+            'groups_reordered': self.groups_reordered,
+            'nodes_skipped': self.nodes_skipped,
+            'expensive_nodes_skipped': self.expensive_nodes_skipped,
+            'selectivity_entries': len(self._selectivity)
+        }
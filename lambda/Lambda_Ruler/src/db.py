@@ -0,0 +1,91 @@
+import time
+import threading
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+
+class ConnectionManager:
+    """Keeps one Postgres connection alive across warm Lambda invocations.
+
+    get() hands back the cached connection when it still looks healthy and
+    reconnects otherwise; release() ends any open transaction but keeps the
+    connection for the next invocation. Connections idle for longer than
+    validate_after seconds are pinged with SELECT 1 before reuse, since a
+    frozen container cannot notice RDS dropping the socket.
+    """
+
+    def __init__(self, statement_timeout_ms=30000, validate_after=30, pool_size=4, **connect_kwargs):
+        self.connect_kwargs = dict(connect_kwargs)
+        options = self.connect_kwargs.pop('options', '')
+        self.connect_kwargs['options'] = f"{options} -c statement_timeout={int(statement_timeout_ms)}".strip()
+        self.connect_kwargs.setdefault('connect_timeout', 5)
+        self.connect_kwargs.setdefault('keepalives', 1)
+        self.connect_kwargs.setdefault('keepalives_idle', 30)
+        self.validate_after = validate_after
+        self.pool_size = pool_size
+        self._conn = None
+        self._last_used = 0.0
+        self._pool = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - self._last_used < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def get(self):
+        if self._conn is not None and self._healthy(self._conn):
+            self.hits += 1
+        else:
+            if self._conn is not None:
+                self.reconnects += 1
+                self.discard()
+            self.misses += 1
+            self._conn = psycopg2.connect(**self.connect_kwargs)
+        self._last_used = time.monotonic()
+        return self._conn
+
+    def release(self, conn, broken=False):
+        """Return the connection for reuse, rolling back anything left open."""
+        if conn is None or conn.closed:
+            return
+        if broken:
+            self.discard()
+            return
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._last_used = time.monotonic()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.discard()
+
+    def discard(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+        self._conn = None
+
+    def pool(self):
+        """Small thread-safe pool for paths that talk to Postgres from several threads."""
+        with self._lock:
+            if self._pool is None or self._pool.closed:
+                self._pool = pg_pool.ThreadedConnectionPool(1, self.pool_size, **self.connect_kwargs)
+            return self._pool
+
+    def stats(self):
+        return {'connection_hits': self.hits, 'connection_misses': self.misses, 'reconnects': self.reconnects}
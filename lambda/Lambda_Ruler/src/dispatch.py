@@ -0,0 +1,139 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+
+# SNS PublishBatch limits
+BATCH_SIZE = 10
+SUBJECT_LIMIT = 100
+
+
+class NotificationDispatcher:
+    """Collects triggered actions during evaluation and sends them once it is done.
+
+    Topic messages go out with PublishBatch, up to ten per call, from a small
+    thread pool; SMS actions carrying a phone_number are published directly
+    to that number, since PublishBatch only targets topics. With digest=True
+    every alert for a (farm_id, stakeholder, channel) in one run is merged
+    into a single message. Items whose message SNS did not accept are left
+    in undelivered after flush().
+    """
+
+    def __init__(self, sns, email_topic_arn, sms_topic_arn=None, digest=False, workers=4):
+        self.sns = sns
+        self.email_topic_arn = email_topic_arn
+        self.sms_topic_arn = sms_topic_arn
+        self.digest = digest
+        self.workers = workers
+        self.pending = []
+        self.undelivered = []
+        self.calls = 0
+        self.sent = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def collect(self, farm_id, stakeholder, rule, action):
+        self.pending.append({'farm_id': farm_id, 'stakeholder': stakeholder, 'rule': rule, 'action': action})
+
+    def _destination(self, action):
+        """('topic', arn) / ('phone', number) for an action, or None when it has nowhere to go."""
+        if action['type'] == 'email':
+            return ('topic', self.email_topic_arn)
+        if action['type'] == 'sms':
+            if action.get('phone_number'):
+                return ('phone', action['phone_number'])
+            if self.sms_topic_arn:
+                return ('topic', self.sms_topic_arn)
+        return None
+
+    def _messages(self):
+        """Group pending actions by destination and turn them into (destination, subject, message, items)."""
+        groups = {}
+        for item in self.pending:
+            destination = self._destination(item['action'])
+            if destination is None:
+                telemetry.info("SMS action triggered: %s (no SMS destination configured)", item['action']['message'])
+                continue
+            key = (destination, item['farm_id'], item['stakeholder']) if self.digest else (destination, len(groups))
+            groups.setdefault(key, []).append(item)
+
+        messages = []
+        for (destination, *_), items in groups.items():
+            farm_id = items[0]['farm_id']
+            if len(items) == 1:
+                subject = f"Weather Alert: Rule {items[0]['rule']['name']} Triggered for {farm_id}"
+                message = items[0]['action']['message']
+            else:
+                subject = f"Weather Alert: {len(items)} rules triggered for {farm_id}"
+                message = '\n'.join(f"- {item['rule']['name']}: {item['action']['message']}" for item in items)
+            messages.append((destination, subject[:SUBJECT_LIMIT], message, items))
+        return messages
+
+    def _publish_batch(self, topic_arn, messages):
+        """(sent count, messages not accepted) for up to ten messages to one topic."""
+        entries = [{'Id': str(i), 'Message': message, 'Subject': subject}
+                   for i, (_, subject, message, _) in enumerate(messages)]
+        try:
+            with telemetry.span('sns_publish'):
+                response = self.sns.publish_batch(TopicArn=topic_arn, PublishBatchRequestEntries=entries)
+        except Exception as e:
+            telemetry.error("Error sending SNS batch to %s: %s", topic_arn, e)
+            return 0, messages
+        accepted = {entry.get('Id') for entry in response.get('Successful', [])}
+        for failure in response.get('Failed', []):
+            telemetry.error("SNS batch entry %s failed: %s %s", failure.get('Id'), failure.get('Code'), failure.get('Message'))
+        return len(accepted), [message for i, message in enumerate(messages) if str(i) not in accepted]
+
+    def _publish_sms(self, phone_number, message):
+        try:
+            with telemetry.span('sns_publish'):
+                self.sns.publish(PhoneNumber=phone_number, Message=message[2])
+            return 1, []
+        except Exception as e:
+            telemetry.error("Error sending SMS to %s: %s", phone_number, e)
+            return 0, [message]
+
+    def flush(self):
+        """Send everything collected so far; returns dispatch stats for the response.
+
+        Items behind messages that failed are collected in self.undelivered.
+        """
+        started = time.perf_counter()
+        messages = self._messages()
+        jobs = []
+        by_topic = {}
+        for message in messages:
+            kind, target = message[0]
+            if kind == 'phone':
+                jobs.append((self._publish_sms, target, message))
+            else:
+                by_topic.setdefault(target, []).append(message)
+        for topic_arn, topic_messages in by_topic.items():
+            for i in range(0, len(topic_messages), BATCH_SIZE):
+                jobs.append((self._publish_batch, topic_arn, topic_messages[i:i + BATCH_SIZE]))
+
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(jobs))) as pool:
+                outcomes = list(pool.map(lambda job: job[0](job[1], job[2]), jobs))
+            sent = sum(ok for ok, _ in outcomes)
+            failed = [message for _, failures in outcomes for message in failures]
+            self.undelivered.extend(item for message in failed for item in message[3])
+            self.calls += len(jobs)
+            self.sent += sent
+            self.failed += len(failed)
+            telemetry.count('sns_calls', len(jobs))
+            telemetry.count('notifications_sent', sent)
+            telemetry.count('notifications_failed', len(failed))
+            telemetry.info("Dispatched %d notification(s) for %d action(s) in %d SNS call(s)",
+                           len(messages), len(self.pending), len(jobs))
+        self.pending = []
+        self.seconds += time.perf_counter() - started
+        return self.stats()
+
+    def stats(self):
+        return {
+            'sns_calls': self.calls,
+            'notifications_sent': self.sent,
+            'notifications_failed': self.failed,
+            'dispatch_seconds': round(self.seconds, 3)
+        }
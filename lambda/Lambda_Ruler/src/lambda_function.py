@@ -1,11 +1,25 @@
 import json
-import boto3
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
+import time
 from datetime import datetime, timedelta
-import dateutil.parser
 from decimal import Decimal
+from db import ConnectionManager
+from rule_cache import RuleCache, parse_numbers
+from watermarks import RuleStateTracker
+from dispatch import NotificationDispatcher
+from alert_state import AlertStateStore
+from condition_order import ConditionOrder
+from reading_buffers import ReadingStore
+import aws_clients
+import vector_eval
+import telemetry
+from rule_plan import usable_plan
+from planner import (
+    TIME_COLUMNS, TABLE_METRICS, COMPARATORS, THRESHOLD_OPERATORS, SEQUENCE_LOOKBACK, RATE_LOOKBACK,
+    CountingCursor, parse_interval, to_number, day_bounds, offset_bounds, utc, plan_window, fetch_windows
+)
 
 # Custom JSON encoder to handle Decimal types
 class DecimalEncoder(json.JSONEncoder):
@@ -14,13 +28,36 @@ class DecimalEncoder(json.JSONEncoder):
             return float(obj) if obj % 1 else int(obj)
         return super(DecimalEncoder, self).default(obj)
 
-# Initialize DynamoDB and SNS clients
-dynamodb = boto3.resource('dynamodb')
-sns = boto3.client('sns')
-rules_table = dynamodb.Table('WeatherRules')
+# Rules table keyed on farm_id and rule_key (stakeholder#priority#rule_id), written by the rule API
+RULES_TABLE = os.environ.get('RULES_TABLE', 'WeatherRulesV2')
+# Index on data_type and type_key (farm_id#rule_key) for the all-farms target listing
+RULES_DATA_TYPE_INDEX = 'DataTypeIndex'
+RULE_DATA_TYPES = ('forecast', 'current')
+# 'client' queries rules through the low-level DynamoDB client, which loads faster than 'resource' (the Table resource)
+DYNAMODB_API = os.environ.get('DYNAMODB_API', 'client')
+
+# DynamoDB and SNS clients, built on first use rather than during init (aws_clients.py)
+sns = aws_clients.Lazy(lambda: aws_clients.client('sns'))
+rules_table = aws_clients.rules_table(RULES_TABLE, DYNAMODB_API)
+
+# Leveled logs (LOG_LEVEL) and per-invocation EMF metrics, see telemetry.py
+telemetry.configure(service='RulesEngine')
 
 # SNS Topic ARN
 SNS_TOPIC_ARN = 'arn:aws:sns:ap-south-1:580075786360:weather-alerts'
+# Topic with SMS subscribers for sms actions without their own phone_number; unset keeps them log-only
+SMS_TOPIC_ARN = os.environ.get('SMS_TOPIC_ARN')
+# Merge all alerts for a (farm_id, stakeholder) in one run into a single message per channel
+ALERT_DIGEST = os.environ.get('ALERT_DIGEST', 'false').lower() == 'true'
+# Threads sending PublishBatch calls once evaluation is done
+DISPATCH_WORKERS = int(os.environ.get('DISPATCH_WORKERS', '4'))
+# Notify only on entering the alert state, on escalation, or once the cooldown has passed
+ALERT_STATE = os.environ.get('ALERT_STATE', 'true').lower() == 'true'
+ALERT_COOLDOWN_MINUTES = int(os.environ.get('ALERT_COOLDOWN_MINUTES', '360'))
+# Consecutive matching runs before a new alert notifies
+ALERT_DEBOUNCE_RUNS = int(os.environ.get('ALERT_DEBOUNCE_RUNS', '1'))
+# Extra distance past the threshold, as a fraction of it, that counts as an escalation
+ALERT_ESCALATION_STEP = float(os.environ.get('ALERT_ESCALATION_STEP', '0.1'))
 
 # Load database credentials from environment variables
 DB_HOST = os.environ.get('DB_HOST')
@@ -28,105 +65,205 @@ DB_PORT = os.environ.get('DB_PORT', '5432')
 DB_NAME = os.environ.get('DB_NAME')
 DB_USER = os.environ.get('DB_USER')
 DB_PASS = os.environ.get('DB_PASSWORD')
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '15000'))
 
-def evaluate_condition(data, condition, table, farm_id, cursor):
-    metric = condition.get('metric')
-    operator = condition.get('operator')
-    value = float(condition.get('value')) if isinstance(condition.get('value'), (Decimal, str)) else condition.get('value')
+# Reused across warm invocations instead of reconnecting every time
+db = ConnectionManager(
+    statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS,
+    dbname=DB_NAME,
+    user=DB_USER,
+    password=DB_PASS,
+    host=DB_HOST,
+    port=DB_PORT,
+    cursor_factory=RealDictCursor
+)
 
-    time_column = 'forecast_for' if table == 'forecast_weather' else 'timestamp'
+# Priority-ordered, pre-parsed rules per (farm_id, stakeholder), kept across warm invocations
+# and invalidated by the DynamoDB stream records this function receives
+RULE_CACHE_TTL_SECONDS = int(os.environ.get('RULE_CACHE_TTL_SECONDS', '300'))
+RULE_CACHE_MAX_ENTRIES = int(os.environ.get('RULE_CACHE_MAX_ENTRIES', '256'))
+rule_cache = RuleCache(ttl=RULE_CACHE_TTL_SECONDS, max_entries=RULE_CACHE_MAX_ENTRIES)
+# Cache key for the all-farms target listing; ('*', data_type) for one data type
+ALL_TARGETS_KEY = ('*', '*')
 
-    if operator == 'RATE>':
-        interval = condition['temporal']['interval']
+# Fetch each farm's weather window once and evaluate every leaf in memory;
+# set to 'false' to fall back to one SQL query per condition leaf
+USE_QUERY_PLANNER = os.environ.get('USE_QUERY_PLANNER', 'true').lower() == 'true'
+# Run rules from the plan the rule API compiled and stored with them (rule_plan.py);
+# 'false' evaluates every rule from its raw conditions
+USE_RULE_PLANS = os.environ.get('USE_RULE_PLANS', 'true').lower() == 'true'
+# Evaluate each farm batch's rules as NumPy array operations when numpy is available
+USE_VECTOR_EVAL = os.environ.get('USE_VECTOR_EVAL', 'true').lower() == 'true'
+# Farms whose windows are fetched and evaluated together; bounds memory at 128 MB
+FARM_BATCH_SIZE = int(os.environ.get('FARM_BATCH_SIZE', '25'))
+# Read DAY_DIFF> day averages from weather_daily_rollups instead of scanning raw rows
+DAILY_ROLLUPS = os.environ.get('DAILY_ROLLUPS', 'true').lower() == 'true'
+# Reuse a rule's stored outcome while no new rows have been ingested for its farm and table
+INCREMENTAL_EVAL = os.environ.get('INCREMENTAL_EVAL', 'true').lower() == 'true'
+# Evaluate AND/OR children cheapest and most likely to decide first, from cost classes and the
+# per-farm match rates kept across warm invocations (condition_order.py); 'false' keeps the authored order
+COST_ORDERING = os.environ.get('COST_ORDERING', 'true').lower() == 'true'
+# LRU bound on the (farm_id, condition) match counts behind that order
+SELECTIVITY_MAX_NODES = int(os.environ.get('SELECTIVITY_MAX_NODES', '4096'))
+condition_order = ConditionOrder(enabled=COST_ORDERING, max_nodes=SELECTIVITY_MAX_NODES)
+# Keep the last READING_BUFFER_HOURS of readings per farm and source in the warm container and only
+# read rows ingested since the previous invocation (reading_buffers.py)
+READING_BUFFERS = os.environ.get('READING_BUFFERS', 'true').lower() == 'true'
+READING_BUFFER_HOURS = int(os.environ.get('READING_BUFFER_HOURS', '24'))
+# Upper bound on readings held across all farms; least recently used farms are dropped first
+READING_BUFFER_MAX_READINGS = int(os.environ.get('READING_BUFFER_MAX_READINGS', '200000'))
+reading_store = ReadingStore(enabled=READING_BUFFERS, hours=READING_BUFFER_HOURS,
+                             max_readings=READING_BUFFER_MAX_READINGS)
+
+def fetch_rate_pairs(metric, table, farm_id, cursor, window=None):
+    """[newest, previous] reading of metric for each source with two in the RATE_LOOKBACK before now."""
+    if window is not None and window.serves(metric, window.now - RATE_LOOKBACK):
+        return window.rate_pairs(metric)
+    time_column = TIME_COLUMNS[table]
+    cursor.execute(
+        f"""
+        SELECT source, {metric}, {time_column} FROM (
+            SELECT source, {metric}, {time_column},
+                   ROW_NUMBER() OVER (PARTITION BY source ORDER BY {time_column} DESC) AS n
+            FROM {table}
+            WHERE farm_id = %s AND {metric} IS NOT NULL
+            AND {time_column} <= NOW() AND {time_column} > NOW() - %s
+        ) recent
+        WHERE n <= 2
+        ORDER BY source, {time_column} DESC
+        """,
+        (farm_id, RATE_LOOKBACK)
+    )
+    pairs = {}
+    for row in cursor.fetchall():
+        pairs.setdefault(row['source'], []).append(row)
+    return [pair for pair in pairs.values() if len(pair) == 2]
+
+def rate_exceeded(metric, expected_rate, table, farm_id, cursor, window=None):
+    """RATE>: whether any source's change between its last two readings, per hour, exceeds expected_rate."""
+    time_column = TIME_COLUMNS[table]
+    for newest, previous in fetch_rate_pairs(metric, table, farm_id, cursor, window):
+        time_diff = (newest[time_column] - previous[time_column]).total_seconds() / 3600
+        rate = (newest[metric] - previous[metric]) / time_diff if time_diff != 0 else 0
+        telemetry.debug("Rate-of-change for %s from %s: %s vs expected %s", metric, newest['source'], rate,
+                        expected_rate)
+        if rate > expected_rate:
+            return True
+    return False
+
+def fetch_day_average(metric, table, farm_id, cursor, day_start, day_end, window=None):
+    if window is not None:
+        loaded, value = window.day_stat(metric, day_start.date())
+        if loaded:
+            return value
+        if window.serves(metric, utc(day_start)):
+            return window.average(metric, utc(day_start), utc(day_end))
+    if DAILY_ROLLUPS:
         cursor.execute(
-            f"""
-            SELECT {metric}, {time_column} FROM {table}
-            WHERE farm_id = %s AND {time_column} <= NOW()
-            ORDER BY {time_column} DESC
-            LIMIT 2
+            """
+            SELECT SUM(sum_value) / NULLIF(SUM(count), 0) AS avg_value
+            FROM weather_daily_rollups
+            WHERE table_name = %s AND farm_id = %s AND day = %s AND metric = %s
             """,
-            (farm_id,)
+            (table, farm_id, day_start.date(), metric)
         )
-        rows = cursor.fetchall()
-        if len(rows) < 2:
-            return False
-        time_diff = (rows[0][time_column] - rows[1][time_column]).total_seconds() / 3600
-        value_diff = rows[0][metric] - rows[1][metric]
-        rate = value_diff / time_diff if time_diff != 0 else 0
+        return cursor.fetchone()['avg_value']
+    time_column = TIME_COLUMNS[table]
+    cursor.execute(
+        f"""
+        SELECT AVG({metric}) as avg_value
+        FROM {table}
+        WHERE farm_id = %s AND {time_column} BETWEEN %s AND %s
+        """,
+        (farm_id, day_start, day_end)
+    )
+    return cursor.fetchone()['avg_value']
+
+def count_matching(metric, operator, value, duration, table, farm_id, cursor, window=None, seconds=None):
+    if window is not None and operator in COMPARATORS:
+        span = parse_interval(duration) if seconds is None else timedelta(seconds=seconds)
+        if span is not None and window.serves(metric, window.now - span):
+            return window.count_matching(metric, operator, value, window.now - span)
+    time_column = TIME_COLUMNS[table]
+    cursor.execute(
+        f"""
+        SELECT COUNT(*) FROM {table}
+        WHERE {metric} {operator} %s
+        AND {time_column} > NOW() - INTERVAL %s
+        AND farm_id = %s
+        """,
+        (value, duration, farm_id)
+    )
+    return cursor.fetchone()['count']
+
+def first_matching_time(metric, operator, value, table, farm_id, cursor, window=None):
+    time_column = TIME_COLUMNS[table]
+    if window is not None and operator in COMPARATORS:
+        since = window.now - SEQUENCE_LOOKBACK
+        if window.serves(metric, since):
+            row = window.first_matching(metric, operator, value, since)
+            return row[time_column] if row else None
+    cursor.execute(
+        f"""
+        SELECT {time_column} FROM {table}
+        WHERE {metric} {operator} %s
+        AND farm_id = %s
+        AND {time_column} > NOW() - INTERVAL '1 day'
+        ORDER BY {time_column} ASC
+        LIMIT 1
+        """,
+        (value, farm_id)
+    )
+    result = cursor.fetchone()
+    return result[time_column] if result else None
+
+def evaluate_condition(data, condition, table, farm_id, cursor, window=None):
+    metric = condition.get('metric')
+    operator = condition.get('operator')
+    value = to_number(condition.get('value'))
+
+    if operator == 'RATE>':
+        interval = condition['temporal']['interval']
         expected_rate = value / (float(interval.split()[0]) / 60 if 'minute' in interval else float(interval.split()[0]))
-        print(f"Rate-of-change for {metric}: {rate} vs expected {expected_rate}")
-        return rate > expected_rate
+        return rate_exceeded(metric, expected_rate, table, farm_id, cursor, window)
 
     if operator == 'DAY_DIFF>':
         day1 = condition['temporal']['day1']
         day2 = condition['temporal']['day2']
-        now = datetime.utcnow()
-        day1_date = now if day1 == 'today' else now + timedelta(days=1 if day1 == 'tomorrow' else int(day1.split('_')[1]))
-        day2_date = now if day2 == 'today' else now + timedelta(days=1 if day2 == 'tomorrow' else int(day2.split('_')[1]))
-        day1_start = day1_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        day1_end = day1_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-        day2_start = day2_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        day2_end = day2_date.replace(hour=23, minute=59, second=59, microsecond=999999)
+        # Same clock as the planned window, so rollup days and row windows agree
+        now = window.now.replace(tzinfo=None) if window is not None else datetime.utcnow()
+        day1_start, day1_end = day_bounds(day1, now)
+        day2_start, day2_end = day_bounds(day2, now)
 
-        cursor.execute(
-            f"""
-            SELECT AVG({metric}) as avg_value
-            FROM {table}
-            WHERE farm_id = %s AND {time_column} BETWEEN %s AND %s
-            """,
-            (farm_id, day1_start, day1_end)
-        )
-        day1_avg = cursor.fetchone()['avg_value']
+        day1_avg = fetch_day_average(metric, table, farm_id, cursor, day1_start, day1_end, window)
         if day1_avg is None:
-            print(f"No data for {metric} on {day1}")
+            telemetry.debug("No data for %s on %s", metric, day1)
             return False
 
-        cursor.execute(
-            f"""
-            SELECT AVG({metric}) as avg_value
-            FROM {table}
-            WHERE farm_id = %s AND {time_column} BETWEEN %s AND %s
-            """,
-            (farm_id, day2_start, day2_end)
-        )
-        day2_avg = cursor.fetchone()['avg_value']
+        day2_avg = fetch_day_average(metric, table, farm_id, cursor, day2_start, day2_end, window)
         if day2_avg is None:
-            print(f"No data for {metric} on {day2}")
+            telemetry.debug("No data for %s on %s", metric, day2)
             return False
 
         diff = day2_avg - day1_avg
-        print(f"Day diff for {metric}: {day2_avg} - {day1_avg} = {diff} vs threshold {value}")
+        telemetry.debug("Day diff for %s: %s - %s = %s vs threshold %s", metric, day2_avg, day1_avg, diff, value)
         return diff > value
 
-    if condition.get('temporal') and operator in ['>', '<', '=']:
+    if condition.get('temporal') and operator in THRESHOLD_OPERATORS:
         duration = condition['temporal']['duration']
-        cursor.execute(
-            f"""
-            SELECT COUNT(*) FROM {table}
-            WHERE {metric} {operator} %s
-            AND {time_column} > NOW() - INTERVAL %s
-            AND farm_id = %s
-            """,
-            (value, duration, farm_id)
-        )
-        count = cursor.fetchone()['count']
-        print(f"Temporal condition: {metric} {operator} {value} for {duration}, count: {count}")
+        count = count_matching(metric, operator, value, duration, table, farm_id, cursor, window)
+        telemetry.debug("Temporal condition: %s %s %s for %s, count: %s", metric, operator, value, duration, count)
         return count > 0
 
     latest_value = data.get(metric)
     if latest_value is None:
-        print(f"No latest value for {metric}")
+        telemetry.debug("No latest value for %s", metric)
         return False
-    if operator == '>':
-        return latest_value > value
-    elif operator == '<':
-        return latest_value < value
-    elif operator == '=':
-        return latest_value == value
+    if operator in THRESHOLD_OPERATORS:
+        return COMPARATORS[operator](latest_value, value)
     return False
 
-def evaluate_sequence(data, sub_conditions, table, farm_id, cursor):
-    time_column = 'forecast_for' if table == 'forecast_weather' else 'timestamp'
+def evaluate_sequence(data, sub_conditions, table, farm_id, cursor, window=None):
     last_time = None
     max_interval = None
 
@@ -134,162 +271,379 @@ def evaluate_sequence(data, sub_conditions, table, farm_id, cursor):
         if i > 0 and 'within' in sub_conditions[i-1]:
             max_interval = sub_conditions[i-1]['within']
 
-        cursor.execute(
-            f"""
-            SELECT {time_column} FROM {table}
-            WHERE {cond['metric']} {cond['operator']} %s
-            AND farm_id = %s
-            AND {time_column} > NOW() - INTERVAL '1 day'
-            ORDER BY {time_column} ASC
-            LIMIT 1
-            """,
-            (float(cond['value']) if isinstance(cond['value'], (Decimal, str)) else cond['value'], farm_id)
-        )
-        result = cursor.fetchone()
-        if not result:
-            print(f"Sequence condition failed: {cond['metric']} {cond['operator']} {cond['value']} not found")
+        current_time = first_matching_time(cond['metric'], cond['operator'], to_number(cond['value']),
+                                           table, farm_id, cursor, window)
+        if not current_time:
+            telemetry.debug("Sequence condition failed: %s %s %s not found", cond['metric'], cond['operator'], cond['value'])
             return False
 
-        current_time = result[time_column]
         if last_time:
             time_diff = (current_time - last_time).total_seconds() / 60
             if max_interval:
                 max_minutes = float(max_interval.split()[0])
                 if time_diff > max_minutes:
-                    print(f"Sequence failed: Time between events {time_diff} minutes > {max_minutes} minutes")
+                    telemetry.debug("Sequence failed: Time between events %s minutes > %s minutes", time_diff, max_minutes)
                     return False
         last_time = current_time
-    print("Sequence condition passed")
+    telemetry.debug("Sequence condition passed")
     return True
 
-def evaluate_conditions(data, conditions, table, farm_id, cursor):
+def evaluate_conditions(data, conditions, table, farm_id, cursor, window=None):
     if isinstance(conditions, list):
-        return all(evaluate_condition(data, cond, table, farm_id, cursor) for cond in conditions)
+        return condition_order.evaluate(
+            conditions, True, farm_id, lambda cond: evaluate_condition(data, cond, table, farm_id, cursor, window),
+            raw=True
+        )
 
     operator = conditions.get('operator')
     sub_conditions = conditions.get('sub_conditions', [])
 
-    if operator == 'AND':
-        return all(
-            evaluate_condition(data, cond, table, farm_id, cursor) if 'metric' in cond
-            else evaluate_conditions(data, cond, table, farm_id, cursor)
-            for cond in sub_conditions
-        )
-    elif operator == 'OR':
-        return any(
-            evaluate_condition(data, cond, table, farm_id, cursor) if 'metric' in cond
-            else evaluate_conditions(data, cond, table, farm_id, cursor)
-            for cond in sub_conditions
+    if operator in ('AND', 'OR'):
+        return condition_order.evaluate(
+            sub_conditions, operator == 'AND', farm_id,
+            lambda cond: evaluate_condition(data, cond, table, farm_id, cursor, window) if 'metric' in cond
+            else evaluate_conditions(data, cond, table, farm_id, cursor, window),
+            raw=True
         )
     elif operator == 'NOT':
-        return not evaluate_conditions(data, sub_conditions[0], table, farm_id, cursor)
+        return not evaluate_conditions(data, sub_conditions[0], table, farm_id, cursor, window)
     elif operator == 'SEQUENCE':
-        return evaluate_sequence(data, sub_conditions, table, farm_id, cursor)
+        return evaluate_sequence(data, sub_conditions, table, farm_id, cursor, window)
     return False
 
-def lambda_handler(event, context):
-    conn = None
-    cursor = None
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS,
-            host=DB_HOST,
-            port=DB_PORT,
-            cursor_factory=RealDictCursor
-        )
-        cursor = conn.cursor()
-
-        farm_id = 'udaipur_farm1'
-        stakeholder = 'field'
-        data_type = 'forecast'
-
-        if 'Records' in event:
-            for record in event['Records']:
-                if record['eventName'] in ['INSERT', 'MODIFY']:
-                    rule = record['dynamodb']['NewImage']
-                    farm_id = rule['farm_id']['S']
-                    stakeholder = rule['stakeholder']['S']
-                    data_type = rule['data_type']['S']
-        else:
-            farm_id = event.get('farm_id', 'udaipur_farm1')
-            stakeholder = event.get('stakeholder', 'field')
-            data_type = event.get('data_type', 'forecast')
+def evaluate_plan(data, node, table, farm_id, cursor, window=None):
+    """evaluate_conditions() for a compiled plan node (see rule_plan.py); same verdicts, nothing left to parse."""
+    kind = node['op']
+    if kind in ('all', 'any'):
+        return condition_order.evaluate(node['args'], kind == 'all', farm_id,
+                                        lambda child: evaluate_plan(data, child, table, farm_id, cursor, window))
+    if kind == 'not':
+        return not evaluate_plan(data, node['arg'], table, farm_id, cursor, window)
+    if kind == 'latest':
+        latest_value = data.get(node['metric'])
+        if latest_value is None:
+            telemetry.debug("No latest value for %s", node['metric'])
+            return False
+        return COMPARATORS[node['cmp']](latest_value, node['value'])
+    if kind == 'count':
+        # Only whether any row matches decides the verdict, so the window can stop at the first one
+        if window is not None and node['seconds'] is not None and node['cmp'] in COMPARATORS:
+            since = window.now - timedelta(seconds=node['seconds'])
+            if window.serves(node['metric'], since):
+                return window.any_matching(node['metric'], node['cmp'], node['value'], since)
+        count = count_matching(node['metric'], node['cmp'], node['value'], node['duration'], table, farm_id, cursor,
+                               window, node['seconds'])
+        telemetry.debug("Temporal condition: %s %s %s for %s, count: %s", node['metric'], node['cmp'], node['value'],
+                        node['duration'], count)
+        return count > 0
+    if kind == 'rate':
+        return rate_exceeded(node['metric'], node['expected_rate'], table, farm_id, cursor, window)
+    if kind == 'day_diff':
+        metric = node['metric']
+        now = window.now.replace(tzinfo=None) if window is not None else datetime.utcnow()
+        averages = []
+        for offset in (node['day1'], node['day2']):
+            day_start, day_end = offset_bounds(offset, now)
+            average = fetch_day_average(metric, table, farm_id, cursor, day_start, day_end, window)
+            if average is None:
+                telemetry.debug("No data for %s on day +%s", metric, offset)
+                return False
+            averages.append(average)
+        telemetry.debug("Day diff for %s: %s - %s vs threshold %s", metric, averages[1], averages[0], node['value'])
+        return averages[1] - averages[0] > node['value']
+    if kind == 'seq':
+        last_time = None
+        for step in node['steps']:
+            current_time = first_matching_time(step['metric'], step['cmp'], step['value'], table, farm_id, cursor, window)
+            if not current_time:
+                telemetry.debug("Sequence condition failed: %s %s %s not found", step['metric'], step['cmp'], step['value'])
+                return False
+            if last_time and step['within_minutes'] is not None:
+                if (current_time - last_time).total_seconds() / 60 > step['within_minutes']:
+                    return False
+            last_time = current_time
+        return True
+    return False
 
-        table = 'forecast_weather' if data_type == 'forecast' else 'current_weather'
-        time_column = 'forecast_for' if data_type == 'forecast' else 'timestamp'
+def collect_targets(event):
+    """Distinct (farm_id, stakeholder, data_type) targets for this invocation, in arrival order."""
+    targets = []
+    if 'Records' in event:
+        for record in event['Records']:
+            if record['eventName'] in ['INSERT', 'MODIFY']:
+                rule = record['dynamodb']['NewImage']
+                targets.append((rule['farm_id']['S'], rule['stakeholder']['S'], rule['data_type']['S']))
+    elif event.get('all_farms'):
+        targets.extend(load_all_targets(event.get('data_type')))
+    elif 'targets' in event:
+        for target in event['targets']:
+            targets.append((target['farm_id'], target.get('stakeholder', 'field'), target.get('data_type', 'forecast')))
+    else:
+        targets.append((
+            event.get('farm_id', 'udaipur_farm1'),
+            event.get('stakeholder', 'field'),
+            event.get('data_type', 'forecast')
+        ))
+    return list(dict.fromkeys(targets))
 
-        cursor.execute(
-            f"""
-            SELECT temperature_c, humidity_percent, wind_speed_mps, wind_direction_deg,
-                   rainfall_mm, chance_of_rain_percent
-            FROM {table}
-            WHERE {time_column} > NOW() - INTERVAL '1 day'
-            AND farm_id = %s
-            ORDER BY {time_column} DESC LIMIT 1
-            """,
-            (farm_id,)
+def invalidate_rule_cache(event):
+    """Drop cached rules for every key an INSERT/MODIFY/REMOVE stream record touches."""
+    for record in event.get('Records', []):
+        if record.get('eventName') not in ['INSERT', 'MODIFY', 'REMOVE']:
+            continue
+        keys = record['dynamodb'].get('Keys') or record['dynamodb'].get('NewImage', {})
+        if 'farm_id' in keys and 'rule_key' in keys:
+            # rule_key starts with the stakeholder, which cannot contain '#'
+            rule_cache.invalidate((keys['farm_id']['S'], keys['rule_key']['S'].split('#', 1)[0]))
+        for data_type in (None,) + RULE_DATA_TYPES:
+            rule_cache.invalidate(('*', data_type or '*'))
+
+def query_all(**kwargs):
+    """Every item of a rules_table query, following LastEvaluatedKey, and the read units it consumed."""
+    items = []
+    read_units = 0.0
+    while True:
+        response = rules_table.query(ReturnConsumedCapacity='TOTAL', **kwargs)
+        read_units += response.get('ConsumedCapacity', {}).get('CapacityUnits', 0)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items, read_units
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def load_all_targets(data_type=None):
+    """Distinct (farm_id, stakeholder, data_type) with rules, from DataTypeIndex rather than a table scan."""
+    cache_key = ('*', data_type or '*')
+    targets = rule_cache.get(cache_key)
+    if targets is not None:
+        return targets
+    targets = []
+    read_units = 0.0
+    for rule_data_type in ([data_type] if data_type else RULE_DATA_TYPES):
+        items, units = query_all(
+            IndexName=RULES_DATA_TYPE_INDEX,
+            KeyConditionExpression='data_type = :dt',
+            ExpressionAttributeValues={':dt': rule_data_type},
+            ProjectionExpression='farm_id, stakeholder, data_type'
         )
-        data = cursor.fetchone() or {}
-        print(f"Latest weather data: {data}")
+        read_units += units
+        targets.extend((item['farm_id'], item['stakeholder'], item['data_type']) for item in items)
+    targets = list(dict.fromkeys(targets))
+    rule_cache.put(cache_key, targets, read_units)
+    return targets
 
-        response = rules_table.query(
-            IndexName='StakeholderIndex',
-            KeyConditionExpression='farm_id = :fid AND stakeholder = :stake',
-            ExpressionAttributeValues={':fid': farm_id, ':stake': stakeholder}
+def load_rules(farm_id, stakeholder):
+    rules = rule_cache.get((farm_id, stakeholder))
+    if rules is not None:
+        return rules
+    with telemetry.span('rule_load'):
+        # rule_key is stakeholder#priority#rule_id with a zero-padded priority, so items arrive in priority order
+        items, read_units = query_all(
+            KeyConditionExpression='farm_id = :fid AND begins_with(rule_key, :prefix)',
+            ExpressionAttributeValues={':fid': farm_id, ':prefix': stakeholder + '#'}
         )
-        rules = sorted(response['Items'], key=lambda x: int(x['priority']))
-        print("All rules in WeatherRules table:")
+        rules = [parse_numbers(item) for item in items]
+        # Stale, older-version or missing plans are dropped here, so those rules run from raw conditions
         for rule in rules:
-            print(f"Rule ID: {rule['rule_id']}, Name: {rule['name']}, Priority: {rule['priority']}, Conditions: {json.dumps(rule['conditions'], cls=DecimalEncoder)}")
-
-        triggered_actions = []
+            rule['plan'] = usable_plan(rule) if USE_RULE_PLANS else None
+    telemetry.count('rules_loaded', len(rules))
+    telemetry.count('rules_without_plan', sum(1 for rule in rules if rule['plan'] is None))
+    telemetry.info("Loaded %d rule(s) from %s for %s/%s", len(rules), RULES_TABLE, farm_id, stakeholder)
+    if telemetry.enabled('DEBUG'):
         for rule in rules:
-            if rule['data_type'] != data_type:
-                print(f"Rule {rule['rule_id']} skipped: Data type mismatch (expected {data_type}, got {rule['data_type']})")
-                continue
-            conditions = rule.get('conditions', [])
-            if evaluate_conditions(data, conditions, table, farm_id, cursor):
-                print(f"Rule {rule['rule_id']} triggered")
-                actions = rule['actions']
-                for action in actions:
-                    if action['type'] == 'email':
-                        message = action['message']
-                        subject = f"Weather Alert: Rule {rule['name']} Triggered for {farm_id}"
-                        try:
-                            sns_response = sns.publish(
-                                TopicArn=SNS_TOPIC_ARN,
-                                Message=message,
-                                Subject=subject
-                            )
-                            print(f"SNS email sent: {sns_response}")
-                        except Exception as e:
-                            print(f"Error sending SNS email: {str(e)}")
-                    elif action['type'] == 'sms':
-                        print(f"SMS action triggered: {action['message']}")
-                triggered_actions.append({
-                    'rule_id': rule['rule_id'],
-                    'actions': rule['actions']
-                })
-                if rule.get('stop_on_match', True):
-                    print("Stopping evaluation due to stop_on_match")
-                    break
-            else:
-                print(f"Rule {rule['rule_id']} not triggered: Conditions not met")
+            telemetry.debug("Rule ID: %s, Name: %s, Priority: %s, Conditions: %s", rule['rule_id'], rule['name'],
+                            rule['priority'], lambda: json.dumps(rule['conditions']))
+    rule_cache.put((farm_id, stakeholder), rules, read_units)
+    return rules
+
+def fetch_latest(cursor, farm_id, table):
+    time_column = TIME_COLUMNS[table]
+    cursor.execute(
+        f"""
+        SELECT {', '.join(TABLE_METRICS[table])}
+        FROM {table}
+        WHERE {time_column} > NOW() - INTERVAL '1 day'
+        AND farm_id = %s
+        ORDER BY {time_column} DESC, source DESC LIMIT 1
+        """,
+        (farm_id,)
+    )
+    return cursor.fetchone() or {}
+
+def evaluate_rules(rules, data, table, farm_id, data_type, cursor, window=None, vector=None,
+                   tracker=None, stakeholder=None, dispatcher=None, alerts=None):
+    triggered_actions = []
+    for rule in rules:
+        if rule['data_type'] != data_type:
+            telemetry.debug("Rule %s skipped: Data type mismatch (expected %s, got %s)", rule['rule_id'], data_type, rule['data_type'])
+            continue
+        conditions = rule.get('conditions', [])
+        matched = tracker.reusable(rule, farm_id, stakeholder, table) if tracker is not None else None
+        if matched is not None:
+            tracker.skipped += 1
+            telemetry.count('rules_reused')
+            telemetry.debug("Rule %s reused previous result: no new data since last evaluation", rule['rule_id'])
+        else:
+            telemetry.count('rules_evaluated')
+            matched = vector.verdict(conditions, farm_id) if vector is not None else None
+            if matched is None:
+                with telemetry.span('evaluate_conditions'):
+                    if rule.get('plan'):
+                        matched = evaluate_plan(data, rule['plan']['root'], table, farm_id, cursor, window)
+                    else:
+                        matched = evaluate_conditions(data, conditions, table, farm_id, cursor, window)
+            if tracker is not None:
+                tracker.evaluated += 1
+                tracker.record(rule, farm_id, stakeholder, table, matched, window)
+        if matched:
+            telemetry.count('rules_triggered')
+            telemetry.info("Rule %s triggered", rule['rule_id'])
+            # Sent after evaluation by the dispatcher, so SNS latency never stalls the loop
+            notify = alerts is None or alerts.should_notify(rule, farm_id, stakeholder, data)
+            if dispatcher is not None and notify:
+                for action in rule['actions']:
+                    dispatcher.collect(farm_id, stakeholder, rule, action)
+            triggered_actions.append({
+                'rule_id': rule['rule_id'],
+                'actions': rule['actions']
+            })
+            if rule.get('stop_on_match', True):
+                telemetry.debug("Stopping evaluation due to stop_on_match")
+                break
+        else:
+            telemetry.debug("Rule %s not triggered: Conditions not met", rule['rule_id'])
+            if alerts is not None:
+                alerts.resolve(rule, farm_id, stakeholder)
+    return triggered_actions
 
+def evaluate_targets(targets, cursor, tracker=None, dispatcher=None, alerts=None):
+    """Evaluate every target, loading each farm's weather window once per data type."""
+    tracker = tracker or RuleStateTracker(enabled=False)
+    alerts = alerts or AlertStateStore(enabled=False)
+    alerts.load(cursor, list(dict.fromkeys(target[0] for target in targets)))
+    rules_by_stakeholder = {}
+    for farm_id, stakeholder, _ in targets:
+        if (farm_id, stakeholder) not in rules_by_stakeholder:
+            rules_by_stakeholder[(farm_id, stakeholder)] = load_rules(farm_id, stakeholder)
+
+    results = {}
+    for data_type in dict.fromkeys(target[2] for target in targets):
+        group = [target for target in targets if target[2] == data_type]
+        table = 'forecast_weather' if data_type == 'forecast' else 'current_weather'
+        farm_ids = list(dict.fromkeys(target[0] for target in group))
+        tracker.load(cursor, farm_ids, table)
+
+        plan = None
+        if USE_QUERY_PLANNER:
+            all_rules = [rule for target in group for rule in rules_by_stakeholder[(target[0], target[1])]]
+            plan = plan_window(all_rules, data_type, daily=DAILY_ROLLUPS)
+
+        # Farms whose reachable rules can all reuse their stored outcome need no weather data
+        stale = {
+            target[0] for target in group
+            if tracker.needs_window(rules_by_stakeholder[(target[0], target[1])], target[0], target[1], table, data_type)
+        }
+        if tracker.enabled:
+            telemetry.info("%d of %d farm(s) on %s need re-evaluation", len(stale), len(farm_ids), table)
+        farm_ids = [farm_id for farm_id in farm_ids if farm_id in stale]
+
+        for i in range(0, len(farm_ids), FARM_BATCH_SIZE):
+            batch = farm_ids[i:i + FARM_BATCH_SIZE]
+            windows = {}
+            vector = None
+            if plan:
+                if reading_store.enabled:
+                    windows = reading_store.windows(cursor, batch, plan,
+                                                    tracker.watermarks if tracker.enabled else None)
+                else:
+                    windows = fetch_windows(cursor, batch, plan)
+                window_rows = sum(w.row_count() for w in windows.values())
+                telemetry.count('window_rows', window_rows)
+                telemetry.info("Planned window for %d farm(s) on %s: %d rows since %s (%s)", len(batch), table,
+                               window_rows, plan['since'], lambda: ', '.join(plan['metrics']))
+                if USE_VECTOR_EVAL:
+                    vector = vector_eval.build_evaluator(windows, batch)
+            batch_farms = set(batch)
+            for farm_id, stakeholder, _ in (target for target in group if target[0] in batch_farms):
+                window = windows.get(farm_id)
+                data = window.latest() if window else fetch_latest(cursor, farm_id, table)
+                telemetry.debug("Latest weather data for %s: %s", farm_id, data)
+                rules = rules_by_stakeholder[(farm_id, stakeholder)]
+                results[(farm_id, stakeholder, data_type)] = evaluate_rules(
+                    rules, data, table, farm_id, data_type, cursor, window, vector, tracker, stakeholder, dispatcher, alerts
+                )
+
+        # Up-to-date farms still run their actions, from the stored outcomes
+        for farm_id, stakeholder, _ in (target for target in group if target[0] not in stale):
+            rules = rules_by_stakeholder[(farm_id, stakeholder)]
+            results[(farm_id, stakeholder, data_type)] = evaluate_rules(
+                rules, {}, table, farm_id, data_type, cursor, None, None, tracker, stakeholder, dispatcher, alerts
+            )
+
+    tracker.save(cursor)
+    return [
+        {'farm_id': target[0], 'stakeholder': target[1], 'data_type': target[2], 'triggered': results[target]}
+        for target in targets
+    ]
+
+def lambda_handler(event, context):
+    conn = None
+    cursor = None
+    broken = False
+    started = time.perf_counter()
+    try:
+        conn = db.get()
+        cursor = CountingCursor(conn.cursor())
+
+        invalidate_rule_cache(event)
+        condition_order.begin()
+        reading_store.begin()
+        targets = collect_targets(event)
+        telemetry.info("Evaluating %d target(s)", len(targets))
+        tracker = RuleStateTracker(enabled=INCREMENTAL_EVAL)
+        dispatcher = NotificationDispatcher(sns, SNS_TOPIC_ARN, SMS_TOPIC_ARN, ALERT_DIGEST, DISPATCH_WORKERS)
+        alerts = AlertStateStore(ALERT_STATE, ALERT_COOLDOWN_MINUTES, ALERT_DEBOUNCE_RUNS, ALERT_ESCALATION_STEP)
+        results = evaluate_targets(targets, cursor, tracker, dispatcher, alerts)
+        dispatcher.flush()
+        # Alerts are only recorded as notified once SNS has accepted them
+        alerts.not_delivered(dispatcher.undelivered)
+        alerts.save(cursor)
+
+        # Single-target invocations keep the original body: the list of triggered actions
+        if len(targets) == 1 and 'Records' not in event and not event.get('all_farms') and 'targets' not in event:
+            body = results[0]['triggered']
+        else:
+            body = results
+
+        stats = {
+            'targets': len(targets),
+            'farms': len({target[0] for target in targets}),
+            'queries': cursor.queries,
+            **db.stats(),
+            **rule_cache.stats(),
+            **condition_order.stats(),
+            **reading_store.stats(),
+            **tracker.stats(),
+            **alerts.stats(),
+            **dispatcher.stats()
+        }
+        telemetry.info("SQL queries this invocation: %d, connections: %s", cursor.queries, db.stats)
+        telemetry.count('queries', cursor.queries)
+        telemetry.gauge('queries_per_rule', round(cursor.queries / max(tracker.evaluated, 1), 3))
         return {
             'statusCode': 200,
-            'body': json.dumps(triggered_actions, cls=DecimalEncoder)
+            'body': json.dumps(body, cls=DecimalEncoder),
+            'stats': stats
         }
     except Exception as e:
-        print(f"[ERROR] Rules engine: {e}")
+        broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        telemetry.error("Rules engine: %s", e)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)}, cls=DecimalEncoder)
         }
     finally:
-        if cursor:
+        if cursor and not conn.closed:
             cursor.close()
-        if conn:
-            conn.close()
\ No newline at end of file
+        db.release(conn, broken)
+        telemetry.observe('invocation', time.perf_counter() - started)
+        telemetry.flush()
\ No newline at end of file
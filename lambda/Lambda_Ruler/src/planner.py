@@ -0,0 +1,359 @@
+import bisect
+import operator as op
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import telemetry
+from rule_plan import (
+    LATEST_LOOKBACK, SEQUENCE_LOOKBACK, RATE_LOOKBACK, THRESHOLD_OPERATORS, parse_interval, day_offset
+)
+
+# Time column and queryable metrics for each weather table
+TIME_COLUMNS = {
+    'forecast_weather': 'forecast_for',
+    'current_weather': 'timestamp'
+}
+TABLE_METRICS = {
+    'forecast_weather': ['temperature_c', 'humidity_percent', 'wind_speed_mps', 'wind_direction_deg',
+                         'rainfall_mm', 'chance_of_rain_percent'],
+    'current_weather': ['temperature_c', 'humidity_percent', 'wind_speed_mps', 'wind_direction_deg',
+                        'rainfall_mm', 'solar_radiation_wm2']
+}
+
+COMPARATORS = {
+    '>': op.gt,
+    '<': op.lt,
+    '=': op.eq,
+    '>=': op.ge,
+    '<=': op.le,
+    '!=': op.ne,
+    '<>': op.ne
+}
+
+
+def to_number(value):
+    return float(value) if isinstance(value, (Decimal, str)) else value
+
+
+def day_bounds(day, now):
+    """Start and end of a 'today' / 'tomorrow' / 'day_N' token relative to now (naive UTC)."""
+    return offset_bounds(day_offset(day), now)
+
+
+def offset_bounds(offset, now):
+    """day_bounds() for a day offset already resolved by the rule compiler."""
+    day_date = now + timedelta(days=offset)
+    day_start = day_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_end = day_date.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return day_start, day_end
+
+
+def day_date(day, now):
+    """UTC calendar date of a day token, the key of weather_daily_rollups."""
+    return day_bounds(day, now.replace(tzinfo=None))[0].date()
+
+
+def utc(dt):
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+# --- PLANNING ---
+
+def _collect(conditions, table, now, needs):
+    if isinstance(conditions, list):
+        for cond in conditions:
+            _collect_leaf(cond, table, now, needs)
+        return
+
+    operator = conditions.get('operator')
+    sub_conditions = conditions.get('sub_conditions', [])
+    if operator in ('AND', 'OR'):
+        for cond in sub_conditions:
+            if 'metric' in cond:
+                _collect_leaf(cond, table, now, needs)
+            else:
+                _collect(cond, table, now, needs)
+    elif operator == 'NOT' and sub_conditions:
+        _collect(sub_conditions[0], table, now, needs)
+    elif operator == 'SEQUENCE':
+        for cond in sub_conditions:
+            needs['metrics'].add(cond.get('metric'))
+        needs['since'].append(now - SEQUENCE_LOOKBACK)
+
+
+def _collect_leaf(condition, table, now, needs):
+    metric = condition.get('metric')
+    operator = condition.get('operator')
+    needs['metrics'].add(metric)
+
+    if operator == 'RATE>':
+        needs['since'].append(now - RATE_LOOKBACK)
+    elif operator == 'DAY_DIFF>':
+        temporal = condition.get('temporal', {})
+        naive_now = now.replace(tzinfo=None)
+        for key in ('day1', 'day2'):
+            try:
+                day_start, _ = day_bounds(temporal[key], naive_now)
+            except (KeyError, ValueError, IndexError, AttributeError):
+                continue
+            if needs['days'] is not None:
+                # Served from weather_daily_rollups, so the row window need not reach back to the day
+                needs['days'].add((metric, day_start.date()))
+            else:
+                needs['since'].append(utc(day_start))
+    elif condition.get('temporal') and operator in THRESHOLD_OPERATORS:
+        duration = parse_interval(condition['temporal'].get('duration'))
+        if duration is not None:
+            needs['since'].append(now - duration)
+    else:
+        needs['since'].append(now - LATEST_LOOKBACK)
+
+
+def _collect_plan(plan, now, needs):
+    """_collect() for a compiled rule, from the needs recorded in its plan."""
+    needs['metrics'].update(plan['metrics'])
+    if plan['lookback_seconds'] is not None:
+        needs['since'].append(now - timedelta(seconds=plan['lookback_seconds']))
+    naive_now = now.replace(tzinfo=None)
+    for metric, offset in plan['days']:
+        day_start, _ = offset_bounds(offset, naive_now)
+        if needs['days'] is not None:
+            needs['days'].add((metric, day_start.date()))
+        else:
+            needs['since'].append(utc(day_start))
+
+
+def plan_window(rules, data_type, now=None, daily=False):
+    """Walk every rule for data_type and return the single (table, metrics, since) window they need.
+
+    With daily=True, DAY_DIFF> days are planned as (metric, day) rollup lookups instead.
+    """
+    now = now or datetime.now(timezone.utc)
+    table = 'forecast_weather' if data_type == 'forecast' else 'current_weather'
+    needs = {'metrics': set(), 'since': [now - LATEST_LOOKBACK], 'days': set() if daily else None}
+    for rule in rules:
+        if rule.get('data_type') != data_type:
+            continue
+        if rule.get('plan'):
+            _collect_plan(rule['plan'], now, needs)
+        else:
+            _collect(rule.get('conditions', []), table, now, needs)
+
+    # Only whitelisted columns are fetched; anything else is left to the SQL fallback
+    metrics = [m for m in TABLE_METRICS[table] if m in needs['metrics']]
+    if not metrics:
+        metrics = list(TABLE_METRICS[table])
+    return {
+        'table': table,
+        'metrics': metrics,
+        'since': min(needs['since']),
+        'now': now,
+        'days': sorted(needs['days'] or [])
+    }
+
+
+def fetch_windows(cursor, farm_ids, plan):
+    """Pull the planned window for a batch of farms with a single query."""
+    table = plan['table']
+    time_column = TIME_COLUMNS[table]
+    cursor.execute(
+        f"""
+        SELECT farm_id, source, {time_column}, {', '.join(plan['metrics'])}
+        FROM {table}
+        WHERE farm_id = ANY(%s) AND {time_column} >= %s
+        ORDER BY farm_id, {time_column} ASC, source ASC
+        """,
+        (list(farm_ids), plan['since'])
+    )
+    rows_by_farm = {farm_id: [] for farm_id in farm_ids}
+    for row in cursor.fetchall():
+        rows_by_farm[row['farm_id']].append(row)
+    daily = fetch_daily(cursor, farm_ids, plan) if plan.get('days') else {}
+    return {
+        farm_id: WeatherWindow(table, farm_id, plan['metrics'], plan['since'], rows, plan['now'],
+                               daily.get(farm_id) if plan.get('days') else None)
+        for farm_id, rows in rows_by_farm.items()
+    }
+
+
+def fetch_daily(cursor, farm_ids, plan):
+    """Planned (metric, day) aggregates for a batch of farms, combined across sources, in one query."""
+    metrics = sorted({metric for metric, _ in plan['days']})
+    days = sorted({day for _, day in plan['days']})
+    cursor.execute(
+        """
+        SELECT farm_id, metric, day,
+               SUM(sum_value) / NULLIF(SUM(count), 0) AS avg_value,
+               MIN(min_value) AS min_value, MAX(max_value) AS max_value,
+               SUM(sum_value) AS sum_value, SUM(count) AS count
+        FROM weather_daily_rollups
+        WHERE table_name = %s AND farm_id = ANY(%s) AND metric = ANY(%s) AND day = ANY(%s)
+        GROUP BY farm_id, metric, day
+        """,
+        (plan['table'], list(farm_ids), metrics, days)
+    )
+    # Planned days with no rollup row stay as None: known to have no data
+    daily = {farm_id: dict.fromkeys(plan['days']) for farm_id in farm_ids}
+    for row in cursor.fetchall():
+        daily[row['farm_id']][(row['metric'], row['day'])] = row
+    return daily
+
+
+def fetch_window(cursor, farm_id, plan):
+    return fetch_windows(cursor, [farm_id], plan)[farm_id]
+
+
+# --- IN-MEMORY EVALUATION ---
+
+class WeatherWindow:
+    """Rows of one (farm_id, table) window, ordered by time, with the operators the engine needs."""
+
+    def __init__(self, table, farm_id, metrics, since, rows, now, daily=None):
+        self.table = table
+        self.farm_id = farm_id
+        self.time_column = TIME_COLUMNS[table]
+        self.metrics = set(metrics)
+        self.since = since
+        self.rows = rows
+        self.now = now
+        # (metric, day) -> rollup row; None when rollups were not planned
+        self.daily = daily
+
+    def _times(self):
+        if not hasattr(self, '_time_index'):
+            self._time_index = [row[self.time_column] for row in self.rows]
+        return self._time_index
+
+    def _first_after(self, moment):
+        times = self._times()
+        i = bisect.bisect_right(times, moment)
+        return times[i] if i < len(times) else None
+
+    def next_change(self, conditions):
+        """Earliest time at which re-evaluating conditions over this same data could give a different answer.
+
+        Results only move with time when a row crosses a window edge: a row
+        dropping out of a 'now - duration' look-back, a forecast row reaching
+        now (RATE>), or the UTC day rolling over (DAY_DIFF>). Returns None when
+        the tree has a leaf whose window cannot be determined.
+        """
+        edges = []
+        if not self._collect_edges(conditions, edges):
+            return None
+        return min(edges) if edges else datetime.max.replace(tzinfo=timezone.utc)
+
+    def _lookback_edge(self, span, edges):
+        row_time = self._first_after(self.now - span)
+        if row_time is not None:
+            edges.append(row_time + span)
+
+    def _collect_edges(self, conditions, edges):
+        if isinstance(conditions, list):
+            return all(self._leaf_edges(cond, edges) for cond in conditions)
+        if not isinstance(conditions, dict):
+            return False
+        operator = conditions.get('operator')
+        sub_conditions = conditions.get('sub_conditions', [])
+        if operator in ('AND', 'OR', 'NOT'):
+            return all(self._leaf_edges(cond, edges) if 'metric' in cond else self._collect_edges(cond, edges)
+                       for cond in sub_conditions)
+        if operator == 'SEQUENCE':
+            self._lookback_edge(SEQUENCE_LOOKBACK, edges)
+        return True
+
+    def _leaf_edges(self, condition, edges):
+        operator = condition.get('operator')
+        if operator == 'RATE>':
+            row_time = self._first_after(self.now)
+            if row_time is not None:
+                edges.append(row_time)
+            self._lookback_edge(RATE_LOOKBACK, edges)
+        elif operator == 'DAY_DIFF>':
+            midnight = self.now.replace(hour=0, minute=0, second=0, microsecond=0)
+            edges.append(midnight + timedelta(days=1))
+        elif condition.get('temporal') and operator in THRESHOLD_OPERATORS:
+            span = parse_interval(condition['temporal'].get('duration'))
+            if span is None:
+                return False
+            self._lookback_edge(span, edges)
+        else:
+            self._lookback_edge(LATEST_LOOKBACK, edges)
+        return True
+
+    def serves(self, metric, since=None):
+        return metric in self.metrics and (since is None or since >= self.since)
+
+    def latest(self):
+        """Same as ORDER BY time DESC LIMIT 1 over the last LATEST_LOOKBACK."""
+        cutoff = self.now - LATEST_LOOKBACK
+        if self.rows and self.rows[-1][self.time_column] > cutoff:
+            return {metric: self.rows[-1][metric] for metric in self.metrics}
+        return {}
+
+    def row_count(self):
+        return len(self.rows)
+
+    def rate_pairs(self, metric):
+        """[newest, previous] reading of metric for each source that has two in (now - RATE_LOOKBACK, now]."""
+        since = self.now - RATE_LOOKBACK
+        pairs = {}
+        for row in reversed(self.rows):
+            moment = row[self.time_column]
+            if moment <= since:
+                break
+            if moment <= self.now and row[metric] is not None:
+                pair = pairs.setdefault(row['source'], [])
+                if len(pair) < 2:
+                    pair.append(row)
+        return [pair for _, pair in sorted(pairs.items()) if len(pair) == 2]
+
+    def day_stat(self, metric, day, stat='avg_value'):
+        """(True, value) from the daily rollups, or (False, None) when this window did not load that day."""
+        if self.daily is None or (metric, day) not in self.daily:
+            return False, None
+        row = self.daily[(metric, day)]
+        return True, (row[stat] if row else None)
+
+    def average(self, metric, start, end):
+        values = [row[metric] for row in self.rows
+                  if start <= row[self.time_column] <= end and row[metric] is not None]
+        return sum(values) / len(values) if values else None
+
+    def count_matching(self, metric, operator, value, since):
+        compare = COMPARATORS[operator]
+        return sum(1 for row in self.rows
+                   if row[self.time_column] > since and row[metric] is not None and compare(row[metric], value))
+
+    def any_matching(self, metric, operator, value, since):
+        """count_matching(...) > 0, stopping at the first match and skipping rows at or before since."""
+        compare = COMPARATORS[operator]
+        for row in self.rows[bisect.bisect_right(self._times(), since):]:
+            if row[metric] is not None and compare(row[metric], value):
+                return True
+        return False
+
+    def first_matching(self, metric, operator, value, since):
+        compare = COMPARATORS[operator]
+        for row in self.rows:
+            if row[self.time_column] > since and row[metric] is not None and compare(row[metric], value):
+                return row
+        return None
+
+
+class CountingCursor:
+    """Cursor proxy that counts, times and reports the SQL statements sent per invocation."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.queries = 0
+
+    def execute(self, *args, **kwargs):
+        self.queries += 1
+        with telemetry.span('sql'):
+            result = self._cursor.execute(*args, **kwargs)
+        if self._cursor.description is not None:
+            telemetry.count('rows_fetched', max(self._cursor.rowcount, 0))
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
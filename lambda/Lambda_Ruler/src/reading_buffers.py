@@ -0,0 +1,369 @@
+"""Recent weather readings kept in the warm container and topped up from Postgres.
+
+ReadingStore holds, per (table, farm_id), one ReadingBuffer per source: an
+array of reading times plus one array of values per metric of the table,
+complete for every row from the farm's floor (now - READING_BUFFER_HOURS)
+onwards, future forecast rows included. A farm is primed with that whole
+span the first time a batch needs it. After that only rows whose ingestion
+column (timestamp for current_weather, fetched_at for forecast_weather) is
+at or past the farm's high-water mark, less TOP_UP_OVERLAP, are read, in
+one query for the whole batch. When the caller passes the farms'
+ingestion_watermarks (as RuleStateTracker loads them), farms whose
+(watermark, revision) has not moved since their last top-up are not read
+at all, and a batch where none has moved costs no query. A re-read row
+replaces the reading at the same (source, time), so forecasts rewritten by
+a later fetch are picked up, and readings older than the floor expire from
+the head of each buffer.
+
+windows() returns BufferWindow objects, which answer the questions a
+WeatherWindow does (latest row, per-source RATE> pairs, temporal counts,
+day averages, SEQUENCE matches) by bisecting the arrays of each source. A
+plan reaching back past the floor is fetched with fetch_windows() as before,
+and DAY_DIFF> days starting before it are read from the rollups. At most
+max_readings readings are held; the least recently used farms are dropped
+and primed again when next needed.
+
+Rows deleted from Postgres inside the span are not noticed, so the
+retention job's RETENTION_RAW_DAYS and RETENTION_FORECAST_DAYS must stay
+longer than it.
+"""
+import bisect
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import telemetry
+from planner import (
+    COMPARATORS, LATEST_LOOKBACK, RATE_LOOKBACK, TABLE_METRICS, TIME_COLUMNS, WeatherWindow, fetch_daily, fetch_windows
+)
+
+# Column ingestion stamps each row with when it writes it; the high-water mark is kept on it
+INGESTED_COLUMNS = {
+    'forecast_weather': 'fetched_at',
+    'current_weather': 'timestamp'
+}
+# Rows ingested this long before the high-water mark are read again, in case an
+# ingestion run committed after a later one
+TOP_UP_OVERLAP = timedelta(minutes=5)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_NULL = float('nan')
+
+
+def to_micros(moment):
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def from_micros(micros):
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def _value(value):
+    return None if value != value else value
+
+
+class ReadingBuffer:
+    """Readings of one (farm_id, source), oldest first: a time array and one value array per metric.
+
+    New readings are appended at the tail and expired ones leave the head by
+    moving start; the arrays are only copied when that dead prefix is cut
+    away (once it is half the array) or a reading lands between two others.
+    Times are microseconds since the epoch; NULL values are NaN.
+    """
+
+    __slots__ = ('times', 'values', 'start')
+
+    def __init__(self, metrics):
+        self.times = array('q')
+        self.values = {metric: array('d') for metric in metrics}
+        self.start = 0
+
+    def __len__(self):
+        return len(self.times) - self.start
+
+    def put(self, micros, row):
+        """Store row's values at micros, replacing any reading already there; returns the readings added."""
+        times = self.times
+        if len(times) == self.start or micros > times[-1]:
+            times.append(micros)
+            for metric, values in self.values.items():
+                values.append(_NULL if row[metric] is None else row[metric])
+            return 1
+        i = bisect.bisect_left(times, micros, self.start)
+        replace = i < len(times) and times[i] == micros
+        if not replace:
+            times.insert(i, micros)
+        for metric, values in self.values.items():
+            value = _NULL if row[metric] is None else row[metric]
+            if replace:
+                values[i] = value
+            else:
+                values.insert(i, value)
+        return 0 if replace else 1
+
+    def expire(self, floor):
+        """Drop readings before floor; returns how many."""
+        i = bisect.bisect_left(self.times, floor, self.start)
+        dropped = i - self.start
+        self.start = i
+        if self.start and self.start * 2 >= len(self.times):
+            del self.times[:self.start]
+            for values in self.values.values():
+                del values[:self.start]
+            self.start = 0
+        return dropped
+
+    def after(self, micros):
+        """Index of the first reading strictly after micros."""
+        return bisect.bisect_right(self.times, micros, self.start)
+
+
+class FarmReadings:
+    """A farm's buffers, the time they are complete from, and how far its rows have been read."""
+
+    __slots__ = ('floor', 'mark', 'synced', 'buffers', 'size')
+
+    def __init__(self, floor):
+        self.floor = floor
+        # Latest ingestion column value read, and the ingestion watermark the buffers were last synced to
+        self.mark = None
+        self.synced = None
+        self.buffers = {}
+        self.size = 0
+
+
+class ReadingStore:
+    """Per-farm reading buffers shared by warm invocations; see the module docstring."""
+
+    def __init__(self, enabled=True, hours=24, max_readings=200000):
+        self.enabled = enabled
+        self.span = timedelta(hours=hours)
+        self.max_readings = max_readings
+        self._farms = OrderedDict()
+        self.readings = 0
+        self.begin()
+
+    def begin(self):
+        """Reset the per-invocation counters; the buffers are kept."""
+        self.primed = 0
+        self.topped_up = 0
+        self.rows_read = 0
+        self.evicted = 0
+        self.fallbacks = 0
+
+    def windows(self, cursor, farm_ids, plan, watermarks=None):
+        """fetch_windows() for a batch of farms, served from the buffers after topping them up.
+
+        watermarks maps (farm_id, table) to the farm's ingestion (watermark, revision), when known.
+        """
+        floor = plan['now'] - self.span
+        if plan['since'] < floor:
+            self.fallbacks += 1
+            telemetry.count('buffer_fallbacks')
+            return fetch_windows(cursor, farm_ids, plan)
+        table = plan['table']
+        self._top_up(cursor, table, farm_ids, floor, watermarks)
+        # Day averages come from the buffers when the whole day is in them, otherwise from the rollups
+        uncovered = any(datetime(day.year, day.month, day.day, tzinfo=timezone.utc) < floor for _, day in plan['days'])
+        daily = fetch_daily(cursor, farm_ids, plan) if uncovered else {}
+        return {
+            farm_id: BufferWindow(table, farm_id, self._farms[(table, farm_id)], plan['now'],
+                                  daily.get(farm_id) if uncovered else None)
+            for farm_id in farm_ids
+        }
+
+    def _top_up(self, cursor, table, farm_ids, floor, watermarks=None):
+        floor_micros = to_micros(floor)
+        stale, marks = [], []
+        for farm_id in farm_ids:
+            farm = self._farms.get((table, farm_id))
+            watermark = watermarks.get((farm_id, table)) if watermarks is not None else None
+            if farm is None:
+                farm = self._farms[(table, farm_id)] = FarmReadings(floor_micros)
+                self.primed += 1
+            else:
+                self._farms.move_to_end((table, farm_id))
+                self._expire(farm, floor_micros)
+                # Nothing ingested for this farm since its last top-up
+                if watermark is not None and farm.synced == watermark:
+                    continue
+                self.topped_up += 1
+            farm.synced = watermark
+            stale.append(farm_id)
+            marks.append(farm.mark - TOP_UP_OVERLAP if farm.mark is not None else None)
+        if stale:
+            self._read(cursor, table, stale, marks, floor)
+        self._evict({(table, farm_id) for farm_id in farm_ids})
+
+    def _read(self, cursor, table, farm_ids, marks, floor):
+        """Read the rows at or past each farm's mark into its buffers; farms without a mark read their whole span."""
+        time_column, ingested = TIME_COLUMNS[table], INGESTED_COLUMNS[table]
+        metrics = TABLE_METRICS[table]
+        cursor.execute(
+            f"""
+            SELECT w.farm_id, w.source, w.{time_column}, w.{ingested} AS ingested_at,
+                   {', '.join(f'w.{metric}' for metric in metrics)}
+            FROM {table} w
+            JOIN unnest(%s::text[], %s::timestamptz[]) AS mark(farm_id, since) ON w.farm_id = mark.farm_id
+            WHERE w.{time_column} >= %s AND (mark.since IS NULL OR w.{ingested} >= mark.since)
+            ORDER BY w.{time_column}
+            """,
+            (list(farm_ids), marks, floor)
+        )
+        rows = cursor.fetchall()
+        for row in rows:
+            farm = self._farms[(table, row['farm_id'])]
+            buffer = farm.buffers.get(row['source'])
+            if buffer is None:
+                buffer = farm.buffers[row['source']] = ReadingBuffer(metrics)
+            added = buffer.put(to_micros(row[time_column]), row)
+            farm.size += added
+            self.readings += added
+            if farm.mark is None or row['ingested_at'] > farm.mark:
+                farm.mark = row['ingested_at']
+        self.rows_read += len(rows)
+        telemetry.count('buffer_rows_read', len(rows))
+
+    def _expire(self, farm, floor):
+        for buffer in farm.buffers.values():
+            dropped = buffer.expire(floor)
+            farm.size -= dropped
+            self.readings -= dropped
+        farm.floor = max(farm.floor, floor)
+
+    def _evict(self, keep):
+        """Drop least recently used farms, never the batch in hand, until max_readings holds."""
+        while self.readings > self.max_readings:
+            key = next((key for key in self._farms if key not in keep), None)
+            if key is None:
+                break
+            self.readings -= self._farms.pop(key).size
+            self.evicted += 1
+
+    def clear(self):
+        self._farms.clear()
+        self.readings = 0
+
+    def stats(self):
+        return {
+            'buffer_farms_primed': self.primed,
+            'buffer_farms_topped_up': self.topped_up,
+            'buffer_rows_read': self.rows_read,
+            'buffer_evictions': self.evicted,
+            'buffer_fallbacks': self.fallbacks,
+            'buffer_readings': self.readings
+        }
+
+
+class BufferWindow(WeatherWindow):
+    """WeatherWindow over a farm's reading buffers, complete from the farm's floor onwards."""
+
+    def __init__(self, table, farm_id, readings, now, daily=None):
+        self.table = table
+        self.farm_id = farm_id
+        self.time_column = TIME_COLUMNS[table]
+        self.metrics = set(TABLE_METRICS[table])
+        self.since = from_micros(readings.floor)
+        self.now = now
+        self.daily = daily
+        # In source order, so ties between sources resolve as in fetch_windows() (source ASC)
+        self.buffers = sorted(readings.buffers.items())
+        self._rows = None
+
+    @property
+    def rows(self):
+        """The readings as fetch_windows() rows, built on first use (vector_eval reads them)."""
+        if self._rows is None:
+            rows = []
+            for source, buffer in self.buffers:
+                for i in range(buffer.start, len(buffer.times)):
+                    row = {'farm_id': self.farm_id, 'source': source, self.time_column: from_micros(buffer.times[i])}
+                    for metric, values in buffer.values.items():
+                        row[metric] = _value(values[i])
+                    rows.append(row)
+            rows.sort(key=lambda row: (row[self.time_column], row['source']))
+            self._rows = rows
+        return self._rows
+
+    def row_count(self):
+        return sum(len(buffer) for _, buffer in self.buffers)
+
+    def _first_after(self, moment):
+        micros = to_micros(moment)
+        first = None
+        for _, buffer in self.buffers:
+            i = buffer.after(micros)
+            if i < len(buffer.times) and (first is None or buffer.times[i] < first):
+                first = buffer.times[i]
+        return from_micros(first) if first is not None else None
+
+    def latest(self):
+        newest = None
+        for _, buffer in self.buffers:
+            if len(buffer) and (newest is None or buffer.times[-1] >= newest.times[-1]):
+                newest = buffer
+        if newest is None or newest.times[-1] <= to_micros(self.now - LATEST_LOOKBACK):
+            return {}
+        return {metric: _value(values[-1]) for metric, values in newest.values.items()}
+
+    def rate_pairs(self, metric):
+        since, now = to_micros(self.now - RATE_LOOKBACK), to_micros(self.now)
+        pairs = []
+        for source, buffer in self.buffers:
+            times, values = buffer.times, buffer.values[metric]
+            lowest = buffer.after(since)
+            i = buffer.after(now)
+            pair = []
+            while i > lowest and len(pair) < 2:
+                i -= 1
+                if values[i] == values[i]:
+                    pair.append({'source': source, self.time_column: from_micros(times[i]), metric: values[i]})
+            if len(pair) == 2:
+                pairs.append(pair)
+        return pairs
+
+    def average(self, metric, start, end):
+        start, end = to_micros(start), to_micros(end)
+        total, count = 0.0, 0
+        for _, buffer in self.buffers:
+            values = buffer.values[metric]
+            for i in range(bisect.bisect_left(buffer.times, start, buffer.start), buffer.after(end)):
+                if values[i] == values[i]:
+                    total += values[i]
+                    count += 1
+        return total / count if count else None
+
+    def count_matching(self, metric, operator, value, since):
+        compare = COMPARATORS[operator]
+        count = 0
+        for _, buffer in self.buffers:
+            values = buffer.values[metric]
+            for i in range(buffer.after(to_micros(since)), len(buffer.times)):
+                if values[i] == values[i] and compare(values[i], value):
+                    count += 1
+        return count
+
+    def any_matching(self, metric, operator, value, since):
+        compare = COMPARATORS[operator]
+        for _, buffer in self.buffers:
+            values = buffer.values[metric]
+            for i in range(buffer.after(to_micros(since)), len(buffer.times)):
+                if values[i] == values[i] and compare(values[i], value):
+                    return True
+        return False
+
+    def first_matching(self, metric, operator, value, since):
+        compare = COMPARATORS[operator]
+        first = None
+        for source, buffer in self.buffers:
+            times, values = buffer.times, buffer.values[metric]
+            for i in range(buffer.after(to_micros(since)), len(times)):
+                if first is not None and times[i] >= first[0]:
+                    break
+                if values[i] == values[i] and compare(values[i], value):
+                    first = (times[i], source, values[i])
+                    break
+        if first is None:
+            return None
+        return {'source': first[1], self.time_column: from_micros(first[0]), metric: first[2]}
@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+
+def parse_numbers(value):
+    """Convert DynamoDB Decimals in a rule tree to int/float once, the way DecimalEncoder does."""
+    if isinstance(value, Decimal):
+        return float(value) if value % 1 else int(value)
+    if isinstance(value, dict):
+        return {k: parse_numbers(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [parse_numbers(v) for v in value]
+    return value
+
+
+class RuleCache:
+    """LRU cache of sorted, pre-parsed rules keyed by (farm_id, stakeholder).
+
+    Lives at module level so it survives warm invocations. Entries expire
+    after ttl seconds and are dropped early when the DynamoDB stream reports
+    a change to that key. Each entry remembers the read capacity its load
+    consumed, so hits can be reported as read units saved.
+    """
+
+    def __init__(self, ttl=300, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.read_units_saved = 0.0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or self.ttl <= 0 or time.monotonic() - entry['loaded_at'] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.read_units_saved += entry['read_units']
+        return entry['value']
+
+    def put(self, key, value, read_units=0.0):
+        if self.ttl <= 0:
+            return
+        self._entries[key] = {'value': value, 'loaded_at': time.monotonic(), 'read_units': read_units}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {
+            'rule_cache_hits': self.hits,
+            'rule_cache_misses': self.misses,
+            'rule_cache_invalidations': self.invalidations,
+            'rule_cache_size': len(self._entries),
+            'read_units_saved': round(self.read_units_saved, 2)
+        }
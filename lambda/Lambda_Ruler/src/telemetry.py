@@ -0,0 +1,155 @@
+"""Leveled logging, timing spans and CloudWatch Embedded Metric Format metrics.
+
+Log calls take a %-style template and its arguments, and nothing is
+formatted unless LOG_LEVEL lets the line through; an argument may also be
+a zero-argument callable (e.g. ``lambda: json.dumps(rule)``) that only
+runs when the line is written. span() and count() accumulate in memory
+and flush() writes one EMF JSON line per dimension set, which CloudWatch
+turns into metrics without any API calls. Sinks added with add_sink()
+receive every flushed record, so local tools can read the same numbers.
+
+Each Lambda ships its own copy of this file.
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LOG_LEVEL = LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+# Print EMF lines on flush; sinks get the records either way
+EMF_ENABLED = os.environ.get('EMF_METRICS', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'WeatherAlerts')
+
+_lock = threading.Lock()
+_service = 'Lambda'
+_level = LOG_LEVEL
+# {(dimension items): {metric: [unit, value]}}
+_metrics = {}
+# {(dimension items): {span: [count, total_ms, max_ms]}}
+_spans = {}
+_sinks = []
+
+
+def configure(service=None, level=None):
+    global _service, _level
+    if service is not None:
+        _service = service
+    if level is not None:
+        _level = LEVELS[level.upper()]
+
+
+def enabled(level):
+    return LEVELS[level] >= _level
+
+
+def _log(level, message, args):
+    if LEVELS[level] < _level:
+        return
+    if args:
+        message = message % tuple(arg() if callable(arg) else arg for arg in args)
+    print(message if level == 'INFO' else f"[{level}] {message}")
+
+
+def debug(message, *args):
+    _log('DEBUG', message, args)
+
+
+def info(message, *args):
+    _log('INFO', message, args)
+
+
+def warning(message, *args):
+    _log('WARNING', message, args)
+
+
+def error(message, *args):
+    _log('ERROR', message, args)
+
+
+def _key(dimensions):
+    return tuple(sorted(dimensions.items()))
+
+
+def count(name, value=1, unit='Count', **dimensions):
+    """Add value to a counter."""
+    with _lock:
+        metric = _metrics.setdefault(_key(dimensions), {}).setdefault(name, [unit, 0])
+        metric[1] += value
+
+
+def gauge(name, value, unit='None', **dimensions):
+    """Set a metric to value, replacing anything recorded earlier in the invocation."""
+    with _lock:
+        _metrics.setdefault(_key(dimensions), {})[name] = [unit, value]
+
+
+def observe(name, seconds, **dimensions):
+    """Record one timing for span name."""
+    ms = seconds * 1000
+    with _lock:
+        span = _spans.setdefault(_key(dimensions), {}).setdefault(name, [0, 0.0, 0.0])
+        span[0] += 1
+        span[1] += ms
+        if ms > span[2]:
+            span[2] = ms
+
+
+@contextmanager
+def span(name, **dimensions):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **dimensions)
+
+
+def add_sink(sink):
+    """Call sink(record) with every EMF record flushed from now on."""
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def flush():
+    """Emit everything recorded since the last flush as EMF records and reset; returns the records."""
+    with _lock:
+        metrics, spans = dict(_metrics), dict(_spans)
+        _metrics.clear()
+        _spans.clear()
+    if not (EMF_ENABLED or _sinks):
+        return []
+
+    records = []
+    timestamp = int(time.time() * 1000)
+    for key in list(metrics) + [k for k in spans if k not in metrics]:
+        record = {'Service': _service, **dict(key)}
+        definitions = []
+        for name, (unit, value) in metrics.get(key, {}).items():
+            record[name] = value
+            definitions.append({'Name': name, 'Unit': unit})
+        for name, (calls, total_ms, max_ms) in spans.get(key, {}).items():
+            record[f"{name}_count"] = calls
+            record[f"{name}_ms"] = round(total_ms, 3)
+            record[f"{name}_max_ms"] = round(max_ms, 3)
+            definitions += [{'Name': f"{name}_count", 'Unit': 'Count'},
+                            {'Name': f"{name}_ms", 'Unit': 'Milliseconds'},
+                            {'Name': f"{name}_max_ms", 'Unit': 'Milliseconds'}]
+        record['_aws'] = {
+            'Timestamp': timestamp,
+            'CloudWatchMetrics': [{'Namespace': METRICS_NAMESPACE,
+                                   'Dimensions': [['Service', *dict(key)]],
+                                   'Metrics': definitions}]
+        }
+        records.append(record)
+
+    for record in records:
+        if EMF_ENABLED:
+            print(json.dumps(record, default=str))
+        for sink in list(_sinks):
+            sink(record)
+    return records
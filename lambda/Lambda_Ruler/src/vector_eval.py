@@ -0,0 +1,318 @@
+import json
+
+# numpy ships with the AWS SDK Pandas layer; without it the scalar path is used. It is imported by
+# available() on the first planned batch rather than at init, since it is most of the layer's import time.
+np = None
+_numpy_checked = False
+
+from planner import (
+    COMPARATORS, THRESHOLD_OPERATORS, LATEST_LOOKBACK, SEQUENCE_LOOKBACK, RATE_LOOKBACK,
+    parse_interval, to_number, day_bounds, utc
+)
+
+_NUMPY_COMPARATORS = {
+    '>': 'greater',
+    '<': 'less',
+    '=': 'equal',
+    '>=': 'greater_equal',
+    '<=': 'less_equal',
+    '!=': 'not_equal',
+    '<>': 'not_equal'
+}
+
+
+def available():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+        _numpy_checked = True
+    return np is not None
+
+
+class ColumnBatch:
+    """Windows for a batch of farms flattened into one timestamp array plus one float array per metric.
+
+    Rows stay grouped by farm and ordered by time; seg holds each row's farm
+    index so per-farm reductions are bincounts, and source_codes its source
+    as an index into sources. Missing values are NaN, which compares False
+    like NULL does in SQL.
+    """
+
+    def __init__(self, windows, farm_ids):
+        self.farm_ids = list(farm_ids)
+        self.farm_index = {farm_id: i for i, farm_id in enumerate(self.farm_ids)}
+        first = windows[self.farm_ids[0]]
+        self.time_column = first.time_column
+        self.metrics = set(first.metrics)
+        self.since = first.since.timestamp()
+        self.now = first.now.timestamp()
+        self.now_dt = first.now
+        self.size = len(self.farm_ids)
+
+        counts = np.array([len(windows[farm_id].rows) for farm_id in self.farm_ids], dtype=np.int64)
+        self.counts = counts
+        self.starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+        self.seg = np.repeat(np.arange(self.size), counts)
+        rows = [row for farm_id in self.farm_ids for row in windows[farm_id].rows]
+        self.times = np.array([row[self.time_column].timestamp() for row in rows], dtype=np.float64)
+        self.columns = {
+            metric: np.array([np.nan if row[metric] is None else row[metric] for row in rows], dtype=np.float64)
+            for metric in self.metrics
+        }
+        self.sources = sorted({row['source'] for row in rows})
+        codes = {source: i for i, source in enumerate(self.sources)}
+        self.source_codes = np.array([codes[row['source']] for row in rows], dtype=np.int64)
+
+        # reduceat cannot express empty segments, so reductions run over the non-empty farms only
+        # Per-farm daily rollups ((metric, day) -> row), when the plan loaded them
+        self.daily = [windows[farm_id].daily for farm_id in self.farm_ids]
+
+        self.nonempty = counts > 0
+        self.nonempty_starts = self.starts[self.nonempty]
+        self._masks = {}
+
+    def since_mask(self, seconds_back):
+        """Rows strictly newer than now - seconds_back, cached per look-back."""
+        key = ('since', seconds_back)
+        if key not in self._masks:
+            self._masks[key] = self.times > self.now - seconds_back
+        return self._masks[key]
+
+    def between_mask(self, start, end):
+        key = ('between', start, end)
+        if key not in self._masks:
+            self._masks[key] = (self.times >= start) & (self.times <= end)
+        return self._masks[key]
+
+    def compare_mask(self, metric, operator, value):
+        key = ('compare', metric, operator, value)
+        if key not in self._masks:
+            with np.errstate(invalid='ignore'):
+                self._masks[key] = getattr(np, _NUMPY_COMPARATORS[operator])(self.columns[metric], value)
+        return self._masks[key]
+
+    def _reduce(self, ufunc, values, empty):
+        out = np.full(self.size, empty, dtype=values.dtype)
+        if len(self.nonempty_starts):
+            out[self.nonempty] = ufunc.reduceat(values, self.nonempty_starts)
+        return out
+
+    def any_per_farm(self, mask):
+        return self._reduce(np.logical_or, mask, False)
+
+    def count_per_farm(self, mask):
+        return self._reduce(np.add, mask.astype(np.int64), 0)
+
+    def sum_per_farm(self, values, mask):
+        return self._reduce(np.add, np.where(mask, values, 0.0), 0.0)
+
+    def daily_per_farm(self, metric, day, stat='avg_value'):
+        """Rollup stat per farm (NaN where the day has no data), or None if the rollups do not cover it."""
+        if any(daily is None or (metric, day) not in daily for daily in self.daily):
+            return None
+        values = [daily[(metric, day)][stat] if daily[(metric, day)] else None for daily in self.daily]
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+    def first_time_per_farm(self, mask):
+        """Time of the first row matching mask in each farm (rows are time-ordered), inf if none."""
+        first = np.full(self.size, np.inf)
+        hits = np.flatnonzero(mask)
+        if len(hits):
+            segs = self.seg[hits]
+            leading = np.concatenate(([True], segs[1:] != segs[:-1]))
+            first[segs[leading]] = self.times[hits[leading]]
+        return first
+
+
+class VectorEvaluator:
+    """Evaluates condition trees for every farm in a ColumnBatch at once.
+
+    Every node yields two boolean arrays over the batch's farms: the result,
+    and an 'unknown' mask for farms the arrays cannot answer exactly (too few
+    rows for RATE>, windows that do not reach back far enough, unsupported
+    shapes). Callers fall back to the scalar evaluator for unknown farms.
+    Results are memoised per leaf and per rule, so rules shared by many farms
+    or leaves shared by many rules are computed once.
+    """
+
+    def __init__(self, batch):
+        self.batch = batch
+        self._leaves = {}
+        self._rules = {}
+
+    def verdict(self, conditions, farm_id):
+        """True/False for one farm, or None when the scalar path must decide."""
+        key = id(conditions)
+        if key not in self._rules:
+            try:
+                outcome = self.evaluate(conditions)
+            except (KeyError, TypeError, ValueError, IndexError, AttributeError):
+                outcome = self._unknown()
+            # Keep a reference to the tree so its id() cannot be reused while cached
+            self._rules[key] = (conditions, outcome)
+        result, unknown = self._rules[key][1]
+        i = self.batch.farm_index[farm_id]
+        return None if unknown[i] else bool(result[i])
+
+    def _const(self, value):
+        return np.full(self.batch.size, value, dtype=bool)
+
+    def _unknown(self):
+        return self._const(False), self._const(True)
+
+    def evaluate(self, conditions):
+        if isinstance(conditions, list):
+            return self._all([self.evaluate_leaf(cond) for cond in conditions])
+        if not isinstance(conditions, dict):
+            return self._unknown()
+
+        operator = conditions.get('operator')
+        sub_conditions = conditions.get('sub_conditions', [])
+        children = lambda: [self.evaluate_leaf(cond) if 'metric' in cond else self.evaluate(cond)
+                            for cond in sub_conditions]
+        if operator == 'AND':
+            return self._all(children())
+        elif operator == 'OR':
+            return self._any(children())
+        elif operator == 'NOT':
+            if not sub_conditions:
+                return self._unknown()
+            result, unknown = self.evaluate(sub_conditions[0])
+            return ~result, unknown
+        elif operator == 'SEQUENCE':
+            return self._sequence(sub_conditions)
+        return self._const(False), self._const(False)
+
+    def _all(self, parts):
+        result, unknown = self._const(True), self._const(False)
+        for part_result, part_unknown in parts:
+            result &= part_result
+            unknown |= part_unknown
+        return result, unknown
+
+    def _any(self, parts):
+        result, unknown = self._const(False), self._const(False)
+        for part_result, part_unknown in parts:
+            result |= part_result
+            unknown |= part_unknown
+        return result, unknown
+
+    def evaluate_leaf(self, condition):
+        key = json.dumps(condition, sort_keys=True, default=str)
+        if key not in self._leaves:
+            try:
+                self._leaves[key] = self._leaf(condition)
+            except (KeyError, TypeError, ValueError, IndexError, AttributeError):
+                self._leaves[key] = self._unknown()
+        return self._leaves[key]
+
+    def _leaf(self, condition):
+        batch = self.batch
+        metric = condition.get('metric')
+        operator = condition.get('operator')
+        value = to_number(condition.get('value'))
+        if metric not in batch.metrics:
+            return self._unknown()
+
+        if operator == 'RATE>':
+            interval = condition['temporal']['interval']
+            expected_rate = value / (float(interval.split()[0]) / 60 if 'minute' in interval else float(interval.split()[0]))
+            lookback = RATE_LOOKBACK.total_seconds()
+            if batch.now - lookback < batch.since:
+                return self._unknown()
+            values = batch.columns[metric]
+            # Non-NULL readings in (now - RATE_LOOKBACK, now], sorted by (farm, source, time)
+            rows = np.flatnonzero(~batch.since_mask(0) & batch.since_mask(lookback) & ~np.isnan(values))
+            rows = rows[np.lexsort((batch.times[rows], batch.source_codes[rows], batch.seg[rows]))]
+            group = batch.seg[rows] * len(batch.sources) + batch.source_codes[rows]
+            # The last reading of each (farm, source), paired with the one before it when that is the same source
+            last = np.flatnonzero(np.append(group[1:] != group[:-1], True))
+            last = last[last > 0]
+            last = last[group[last - 1] == group[last]]
+            newest, previous = rows[last], rows[last - 1]
+            hours = (batch.times[newest] - batch.times[previous]) / 3600
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rate = np.where(hours != 0, (values[newest] - values[previous]) / hours, 0.0)
+            result = self._const(False)
+            result[batch.seg[newest[rate > expected_rate]]] = True
+            return result, self._const(False)
+
+        if operator == 'DAY_DIFF>':
+            temporal = condition['temporal']
+            naive_now = batch.now_dt.replace(tzinfo=None)
+            averages = []
+            for day in (temporal['day1'], temporal['day2']):
+                start, end = day_bounds(day, naive_now)
+                daily = batch.daily_per_farm(metric, start.date())
+                if daily is not None:
+                    averages.append((daily, ~np.isnan(daily)))
+                    continue
+                start, end = utc(start).timestamp(), utc(end).timestamp()
+                if start < batch.since:
+                    return self._unknown()
+                values = batch.columns[metric]
+                mask = batch.between_mask(start, end) & ~np.isnan(values)
+                count = batch.count_per_farm(mask)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    averages.append((batch.sum_per_farm(values, mask) / count, count > 0))
+            (day1_avg, has_day1), (day2_avg, has_day2) = averages
+            found = has_day1 & has_day2
+            with np.errstate(invalid='ignore'):
+                diff = day2_avg - day1_avg
+                # NumPy sums in a different order than the scalar path; let it settle near-ties
+                tie = found & (np.abs(diff - value) <= 1e-9 * np.maximum(1.0, np.abs(diff)))
+                return found & (diff > value), tie
+
+        if operator not in THRESHOLD_OPERATORS:
+            return self._const(False), self._const(False)
+
+        if condition.get('temporal'):
+            span = parse_interval(condition['temporal']['duration'])
+            if span is None or batch.now - span.total_seconds() < batch.since:
+                return self._unknown()
+            mask = batch.since_mask(span.total_seconds()) & batch.compare_mask(metric, operator, value)
+            return batch.any_per_farm(mask), self._const(False)
+
+        # Latest row of each farm, provided it falls inside the latest-row look-back
+        has_rows = batch.counts > 0
+        last = np.maximum(batch.starts + batch.counts - 1, 0)
+        if not len(batch.times):
+            return self._const(False), self._const(False)
+        recent = has_rows & (batch.times[last] > batch.now - LATEST_LOOKBACK.total_seconds())
+        with np.errstate(invalid='ignore'):
+            hit = getattr(np, _NUMPY_COMPARATORS[operator])(batch.columns[metric][last], value)
+        return recent & hit, self._const(False)
+
+    def _sequence(self, sub_conditions):
+        batch = self.batch
+        lookback = SEQUENCE_LOOKBACK.total_seconds()
+        if batch.now - lookback < batch.since:
+            return self._unknown()
+        result, unknown = self._const(True), self._const(False)
+        last_time = None
+        max_interval = None
+        for i, cond in enumerate(sub_conditions):
+            if i > 0 and 'within' in sub_conditions[i - 1]:
+                max_interval = sub_conditions[i - 1]['within']
+            metric, operator = cond.get('metric'), cond.get('operator')
+            if metric not in batch.metrics or operator not in COMPARATORS:
+                return self._unknown()
+            mask = batch.since_mask(lookback) & batch.compare_mask(metric, operator, to_number(cond['value']))
+            current_time = batch.first_time_per_farm(mask)
+            found = np.isfinite(current_time)
+            result &= found
+            if last_time is not None and max_interval:
+                with np.errstate(invalid='ignore'):
+                    result &= ~((current_time - last_time) / 60 > float(max_interval.split()[0]))
+            last_time = current_time
+        return result, unknown
+
+
+def build_evaluator(windows, farm_ids):
+    if not available() or not farm_ids:
+        return None
+    return VectorEvaluator(ColumnBatch(windows, farm_ids))
@@ -0,0 +1,157 @@
+import json
+import hashlib
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import execute_values
+
+import telemetry
+
+
+def rule_fingerprint(rule):
+    """Hash of everything that decides a rule's outcome, so edited rules are never reused."""
+    if rule.get('plan'):
+        # Compiled rules carry the same hash, checked against their conditions when loaded
+        return rule['plan']['fingerprint']
+    payload = json.dumps([rule.get('data_type'), rule.get('conditions', [])], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def rule_metrics(conditions):
+    """Metrics a conditions tree reads, in first-seen order."""
+    metrics = []
+
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            if node.get('metric') and node['metric'] not in metrics:
+                metrics.append(node['metric'])
+            walk(node.get('sub_conditions', []))
+
+    walk(conditions)
+    return metrics
+
+
+class RuleStateTracker:
+    """Reuses a rule's previous outcome while its inputs have not moved.
+
+    The ingestion Lambda advances ingestion_watermarks for every (farm_id,
+    table) it writes. A stored outcome in rule_evaluations is reused when the
+    rule is unchanged (same fingerprint), the farm's watermark and revision for
+    the rule's table are the ones it was evaluated against, and the clock has not yet
+    reached valid_until, the first moment a row could slide across one of the
+    rule's time windows. If either table is missing, the tracker switches
+    itself off and every rule is evaluated as before.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # One clock for the whole invocation so a result cannot expire between planning and evaluation
+        self.now = datetime.now(timezone.utc)
+        self.watermarks = {}
+        self.states = {}
+        self.pending = []
+        self.skipped = 0
+        self.evaluated = 0
+
+    def load(self, cursor, farm_ids, table):
+        if not self.enabled or not farm_ids:
+            return
+        try:
+            cursor.execute(
+                """
+                SELECT farm_id, watermark, revision FROM ingestion_watermarks
+                WHERE table_name = %s AND farm_id = ANY(%s)
+                """,
+                (table, list(farm_ids))
+            )
+            for row in cursor.fetchall():
+                self.watermarks[(row['farm_id'], table)] = (row['watermark'], row['revision'])
+            cursor.execute(
+                """
+                SELECT rule_id, farm_id, stakeholder, fingerprint, watermark, revision, result, valid_until
+                FROM rule_evaluations
+                WHERE farm_id = ANY(%s)
+                """,
+                (list(farm_ids),)
+            )
+            for row in cursor.fetchall():
+                self.states[(row['rule_id'], row['farm_id'], row['stakeholder'])] = row
+        except psycopg2.Error as e:
+            telemetry.warning("Incremental evaluation disabled: %s", e)
+            cursor.connection.rollback()
+            self.enabled = False
+
+    def reusable(self, rule, farm_id, stakeholder, table):
+        """Previous result of rule for this farm, or None when it has to be evaluated."""
+        if not self.enabled:
+            return None
+        state = self.states.get((rule['rule_id'], farm_id, stakeholder))
+        watermark = self.watermarks.get((farm_id, table))
+        if state is None or watermark is None or (state['watermark'], state['revision']) != watermark:
+            return None
+        if state['fingerprint'] != rule_fingerprint(rule) or state['valid_until'] is None:
+            return None
+        if self.now >= state['valid_until']:
+            return None
+        return state['result']
+
+    def needs_window(self, rules, farm_id, stakeholder, table, data_type):
+        """True when at least one rule the engine will reach has to be evaluated."""
+        if not self.enabled:
+            return True
+        for rule in rules:
+            if rule['data_type'] != data_type:
+                continue
+            result = self.reusable(rule, farm_id, stakeholder, table)
+            if result is None:
+                return True
+            if result and rule.get('stop_on_match', True):
+                return False
+        return False
+
+    def record(self, rule, farm_id, stakeholder, table, result, window=None):
+        if not self.enabled:
+            return
+        watermark = self.watermarks.get((farm_id, table))
+        if watermark is None:
+            return
+        conditions = rule.get('conditions', [])
+        # Without an in-memory window there is no way to tell when the result expires
+        valid_until = window.next_change(conditions) if window is not None else None
+        self.pending.append((
+            rule['rule_id'], farm_id, stakeholder, rule_fingerprint(rule), *watermark,
+            bool(result), rule_metrics(conditions), valid_until or self.now
+        ))
+
+    def save(self, cursor):
+        if not self.enabled or not self.pending:
+            return
+        try:
+            execute_values(
+                cursor,
+                """
+                INSERT INTO rule_evaluations
+                    (rule_id, farm_id, stakeholder, fingerprint, watermark, revision, result, metrics, valid_until)
+                VALUES %s
+                ON CONFLICT (rule_id, farm_id, stakeholder) DO UPDATE SET
+                    fingerprint = EXCLUDED.fingerprint,
+                    watermark = EXCLUDED.watermark,
+                    revision = EXCLUDED.revision,
+                    result = EXCLUDED.result,
+                    metrics = EXCLUDED.metrics,
+                    valid_until = EXCLUDED.valid_until,
+                    evaluated_at = NOW()
+                """,
+                self.pending,
+                page_size=500
+            )
+            cursor.connection.commit()
+        except psycopg2.Error as e:
+            telemetry.error("Failed to save rule evaluations: %s", e)
+            cursor.connection.rollback()
+        self.pending = []
+
+    def stats(self):
+        return {'rules_skipped': self.skipped, 'rules_evaluated': self.evaluated}
@@ -0,0 +1,270 @@
+"""Conditional-request cache for provider responses.
+
+Each response is kept under a hash of its URL with its validators (ETag,
+Last-Modified), the expiry computed from Cache-Control/Expires (or the
+provider's default TTL when it sends neither) and the hash of the body
+last written to Postgres. fetch() serves fresh entries without a request,
+revalidates stale ones with If-None-Match/If-Modified-Since, and reports a
+body as unchanged when it is the one already written, so the caller can
+skip parsing and upserts. confirm() records that a body reached the
+database; until then the same body is reported as changed. A variant
+(e.g. the farms a shared response is written for) is part of what counts
+as written, so the same body is reported as changed when the variant is.
+
+The local tier lives in /tmp and evicts least recently used entries past
+max_bytes. An optional store (S3, or a directory standing in for it) is
+read on a local miss and written through, so a cold container starts warm.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from email.utils import parsedate_to_datetime
+
+import telemetry
+
+
+def _encode(meta, body):
+    return json.dumps(meta).encode() + b'\n' + body
+
+
+def _decode(blob):
+    header, _, body = blob.partition(b'\n')
+    return json.loads(header), body
+
+
+class DirectoryBackend:
+    """One file per entry (JSON header line + body) under root, LRU-evicted past max_bytes."""
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+        self.evicted = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                blob = f.read()
+            # mtime doubles as last access for eviction
+            os.utime(self._path(key))
+        except OSError:
+            return None
+        return _decode(blob)
+
+    def put(self, key, meta, body):
+        blob = _encode(meta, body)
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            old = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        if self.max_bytes:
+            with self._lock:
+                if self._size is None:
+                    self._size = self._scan_size()
+                else:
+                    self._size += len(blob) - old
+                if self._size > self.max_bytes:
+                    self._evict()
+
+    def _entries(self):
+        with os.scandir(self.root) as it:
+            return [entry for entry in it if entry.is_file() and not entry.name.endswith('.tmp')]
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of max_bytes."""
+        target = self.max_bytes * 0.9
+        for entry in sorted(self._entries(), key=lambda e: e.stat().st_mtime):
+            if self._size <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._size -= size
+            self.evicted += 1
+
+
+class S3Backend:
+    """Entries as objects under s3://bucket/prefix; failures only cost a cache miss."""
+
+    def __init__(self, bucket, prefix='', client=None):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = client or boto3.client('s3')
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def get(self, key):
+        try:
+            blob = self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body'].read()
+        except Exception:
+            return None
+        return _decode(blob)
+
+    def put(self, key, meta, body):
+        try:
+            self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=_encode(meta, body))
+        except Exception as e:
+            telemetry.warning("Response cache store write failed: %s", e)
+
+
+def open_store(location):
+    """Backend for CACHE_STORE: 's3://bucket/prefix', a directory path, or None when unset."""
+    if not location:
+        return None
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[5:].partition('/')
+        return S3Backend(bucket, prefix)
+    return DirectoryBackend(location)
+
+
+def _written_tag(sha1, variant):
+    return hashlib.sha1(f"{sha1}:{variant}".encode()).hexdigest() if variant else sha1
+
+
+def _expiry(headers, now, default_ttl):
+    """Absolute expiry from Cache-Control max-age (minus Age) or Expires, else now + default_ttl."""
+    cache_control = headers.get('Cache-Control', '').lower()
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return now
+    for directive in cache_control.split(','):
+        name, _, value = directive.strip().partition('=')
+        if name == 'max-age' and value.isdigit():
+            age = headers.get('Age', '0')
+            return now + int(value) - (int(age) if age.isdigit() else 0)
+    if headers.get('Expires'):
+        try:
+            expires = parsedate_to_datetime(headers['Expires']).timestamp()
+            date = parsedate_to_datetime(headers['Date']).timestamp() if headers.get('Date') else now
+            # Relative to the server's clock, so local clock skew does not matter
+            return now + (expires - date)
+        except (TypeError, ValueError):
+            return now
+    return now + default_ttl
+
+
+class ResponseCache:
+    def __init__(self, session, local, store=None, default_ttl=None):
+        self.session = session
+        self.local = local
+        self.store = store
+        self.default_ttl = default_ttl or {}
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def _count(self, provider, name, value=1):
+        with self._lock:
+            counts = self.counts.setdefault(provider, {'requests': 0, 'fresh': 0, 'revalidated': 0,
+                                                       'unchanged': 0, 'misses': 0, 'bytes_saved': 0})
+            counts[name] += value
+        telemetry.count(f"cache_{name}", value, 'Bytes' if name == 'bytes_saved' else 'Count', Provider=provider)
+
+    def _load(self, key):
+        entry = self.local.get(key)
+        if entry is None and self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self.local.put(key, *entry)
+        return entry
+
+    def _save(self, key, meta, body):
+        self.local.put(key, meta, body)
+        if self.store is not None:
+            self.store.put(key, meta, body)
+
+    def fetch(self, url, provider, headers=None, variant=None):
+        """(body, unchanged, token) for url; unchanged means this body and variant were last confirmed as written.
+
+        Pass the tokens of whatever reached the database to confirm().
+        """
+        key = hashlib.sha1(url.encode()).hexdigest()
+        now = time.time()
+        entry = self._load(key)
+        self._count(provider, 'requests')
+
+        if entry is not None and entry[0]['expires_at'] > now:
+            meta, body = entry
+            self._count(provider, 'fresh')
+            self._count(provider, 'bytes_saved', len(body))
+            tag = _written_tag(meta['sha1'], variant)
+            return body, tag == meta.get('written_sha1'), (key, tag)
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry[0].get('etag'):
+                request_headers['If-None-Match'] = entry[0]['etag']
+            if entry[0].get('last_modified'):
+                request_headers['If-Modified-Since'] = entry[0]['last_modified']
+        response = self.session.get(url, headers=request_headers)
+
+        if response.status_code == 304 and entry is not None:
+            meta, body = entry
+            meta['expires_at'] = _expiry(response.headers, now, self.default_ttl.get(provider, 0))
+            meta['etag'] = response.headers.get('ETag', meta.get('etag'))
+            self._save(key, meta, body)
+            self._count(provider, 'revalidated')
+            self._count(provider, 'bytes_saved', len(body))
+            tag = _written_tag(meta['sha1'], variant)
+            return body, tag == meta.get('written_sha1'), (key, tag)
+
+        body = response.content
+        if response.status_code != 200:
+            return body, False, (key, None)
+        sha1 = hashlib.sha1(body).hexdigest()
+        meta = {
+            'url_sha1': key,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'expires_at': _expiry(response.headers, now, self.default_ttl.get(provider, 0)),
+            'sha1': sha1,
+            'written_sha1': entry[0].get('written_sha1') if entry is not None else None
+        }
+        self._save(key, meta, body)
+        tag = _written_tag(sha1, variant)
+        unchanged = tag == meta['written_sha1']
+        self._count(provider, 'unchanged' if unchanged else 'misses')
+        return body, unchanged, (key, tag)
+
+    def confirm(self, tokens):
+        """Mark the bodies fetch() returned these tokens for as written to the database."""
+        for key, tag in set(tokens):
+            entry = self.local.get(key)
+            if tag is None or entry is None or entry[0].get('written_sha1') == tag:
+                continue
+            meta, body = entry
+            meta['written_sha1'] = tag
+            self._save(key, meta, body)
+
+    def stats(self):
+        """Totals since the previous call (the cache itself outlives invocations)."""
+        with self._lock:
+            totals = {name: sum(c[name] for c in self.counts.values())
+                      for name in ('requests', 'fresh', 'revalidated', 'unchanged', 'misses', 'bytes_saved')}
+            self.counts = {}
+        hits = totals['fresh'] + totals['revalidated']
+        return {
+            'cache_requests': totals['requests'],
+            'cache_hits': hits,
+            'cache_hit_rate': round(hits / totals['requests'], 3) if totals['requests'] else 0.0,
+            'cache_unchanged_bodies': totals['unchanged'],
+            'cache_bytes_saved': totals['bytes_saved'],
+            'cache_evictions': getattr(self.local, 'evicted', 0)
+        }
@@ -1,11 +1,20 @@
 import os
+import io
+import resource
+import csv
 import json
-import requests
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from psycopg2.extras import RealDictCursor, execute_values
+from db import ConnectionManager
+from rollups import refresh_daily_rollups
+from http_cache import ResponseCache, DirectoryBackend, open_store
+from retention import RetentionJob
+from streaming import StreamedForecast, FORECAST_HORIZON, first_item, items_at
+import telemetry
 
 # --- ENV CONFIG ---
 OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY')
@@ -15,12 +24,165 @@ DB_PORT = os.environ.get('DB_PORT', '5432')
 DB_NAME = os.environ.get('DB_NAME')
 DB_USER = os.environ.get('DB_USER')
 DB_PASS = os.environ.get('DB_PASS')
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '30000'))
+
+# Provider endpoints (overridable so the fetchers can be pointed at local stubs)
+OPENWEATHER_BASE_URL = os.environ.get('OPENWEATHER_BASE_URL', 'https://api.openweathermap.org/data/2.5')
+WEATHERAPI_BASE_URL = os.environ.get('WEATHERAPI_BASE_URL', 'http://api.weatherapi.com/v1')
+YR_NO_BASE_URL = os.environ.get('YR_NO_BASE_URL', 'https://api.met.no/weatherapi/locationforecast/2.0')
+OPEN_METEO_URL = os.environ.get('OPEN_METEO_URL', 'https://api.open-meteo.com/v1/forecast')
+
+# --- FETCH CONCURRENCY ---
+# 'concurrent' runs every (location, provider) pair on a thread pool, 'serial' keeps the old loop
+FETCH_MODE = os.environ.get('FETCH_MODE', 'concurrent')
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', '8'))
+# Max in-flight requests per provider, to stay inside each API's rate limits
+PROVIDER_CONCURRENCY = {
+    'openweather': int(os.environ.get('OPENWEATHER_CONCURRENCY', '2')),
+    'weatherapi': int(os.environ.get('WEATHERAPI_CONCURRENCY', '2')),
+    'yrno': int(os.environ.get('YR_NO_CONCURRENCY', '2')),
+    'openmeteo': int(os.environ.get('OPEN_METEO_CONCURRENCY', '4'))
+}
+
+# --- SPATIAL DEDUP ---
+# Farm coordinates are snapped to each provider's grid (degrees) and every distinct cell is fetched once;
+# 0 only merges farms at identical coordinates. yr.no and Open-Meteo serve ~1-10 km model grids.
+PROVIDER_GRID_DEG = {
+    'openweather': float(os.environ.get('OPENWEATHER_GRID_DEG', '0')),
+    'weatherapi': float(os.environ.get('WEATHERAPI_GRID_DEG', '0')),
+    'yrno': float(os.environ.get('YR_NO_GRID_DEG', '0.05')),
+    'openmeteo': float(os.environ.get('OPEN_METEO_GRID_DEG', '0.1'))
+}
+
+# --- RESPONSE CACHE ---
+# Conditional requests against cached provider responses; unchanged payloads are neither parsed nor written
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'true').lower() == 'true'
+CACHE_DIR = os.environ.get('CACHE_DIR', '/tmp/provider-cache')
+# Half of the default 512 MB ephemeral storage
+CACHE_MAX_MB = int(os.environ.get('CACHE_MAX_MB', '256'))
+# Optional shared tier: 's3://bucket/prefix' or a directory path
+CACHE_STORE = os.environ.get('CACHE_STORE')
+# Freshness for providers that send no Cache-Control/Expires; OpenWeather refreshes about every 10 minutes
+PROVIDER_CACHE_TTL = {
+    'openweather': int(os.environ.get('OPENWEATHER_CACHE_TTL', '600')),
+    'weatherapi': int(os.environ.get('WEATHERAPI_CACHE_TTL', '0')),
+    'yrno': int(os.environ.get('YR_NO_CACHE_TTL', '0')),
+    'openmeteo': int(os.environ.get('OPEN_METEO_CACHE_TTL', '0'))
+}
+
+# --- STREAMING PARSE ---
+# Keep only raw provider bodies between fetch and write and parse forecast rows as the writer consumes them
+# (incrementally when ijson is installed); 'false' parses every payload into row lists up front
+STREAM_PARSE = os.environ.get('STREAM_PARSE', 'true').lower() == 'true'
+
+# --- DB WRITE MODE ---
+# 'row' upserts one row per statement and commits per source (the original path),
+# 'batch' sends multi-row INSERT ... ON CONFLICT pages in a single transaction,
+# 'copy' COPYs every row into a temp staging table and merges it with one INSERT ... SELECT
+WRITE_MODE = os.environ.get('WRITE_MODE', 'batch')
+WRITE_PAGE_SIZE = int(os.environ.get('WRITE_PAGE_SIZE', '500'))
+# Leave rows whose values match the incoming ones untouched instead of rewriting them (no new tuple, WAL or index churn)
+SKIP_UNCHANGED_ROWS = os.environ.get('SKIP_UNCHANGED_ROWS', 'true').lower() == 'true'
+# Recompute weather_daily_rollups for every (farm, source, day) written, in the same transaction
+DAILY_ROLLUPS = os.environ.get('DAILY_ROLLUPS', 'true').lower() == 'true'
+
+# --- DB CONNECTION ---
+# Reused across warm invocations instead of reconnecting every time
+db = ConnectionManager(
+    statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS,
+    dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+    host=DB_HOST, port=DB_PORT, cursor_factory=RealDictCursor
+)
+
+class TimedCursor:
+    """Cursor proxy that times every SQL statement and COPY for the telemetry spans."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        with telemetry.span('sql'):
+            return self._cursor.execute(*args, **kwargs)
+
+    def copy_expert(self, *args, **kwargs):
+        with telemetry.span('sql'):
+            return self._cursor.copy_expert(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+# --- TELEMETRY ---
+# Leveled logs (LOG_LEVEL) and per-invocation EMF metrics, see telemetry.py
+telemetry.configure(service='Ingestion')
+
+# --- RETENTION ---
+# Applied when the Lambda is invoked with {"task": "retention"} (e.g. a daily EventBridge schedule)
+RETENTION_RAW_DAYS = int(os.environ.get('RETENTION_RAW_DAYS', '7'))
+RETENTION_HOURLY_DAYS = int(os.environ.get('RETENTION_HOURLY_DAYS', '90'))
+RETENTION_FORECAST_DAYS = int(os.environ.get('RETENTION_FORECAST_DAYS', '3'))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '5000'))
+# Stop starting batches after this long so the invocation ends inside the function timeout
+RETENTION_MAX_SECONDS = int(os.environ.get('RETENTION_MAX_SECONDS', '40'))
+# Extra time VACUUM may take after that; max + vacuum seconds must also fit inside the timeout
+RETENTION_VACUUM_SECONDS = int(os.environ.get('RETENTION_VACUUM_SECONDS', '15'))
 
 # --- RETRY SESSION ---
-session = requests.Session()
-retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
-session.mount('http://', HTTPAdapter(max_retries=retries))
-session.mount('https://', HTTPAdapter(max_retries=retries))
+# Built with the response cache by get_session() on the first fetch, not at import:
+# requests and urllib3 (from the AWS SDK Pandas layer) are a large part of init, and retention runs never fetch
+session = None
+response_cache = None
+_session_lock = threading.Lock()
+
+PROVIDER_URLS = {
+    'openweather': OPENWEATHER_BASE_URL,
+    'weatherapi': WEATHERAPI_BASE_URL,
+    'yrno': YR_NO_BASE_URL,
+    'openmeteo': OPEN_METEO_URL
+}
+
+def record_response(response, *args, **kwargs):
+    """Session hook: count requests and body bytes per provider."""
+    provider = next((source for source, url in PROVIDER_URLS.items() if response.url.startswith(url)), 'other')
+    telemetry.count('provider_requests', 1, Provider=provider)
+    telemetry.count('bytes_fetched', len(response.content), 'Bytes', Provider=provider)
+
+def get_session():
+    """The shared retrying session, building it and response_cache on first use."""
+    global session, response_cache
+    if session is None:
+        with _session_lock:
+            if session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                new_session = requests.Session()
+                retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+                new_session.mount('http://', HTTPAdapter(max_retries=retries, pool_maxsize=FETCH_WORKERS))
+                new_session.mount('https://', HTTPAdapter(max_retries=retries, pool_maxsize=FETCH_WORKERS))
+                new_session.hooks['response'].append(record_response)
+                response_cache = ResponseCache(
+                    new_session, DirectoryBackend(CACHE_DIR, CACHE_MAX_MB * 2 ** 20), open_store(CACHE_STORE),
+                    PROVIDER_CACHE_TTL
+                ) if RESPONSE_CACHE else None
+                session = new_session
+    return session
+
+# Cache tokens each fetcher touched and the farms its cell covers, per worker thread (set by fetch_pair)
+_fetch_context = threading.local()
+
+class Unchanged(Exception):
+    """Every payload the fetcher needs is already in the database: nothing to parse or write."""
+
+def fetch_body(url, source, headers=None, skip_unchanged=True):
+    """Raw response body for url, or None when skip_unchanged and the cached body was already written."""
+    get_session()
+    if response_cache is None:
+        return session.get(url, headers=headers).content
+    body, unchanged, token = response_cache.fetch(url, source, headers, variant=_fetch_context.farms)
+    _fetch_context.keys.append(token)
+    if unchanged and skip_unchanged:
+        return None
+    return body
 
 # --- LOCATIONS ---
 LOCATIONS = [
@@ -30,10 +192,43 @@ LOCATIONS = [
 ]
 
 # --- API HANDLERS ---
+# Each provider's forecast items are normalized by a generator, so streaming mode can feed rows to the writer lazily
+
+def parse_payload(body, current_prefix, forecast_prefix, normalize):
+    """(current object, forecast rows) from a provider body; in streaming mode the rows are a lazy StreamedForecast."""
+    if body is None:
+        return None, []
+    now = datetime.now(timezone.utc)
+    if STREAM_PARSE:
+        current = first_item(body, current_prefix) if current_prefix else None
+        return current, StreamedForecast(body, forecast_prefix, normalize, now)
+    document = json.loads(body)
+    current = next(items_at(document, current_prefix), None) if current_prefix else None
+    # Same cutoff as StreamedForecast, so both modes store the same rows
+    until = now + FORECAST_HORIZON
+    return current, [f for f in normalize(items_at(document, forecast_prefix)) if f['forecast_for'] < until]
+
+def openweather_forecasts(items):
+    for item in items:
+        yield {
+            "forecast_for": datetime.fromtimestamp(item['dt'], tz=timezone.utc),
+            "temperature_c": item['main']['temp'],
+            "humidity_percent": item['main']['humidity'],
+            "wind_speed_mps": item['wind']['speed'],
+            "wind_direction_deg": item['wind'].get('deg'),
+            "rainfall_mm": item.get('rain', {}).get('3h', 0),
+            "chance_of_rain_percent": item.get('pop', 0) * 100
+        }
 
 def fetch_openweather(location):
-    current_url = f"https://api.openweathermap.org/data/2.5/weather?lat={location['lat']}&lon={location['lon']}&appid={OPENWEATHER_API_KEY}&units=metric"
-    current_data = session.get(current_url).json()
+    forecast_url = f"{OPENWEATHER_BASE_URL}/forecast?lat={location['lat']}&lon={location['lon']}&appid={OPENWEATHER_API_KEY}&units=metric"
+    forecast_body = fetch_body(forecast_url, 'openweather')
+    # The current reading is still needed when only the forecast moved
+    current_url = f"{OPENWEATHER_BASE_URL}/weather?lat={location['lat']}&lon={location['lon']}&appid={OPENWEATHER_API_KEY}&units=metric"
+    current_body = fetch_body(current_url, 'openweather', skip_unchanged=forecast_body is None)
+    if current_body is None:
+        raise Unchanged()
+    current_data = json.loads(current_body)
     current = {
         "temperature_c": current_data['main']['temp'],
         "humidity_percent": current_data['main']['humidity'],
@@ -42,20 +237,7 @@ def fetch_openweather(location):
         "rainfall_mm": current_data.get('rain', {}).get('1h', 0),
         "solar_radiation_wm2": None
     }
-
-    forecast_url = f"https://api.openweathermap.org/data/2.5/forecast?lat={location['lat']}&lon={location['lon']}&appid={OPENWEATHER_API_KEY}&units=metric"
-    forecast_data = session.get(forecast_url).json()
-    forecasts = []
-    for item in forecast_data['list']:
-        forecasts.append({
-            "forecast_for": datetime.fromtimestamp(item['dt'], tz=timezone.utc),
-            "temperature_c": item['main']['temp'],
-            "humidity_percent": item['main']['humidity'],
-            "wind_speed_mps": item['wind']['speed'],
-            "wind_direction_deg": item['wind'].get('deg'),
-            "rainfall_mm": item.get('rain', {}).get('3h', 0),
-            "chance_of_rain_percent": item.get('pop', 0) * 100
-        })
+    _, forecasts = parse_payload(forecast_body, None, 'list.item', openweather_forecasts)
 
     return {
         "source": "openweather",
@@ -63,11 +245,25 @@ def fetch_openweather(location):
         "forecast": forecasts
     }
 
+def weatherapi_forecasts(hours):
+    for hour in hours:
+        yield {
+            "forecast_for": datetime.strptime(hour['time'], "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc),
+            "temperature_c": hour['temp_c'],
+            "humidity_percent": hour['humidity'],
+            "wind_speed_mps": hour['wind_kph'] / 3.6,
+            "wind_direction_deg": hour['wind_degree'],
+            "rainfall_mm": hour['precip_mm'],
+            "chance_of_rain_percent": hour.get('chance_of_rain', None)
+        }
+
 def fetch_weatherapi(location):
-    forecast_url = f"http://api.weatherapi.com/v1/forecast.json?key={WEATHERAPI_API_KEY}&q={location['lat']},{location['lon']}&days=5&aqi=no&alerts=no"
-    data = session.get(forecast_url).json()
+    forecast_url = f"{WEATHERAPI_BASE_URL}/forecast.json?key={WEATHERAPI_API_KEY}&q={location['lat']},{location['lon']}&days=5&aqi=no&alerts=no"
+    body = fetch_body(forecast_url, 'weatherapi')
+    if body is None:
+        raise Unchanged()
+    current, forecasts = parse_payload(body, 'current', 'forecast.forecastday.item.hour.item', weatherapi_forecasts)
 
-    current = data['current']
     current_data = {
         "temperature_c": current['temp_c'],
         "humidity_percent": current['humidity'],
@@ -77,47 +273,19 @@ def fetch_weatherapi(location):
         "solar_radiation_wm2": None
     }
 
-    forecasts = []
-    for day in data['forecast']['forecastday']:
-        for hour in day['hour']:
-            forecasts.append({
-                "forecast_for": datetime.strptime(hour['time'], "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc),
-                "temperature_c": hour['temp_c'],
-                "humidity_percent": hour['humidity'],
-                "wind_speed_mps": hour['wind_kph'] / 3.6,
-                "wind_direction_deg": hour['wind_degree'],
-                "rainfall_mm": hour['precip_mm'],
-                "chance_of_rain_percent": hour.get('chance_of_rain', None)
-            })
-
     return {
         "source": "weatherapi",
         "current": current_data,
         "forecast": forecasts
     }
 
-def fetch_yrno(location):
-    url = f"https://api.met.no/weatherapi/locationforecast/2.0/compact?lat={location['lat']}&lon={location['lon']}"
-    headers = {"User-Agent": "WeatherFetcher/1.0"}
-    data = session.get(url, headers=headers).json()
-
-    now_data = data['properties']['timeseries'][0]['data']['instant']['details']
-    current_data = {
-        "temperature_c": now_data['air_temperature'],
-        "humidity_percent": now_data.get('relative_humidity'),
-        "wind_speed_mps": now_data['wind_speed'],
-        "wind_direction_deg": now_data['wind_from_direction'],
-        "rainfall_mm": 0,
-        "solar_radiation_wm2": None
-    }
-
-    forecasts = []
-    for item in data['properties']['timeseries']:
+def yrno_forecasts(timeseries):
+    for item in timeseries:
         ts = datetime.strptime(item['time'], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
         if (ts - datetime.now(timezone.utc)).days > 5:
             break
         inst = item['data']['instant']['details']
-        forecasts.append({
+        yield {
             "forecast_for": ts,
             "temperature_c": inst.get('air_temperature'),
             "humidity_percent": inst.get('relative_humidity'),
@@ -125,7 +293,26 @@ def fetch_yrno(location):
             "wind_direction_deg": inst.get('wind_from_direction'),
             "rainfall_mm": item['data'].get('next_1_hours', {}).get('details', {}).get('precipitation_amount', 0),
             "chance_of_rain_percent": None
-        })
+        }
+
+def fetch_yrno(location):
+    url = f"{YR_NO_BASE_URL}/compact?lat={location['lat']}&lon={location['lon']}"
+    headers = {"User-Agent": "WeatherFetcher/1.0"}
+    body = fetch_body(url, 'yrno', headers)
+    if body is None:
+        raise Unchanged()
+    # The first timeseries entry is the current reading
+    first, forecasts = parse_payload(body, 'properties.timeseries.item', 'properties.timeseries.item', yrno_forecasts)
+
+    now_data = first['data']['instant']['details']
+    current_data = {
+        "temperature_c": now_data['air_temperature'],
+        "humidity_percent": now_data.get('relative_humidity'),
+        "wind_speed_mps": now_data['wind_speed'],
+        "wind_direction_deg": now_data['wind_from_direction'],
+        "rainfall_mm": 0,
+        "solar_radiation_wm2": None
+    }
 
     return {
         "source": "yrno",
@@ -133,11 +320,30 @@ def fetch_yrno(location):
         "forecast": forecasts
     }
 
+def openmeteo_forecasts(hourly_blocks):
+    # Open-Meteo's hourly data is columnar: one object of parallel arrays
+    for hourly in hourly_blocks:
+        for i in range(len(hourly['time'])):
+            forecast_time = datetime.fromisoformat(hourly['time'][i]).replace(tzinfo=timezone.utc)
+            if (forecast_time - datetime.now(timezone.utc)).days > 5:
+                break
+            yield {
+                "forecast_for": forecast_time,
+                "temperature_c": hourly['temperature_2m'][i],
+                "humidity_percent": hourly['relative_humidity_2m'][i],
+                "wind_speed_mps": hourly['wind_speed_10m'][i],
+                "wind_direction_deg": hourly['wind_direction_10m'][i],
+                "rainfall_mm": hourly['precipitation'][i],
+                "chance_of_rain_percent": None
+            }
+
 def fetch_openmeteo(location):
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={location['lat']}&longitude={location['lon']}&current=temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m,precipitation&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m,precipitation&forecast_days=5"
-    data = session.get(url).json()
+    url = f"{OPEN_METEO_URL}?latitude={location['lat']}&longitude={location['lon']}&current=temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m,precipitation&hourly=temperature_2m,relative_humidity_2m,wind_speed_10m,wind_direction_10m,precipitation&forecast_days=5"
+    body = fetch_body(url, 'openmeteo')
+    if body is None:
+        raise Unchanged()
+    current, forecasts = parse_payload(body, 'current', 'hourly', openmeteo_forecasts)
 
-    current = data['current']
     current_data = {
         "temperature_c": current.get('temperature_2m'),
         "humidity_percent": current.get('relative_humidity_2m'),
@@ -147,124 +353,516 @@ def fetch_openmeteo(location):
         "solar_radiation_wm2": None
     }
 
-    forecasts = []
-    for i in range(len(data['hourly']['time'])):
-        forecast_time = datetime.fromisoformat(data['hourly']['time'][i]).replace(tzinfo=timezone.utc)
-        if (forecast_time - datetime.now(timezone.utc)).days > 5:
-            break
-        forecasts.append({
-            "forecast_for": forecast_time,
-            "temperature_c": data['hourly']['temperature_2m'][i],
-            "humidity_percent": data['hourly']['relative_humidity_2m'][i],
-            "wind_speed_mps": data['hourly']['wind_speed_10m'][i],
-            "wind_direction_deg": data['hourly']['wind_direction_10m'][i],
-            "rainfall_mm": data['hourly']['precipitation'][i],
-            "chance_of_rain_percent": None
-        })
-
     return {
         "source": "openmeteo",
         "current": current_data,
         "forecast": forecasts
     }
 
+PROVIDERS = {
+    'openweather': fetch_openweather,
+    'weatherapi': fetch_weatherapi,
+    'yrno': fetch_yrno,
+    'openmeteo': fetch_openmeteo
+}
+PROVIDER_SEMAPHORES = {source: threading.BoundedSemaphore(limit) for source, limit in PROVIDER_CONCURRENCY.items()}
+
+# --- FETCH PIPELINE ---
+
+def snap(location, grid):
+    """Centre of the grid cell (in degrees) the location falls in; grid 0 leaves it as is."""
+    if not grid:
+        return location['lat'], location['lon']
+    return round(round(location['lat'] / grid) * grid, 4), round(round(location['lon'] / grid) * grid, 4)
+
+def plan_fetches(locations):
+    """One (cell location, source, farms) per distinct provider grid cell, in first-seen order."""
+    cells = {}
+    for location in locations:
+        for source in PROVIDERS:
+            lat, lon = snap(location, PROVIDER_GRID_DEG[source])
+            cell = cells.setdefault((source, lat, lon), ({'lat': lat, 'lon': lon}, source, []))
+            cell[2].append(location)
+    return list(cells.values())
+
+def fetch_pair(location, source, farms=None):
+    fetcher = PROVIDERS[source]
+    _fetch_context.keys = []
+    # The shared response counts as written only for this set of farms
+    _fetch_context.farms = ','.join(sorted(farm['farm_id'] for farm in farms)) if farms else None
+    try:
+        with PROVIDER_SEMAPHORES[source], telemetry.span('fetch', Provider=source):
+            data = fetcher(location)
+        data['cache_keys'] = _fetch_context.keys
+        return location, fetcher, data, None
+    except Unchanged as e:
+        telemetry.count('unchanged_payloads', 1, Provider=source)
+        return location, fetcher, None, e
+    except Exception as e:
+        telemetry.count('fetch_errors', 1, Provider=source)
+        return location, fetcher, None, e
+
+def fetch_all(locations, mode=None, plan=None):
+    """Fetch each grid cell once and fan the result out; results come back in (location, provider) order."""
+    mode = mode or FETCH_MODE
+    plan = plan if plan is not None else plan_fetches(locations)
+    if mode == 'serial' or len(plan) <= 1:
+        fetched = [fetch_pair(*cell) for cell in plan]
+    else:
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(plan))) as pool:
+            fetched = list(pool.map(lambda cell: fetch_pair(*cell), plan))
+
+    by_farm = {}
+    for (_, source, farms), (_, fetcher, data, error) in zip(plan, fetched):
+        if len(farms) > 1:
+            telemetry.count('fetches_saved', len(farms) - 1, Provider=source)
+        for farm in farms:
+            by_farm[(farm['farm_id'], source)] = (farm, fetcher, data, error)
+    return [by_farm[(location['farm_id'], source)] for location in locations for source in PROVIDERS]
+
 # --- DB INSERTS ---
 
-def insert_current_weather(conn, cursor, source, farm_id, location, data, timestamp):
+def insert_current_weather(conn, cursor, source, farm_id, location, data, timestamp, counts=None):
     try:
-        cursor.execute("""
-            INSERT INTO current_weather (
-                source, farm_id, location, timestamp,
-                temperature_c, humidity_percent, wind_speed_mps,
-                wind_direction_deg, rainfall_mm, solar_radiation_wm2
-            )
-            VALUES (%s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s,
-                    %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (farm_id, source, timestamp)
-            DO UPDATE SET
-                location = EXCLUDED.location,
-                temperature_c = EXCLUDED.temperature_c,
-                humidity_percent = EXCLUDED.humidity_percent,
-                wind_speed_mps = EXCLUDED.wind_speed_mps,
-                wind_direction_deg = EXCLUDED.wind_direction_deg,
-                rainfall_mm = EXCLUDED.rainfall_mm,
-                solar_radiation_wm2 = EXCLUDED.solar_radiation_wm2
-        """, (
-            source, farm_id, location['lon'], location['lat'], timestamp,
-            data['temperature_c'], data['humidity_percent'], data['wind_speed_mps'],
-            data['wind_direction_deg'], data['rainfall_mm'], data['solar_radiation_wm2']
-        ))
+        cursor.execute(_upsert_sql('current_weather', 'VALUES ' + _row_template('current_weather')),
+                       current_row(source, farm_id, location, data, timestamp))
+        changed = cursor.fetchall()
+        if DAILY_ROLLUPS:
+            refresh_daily_rollups(cursor, 'current_weather', changed_days(changed))
+        if changed:
+            advance_watermarks(cursor, 'current_weather', [farm_id], timestamp)
         conn.commit()
     except Exception as e:
         conn.rollback()
         raise e
+    add_counts(counts, row_counts({source: 1}, changed))
 
-def insert_forecast_weather(conn, cursor, source, farm_id, location, data, fetched_at):
+def insert_forecast_weather(conn, cursor, source, farm_id, location, data, fetched_at, counts=None):
+    sql = _upsert_sql('forecast_weather', 'VALUES ' + _row_template('forecast_weather'))
+    changed = []
     try:
         for forecast in data:
-            cursor.execute("""
-                INSERT INTO forecast_weather (
-                    source, farm_id, location, forecast_for, fetched_at,
-                    temperature_c, humidity_percent, wind_speed_mps,
-                    wind_direction_deg, rainfall_mm, chance_of_rain_percent
-                )
-                VALUES (%s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s, %s,
-                        %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (farm_id, source, forecast_for)
-                DO UPDATE SET
-                    location = EXCLUDED.location,
-                    fetched_at = EXCLUDED.fetched_at,
-                    temperature_c = EXCLUDED.temperature_c,
-                    humidity_percent = EXCLUDED.humidity_percent,
-                    wind_speed_mps = EXCLUDED.wind_speed_mps,
-                    wind_direction_deg = EXCLUDED.wind_direction_deg,
-                    rainfall_mm = EXCLUDED.rainfall_mm,
-                    chance_of_rain_percent = EXCLUDED.chance_of_rain_percent
-            """, (
-                source, farm_id, location['lon'], location['lat'], forecast['forecast_for'], fetched_at,
-                forecast['temperature_c'], forecast['humidity_percent'], forecast.get('wind_speed_mps'),
-                forecast.get('wind_direction_deg'), forecast['rainfall_mm'], forecast.get('chance_of_rain_percent')
-            ))
+            cursor.execute(sql, forecast_row(source, farm_id, location, forecast, fetched_at))
+            changed += cursor.fetchall()
+        if DAILY_ROLLUPS:
+            refresh_daily_rollups(cursor, 'forecast_weather', changed_days(changed))
+        if changed:
+            advance_watermarks(cursor, 'forecast_weather', [farm_id], fetched_at)
         conn.commit()
     except Exception as e:
         conn.rollback()
         raise e
+    add_counts(counts, row_counts({source: len(data)}, changed))
+
+# --- WATERMARKS ---
+
+def advance_watermarks(cursor, table, farm_ids, watermark):
+    """Record that new rows landed for these farms, in the same transaction as the rows.
+
+    The rules engine reuses a rule's previous outcome only while its farm's
+    (watermark, revision) for the table is unchanged. revision moves on every
+    write, so sources written in separate transactions of one run are seen too.
+    """
+    farm_ids = sorted(set(farm_ids))
+    if not farm_ids:
+        return
+    execute_values(cursor, """
+        INSERT INTO ingestion_watermarks (farm_id, table_name, watermark)
+        VALUES %s
+        ON CONFLICT (farm_id, table_name)
+        DO UPDATE SET
+            watermark = GREATEST(ingestion_watermarks.watermark, EXCLUDED.watermark),
+            revision = ingestion_watermarks.revision + 1,
+            updated_at = NOW()
+    """, [(farm_id, table, watermark) for farm_id in farm_ids])
+
+# --- PARTITIONS ---
+# Month partitions already known to exist, and which tables are partitioned at
+# all, kept across warm invocations so the check costs nothing most runs
+known_partitions = set()
+partitioned_tables = {}
+
+def _month(ts):
+    return ts.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def ensure_partitions(conn, cursor, results, timestamp):
+    """Create any missing month partition the fetched rows will land in, before the write transaction."""
+    months = {('current_weather', _month(timestamp)), ('forecast_weather', _month(timestamp))}
+    for location, fetcher, data, error in results:
+        if error:
+            continue
+        if isinstance(data['forecast'], StreamedForecast):
+            # Not parsed yet: cover every month up to the horizon the rows are clipped to
+            months.add(('forecast_weather', _month(timestamp + FORECAST_HORIZON)))
+        else:
+            months.update(('forecast_weather', _month(f['forecast_for'])) for f in data['forecast'])
+    missing = sorted(months - known_partitions)
+    if not missing:
+        return
+    try:
+        for table in {table for table, _ in missing} - set(partitioned_tables):
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+            row = cursor.fetchone()
+            partitioned_tables[table] = bool(row) and row['relkind'] == 'p'
+        for table, month in missing:
+            if partitioned_tables[table]:
+                cursor.execute("SELECT ensure_monthly_partition(%s, %s)", (table, month))
+            known_partitions.add((table, month))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        telemetry.error("Error creating partitions: %s", e)
+        raise
+
+# --- BULK WRITES ---
+
+# Row layout shared by the batch and COPY paths; lon/lat become the location point
+BULK_TABLES = {
+    'current_weather': {
+        'key': ('farm_id', 'source', 'timestamp'),
+        'columns': ('source', 'farm_id', 'lon', 'lat', 'timestamp',
+                    'temperature_c', 'humidity_percent', 'wind_speed_mps',
+                    'wind_direction_deg', 'rainfall_mm', 'solar_radiation_wm2')
+    },
+    'forecast_weather': {
+        'key': ('farm_id', 'source', 'forecast_for'),
+        'columns': ('source', 'farm_id', 'lon', 'lat', 'forecast_for', 'fetched_at',
+                    'temperature_c', 'humidity_percent', 'wind_speed_mps',
+                    'wind_direction_deg', 'rainfall_mm', 'chance_of_rain_percent')
+    }
+}
+
+def current_row(source, farm_id, location, data, timestamp):
+    return (
+        source, farm_id, location['lon'], location['lat'], timestamp,
+        data['temperature_c'], data['humidity_percent'], data['wind_speed_mps'],
+        data['wind_direction_deg'], data['rainfall_mm'], data['solar_radiation_wm2']
+    )
+
+def forecast_row(source, farm_id, location, forecast, fetched_at):
+    return (
+        source, farm_id, location['lon'], location['lat'], forecast['forecast_for'], fetched_at,
+        forecast['temperature_c'], forecast['humidity_percent'], forecast.get('wind_speed_mps'),
+        forecast.get('wind_direction_deg'), forecast['rainfall_mm'], forecast.get('chance_of_rain_percent')
+    )
+
+def _row_template(table):
+    columns = BULK_TABLES[table]['columns']
+    return '(%s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), ' + ', '.join(['%s'] * (len(columns) - 4)) + ')'
+
+def _upsert_sql(table, select_sql):
+    """Upsert select_sql's rows; returns one (source, farm_id, day, inserted, rows) group per changed day.
+
+    With SKIP_UNCHANGED_ROWS a conflicting row whose values all match is not
+    rewritten (a newer fetched_at alone is not a change). The join sees the
+    table as it was before the statement, so unmatched rows were inserted.
+    """
+    spec = BULK_TABLES[table]
+    value_columns = [c for c in spec['columns'] if c not in ('lon', 'lat')]
+    insert_columns = ['source', 'farm_id', 'location'] + value_columns[2:]
+    updates = ['location'] + [c for c in value_columns if c not in spec['key']]
+    compared = [c for c in updates if c != 'fetched_at']
+    guard = (f"WHERE ({', '.join(f'{table}.{c}' for c in compared)}) "
+             f"IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in compared)})") if SKIP_UNCHANGED_ROWS else ''
+    time_column = spec['key'][2]
+    return f"""
+        WITH upserted AS (
+            INSERT INTO {table} ({', '.join(insert_columns)})
+            {select_sql}
+            ON CONFLICT ({', '.join(spec['key'])})
+            DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in updates)}
+            {guard}
+            RETURNING source, farm_id, {time_column}
+        )
+        SELECT u.source, u.farm_id, (u.{time_column} AT TIME ZONE 'UTC')::DATE AS day,
+               w.farm_id IS NULL AS inserted, COUNT(*) AS rows
+        FROM upserted u
+        LEFT JOIN {table} w ON w.farm_id = u.farm_id AND w.source = u.source AND w.{time_column} = u.{time_column}
+        GROUP BY 1, 2, 3, 4
+    """
+
+def row_counts(sent, changed):
+    """{source: {'inserted', 'updated', 'skipped'}} from the rows sent per source and the upsert's changed groups."""
+    counts = {source: {'inserted': 0, 'updated': 0, 'skipped': rows} for source, rows in sent.items()}
+    for group in changed:
+        source_counts = counts[group['source']]
+        source_counts['inserted' if group['inserted'] else 'updated'] += group['rows']
+        source_counts['skipped'] -= group['rows']
+    return counts
+
+def add_counts(total, counts):
+    if total is None:
+        return
+    for source, source_counts in counts.items():
+        for name, value in source_counts.items():
+            total.setdefault(source, {'inserted': 0, 'updated': 0, 'skipped': 0})[name] += value
+
+def changed_days(changed):
+    return {(group['farm_id'], group['source'], group['day']) for group in changed}
+
+def _pages(table, rows, size):
+    # A multi-row ON CONFLICT DO UPDATE cannot touch the same key twice, so each
+    # page keeps only the last row per key (the per-row path's last-write-wins)
+    columns = BULK_TABLES[table]['columns']
+    key_index = [columns.index(c) for c in BULK_TABLES[table]['key']]
+    page = {}
+    for row in rows:
+        page[tuple(row[i] for i in key_index)] = row
+        if len(page) >= size:
+            yield list(page.values())
+            page = {}
+    if page:
+        yield list(page.values())
+
+def upsert_rows_batch(cursor, table, rows, page_size=None):
+    """(rows sent per source, changed groups) for multi-row upserts of rows."""
+    template = _row_template(table)
+    sql = _upsert_sql(table, 'VALUES %s')
+    sent = {}
+    changed = []
+    for page in _pages(table, rows, page_size or WRITE_PAGE_SIZE):
+        changed += execute_values(cursor, sql, page, template=template, page_size=len(page), fetch=True)
+        for row in page:
+            sent[row[0]] = sent.get(row[0], 0) + 1
+    return sent, changed
+
+def upsert_rows_copy(cursor, table, rows):
+    """(rows sent per source, changed groups) for a COPY into a staging table merged with one upsert."""
+    spec = BULK_TABLES[table]
+    columns = spec['columns']
+    stage = f"{table}_stage"
+    cursor.execute(f"""
+        CREATE TEMP TABLE {stage} (
+            seq INTEGER, source TEXT, farm_id TEXT, lon DOUBLE PRECISION, lat DOUBLE PRECISION,
+            {', '.join(f'{c} TIMESTAMPTZ' for c in columns[4:] if c in ('timestamp', 'forecast_for', 'fetched_at'))},
+            {', '.join(f'{c} REAL' for c in columns[4:] if c not in ('timestamp', 'forecast_for', 'fetched_at'))}
+        ) ON COMMIT DROP
+    """)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    sent = {}
+    count = 0
+    for count, row in enumerate(rows, 1):
+        writer.writerow((count,) + tuple(v.isoformat() if isinstance(v, datetime) else v for v in row))
+        sent[row[0]] = sent.get(row[0], 0) + 1
+    if not count:
+        return sent, []
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {stage} (seq, {', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    value_columns = [c for c in columns if c not in ('lon', 'lat')]
+    select_sql = f"""
+        SELECT DISTINCT ON ({', '.join(spec['key'])})
+            source, farm_id, ST_SetSRID(ST_MakePoint(lon, lat), 4326), {', '.join(value_columns[2:])}
+        FROM {stage}
+        ORDER BY {', '.join(spec['key'])}, seq DESC
+    """
+    cursor.execute(_upsert_sql(table, select_sql))
+    return sent, cursor.fetchall()
+
+def write_results_per_row(conn, cursor, results, timestamp, errors, stored=None, counts=None):
+    """Upsert each result in its own transactions; results that reach the database are appended to stored.
+
+    counts collects rows inserted, updated and skipped per source.
+    """
+    written = 0
+    for result in results:
+        location, fetcher, data, error = result
+        try:
+            if error:
+                raise error
+            telemetry.info("Fetched data for %s from %s", location['farm_id'], data['source'])
+            # insert_forecast_weather walks the rows more than once
+            forecasts = list(data['forecast'])
+            insert_current_weather(conn, cursor, data['source'], location['farm_id'], location, data['current'],
+                                   timestamp, counts)
+            insert_forecast_weather(conn, cursor, data['source'], location['farm_id'], location, forecasts,
+                                    timestamp, counts)
+            written += 1 + len(forecasts)
+            if stored is not None:
+                stored.append(result)
+        except Exception as e:
+            telemetry.error("Error processing %s for %s: %s", fetcher.__name__, location['farm_id'], e)
+            errors.append(f"{fetcher.__name__} for {location['farm_id']}: {str(e)}")
+            continue
+    return written
+
+def write_results_bulk(conn, cursor, results, timestamp, errors, mode=None, stored=None, counts=None):
+    """Write every fetched row for the run in one transaction; on commit the results are appended to stored.
+
+    counts collects rows inserted, updated and skipped per source. Rollups
+    and watermarks only move for the days and farms whose rows changed.
+
+    Forecast rows are pulled through a generator straight into the upsert
+    pages (or the COPY buffer), so streamed payloads are parsed one at a time.
+    """
+    mode = mode or WRITE_MODE
+    current_rows = []
+    prepared = []
+    for result in results:
+        location, fetcher, data, error = result
+        try:
+            if error:
+                raise error
+            telemetry.info("Fetched data for %s from %s", location['farm_id'], data['source'])
+            current_rows.append(current_row(data['source'], location['farm_id'], location, data['current'], timestamp))
+            prepared.append(result)
+        except Exception as e:
+            telemetry.error("Error processing %s for %s: %s", fetcher.__name__, location['farm_id'], e)
+            errors.append(f"{fetcher.__name__} for {location['farm_id']}: {str(e)}")
+
+    # Farms sharing a grid cell share one payload: parse it once and fan each row out to all of them
+    payloads = {}
+    for index, (location, fetcher, data, _) in enumerate(prepared):
+        payloads.setdefault(id(data), (data, []))[1].append((index, location, fetcher))
+    failed = set()
+
+    def forecast_rows():
+        for data, farms in payloads.values():
+            try:
+                for forecast in data['forecast']:
+                    for _, location, _ in farms:
+                        yield forecast_row(data['source'], location['farm_id'], location, forecast, timestamp)
+            except Exception as e:
+                # A payload that fails to parse part-way keeps the rows it already yielded but is not marked written
+                for index, location, fetcher in farms:
+                    failed.add(index)
+                    telemetry.error("Error processing %s for %s: %s", fetcher.__name__, location['farm_id'], e)
+                    errors.append(f"{fetcher.__name__} for {location['farm_id']}: {str(e)}")
+
+    upsert = upsert_rows_copy if mode == 'copy' else upsert_rows_batch
+    try:
+        run_counts = {}
+        written = 0
+        for table, rows in (('current_weather', current_rows), ('forecast_weather', forecast_rows())):
+            sent, changed = upsert(cursor, table, rows)
+            written += sum(sent.values())
+            add_counts(run_counts, row_counts(sent, changed))
+            if DAILY_ROLLUPS:
+                refresh_daily_rollups(cursor, table, changed_days(changed))
+            advance_watermarks(cursor, table, [group['farm_id'] for group in changed], timestamp)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        telemetry.error("Error in bulk write (%s): %s", mode, e)
+        errors.append(f"bulk write ({mode}): {str(e)}")
+        return 0
+    if stored is not None:
+        stored.extend(result for index, result in enumerate(prepared) if index not in failed)
+    add_counts(counts, run_counts)
+    return written
+
+# --- MAINTENANCE ---
+
+def run_retention():
+    started = time.perf_counter()
+    conn = db.get()
+    broken = False
+    try:
+        job = RetentionJob(conn, RETENTION_RAW_DAYS, RETENTION_HOURLY_DAYS, RETENTION_FORECAST_DAYS,
+                           RETENTION_BATCH_SIZE, RETENTION_MAX_SECONDS, log=telemetry.info,
+                           vacuum_seconds=RETENTION_VACUUM_SECONDS)
+        with telemetry.span('retention'):
+            stats = job.run()
+        for name in ('rows_deleted', 'rows_downsampled', 'rows_reclaimed', 'partitions_dropped'):
+            telemetry.count(name, stats[name])
+        telemetry.count('bytes_dropped', stats['bytes_dropped'], 'Bytes')
+        telemetry.info("Retention %s: %d rows reclaimed, %d partitions dropped, %d -> %d bytes",
+                       'complete' if stats['complete'] else 'stopped early', stats['rows_reclaimed'],
+                       stats['partitions_dropped'], stats['bytes_before'], stats['bytes_after'])
+        return {'statusCode': 200, 'body': json.dumps({'message': 'Retention applied', 'stats': stats})}
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        db.release(conn, broken)
+        telemetry.observe('invocation', time.perf_counter() - started)
+        telemetry.flush()
 
 # --- MAIN LAMBDA HANDLER ---
 
 def lambda_handler(event, context):
-    conn = psycopg2.connect(
-        dbname=DB_NAME, user=DB_USER, password=DB_PASS,
-        host=DB_HOST, port=DB_PORT, cursor_factory=RealDictCursor
-    )
-    cursor = conn.cursor()
+    if isinstance(event, dict) and event.get('task') == 'retention':
+        return run_retention()
+    timestamp = datetime.now(timezone.utc)
+    errors = []
+
+    # Fetch everything first so the DB connection is never held across HTTP calls
+    fetch_started = time.perf_counter()
+    plan = plan_fetches(LOCATIONS)
+    results = fetch_all(LOCATIONS, plan=plan)
+    fetch_seconds = time.perf_counter() - fetch_started
+    fetches_saved = len(results) - len(plan)
+    telemetry.info("Fetched %d provider responses for %d farm/provider pairs in %.2fs (%s, %d calls saved)",
+                   len(plan), len(results), fetch_seconds, FETCH_MODE, fetches_saved)
+    # Payloads identical to what was last written skip the write entirely
+    unchanged = [result for result in results if isinstance(result[3], Unchanged)]
+    results = [result for result in results if not isinstance(result[3], Unchanged)]
+    if unchanged:
+        telemetry.info("%d provider response(s) unchanged since the last write", len(unchanged))
+
+    conn = db.get()
+    cursor = TimedCursor(conn.cursor())
+    broken = False
 
     try:
-        fetchers = [fetch_openweather, fetch_weatherapi, fetch_yrno, fetch_openmeteo]
-        timestamp = datetime.now(timezone.utc)
-        errors = []
-
-        for location in LOCATIONS:
-            for fetcher in fetchers:
-                try:
-                    data = fetcher(location)
-                    print(f"Fetched data for {location['farm_id']} from {data['source']}")
-                    insert_current_weather(conn, cursor, data['source'], location['farm_id'], location, data['current'], timestamp)
-                    insert_forecast_weather(conn, cursor, data['source'], location['farm_id'], location, data['forecast'], timestamp)
-                except Exception as e:
-                    print(f"Error processing {fetcher.__name__} for {location['farm_id']}: {str(e)}")
-                    errors.append(f"{fetcher.__name__} for {location['farm_id']}: {str(e)}")
-                    continue
+        ensure_partitions(conn, cursor, results, timestamp)
+        write_started = time.perf_counter()
+        stored = []
+        counts = {}
+        if WRITE_MODE == 'row':
+            rows_written = write_results_per_row(conn, cursor, results, timestamp, errors, stored, counts)
+        else:
+            rows_written = write_results_bulk(conn, cursor, results, timestamp, errors, stored=stored, counts=counts)
+        write_seconds = time.perf_counter() - write_started
+        if response_cache is not None:
+            # A cell's response is only written once every farm it fans out to is in the database
+            stored_ids = {id(result) for result in stored}
+            unwritten = {token for result in results if id(result) not in stored_ids and result[2]
+                         for token in result[2]['cache_keys']}
+            response_cache.confirm(token for _, _, data, _ in stored for token in data['cache_keys']
+                                   if token not in unwritten)
+        stats = {
+            **db.stats(),
+            'write_mode': WRITE_MODE,
+            'rows_written': rows_written,
+            'write_seconds': round(write_seconds, 3),
+            'rows_per_second': round(rows_written / write_seconds, 1) if write_seconds else 0,
+            **{f"rows_{name}": sum(c[name] for c in counts.values()) for name in ('inserted', 'updated', 'skipped')},
+            'rows_by_source': counts,
+            'provider_fetches': len(plan),
+            'fetches_saved': fetches_saved,
+            'unchanged_payloads': len(unchanged),
+            'stream_parse': STREAM_PARSE,
+            # ru_maxrss is in KiB on Linux; it covers the container's lifetime, not just this invocation
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            **(response_cache.stats() if response_cache is not None else {})
+        }
+        telemetry.count('rows_written', rows_written)
+        for source, source_counts in counts.items():
+            for name, value in source_counts.items():
+                telemetry.count(f"rows_{name}", value, Provider=source)
+        telemetry.gauge('peak_rss_mb', stats['peak_rss_mb'], 'Megabytes')
+        telemetry.observe('write', write_seconds)
+        telemetry.info("Wrote %d rows in %.2fs (%s rows/s, %s): %d inserted, %d updated, %d unchanged", rows_written,
+                       write_seconds, stats['rows_per_second'], WRITE_MODE, stats['rows_inserted'],
+                       stats['rows_updated'], stats['rows_skipped'])
 
         if errors:
             return {
                 'statusCode': 500,
-                'body': json.dumps({'message': 'Some data ingestion failed', 'errors': errors})
+                'body': json.dumps({'message': 'Some data ingestion failed', 'errors': errors, 'stats': stats})
             }
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': 'Weather data ingested successfully'})
+            'body': json.dumps({'message': 'Weather data ingested successfully', 'stats': stats})
         }
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
     finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+        if not conn.closed:
+            cursor.close()
+        db.release(conn, broken)
+        telemetry.observe('invocation', time.perf_counter() - fetch_started)
+        telemetry.flush()
\ No newline at end of file
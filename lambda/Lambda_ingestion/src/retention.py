@@ -0,0 +1,325 @@
+"""Retention, downsampling and compaction for the weather tables.
+
+Policies, oldest data first:
+
+- current_weather rows older than hourly_days are deleted; whole month
+  partitions past that point are dropped instead of deleted row by row.
+- current_weather rows older than raw_days are downsampled in place to one
+  row per (farm_id, source, UTC hour): values averaged (wind direction as a
+  vector mean), the latest location kept, timestamp set to the hour.
+- forecast_weather rows whose forecast_for is more than forecast_days in
+  the past are deleted (partitions dropped where possible).
+
+weather_daily_rollups is left alone, so DAY_DIFF> and other day-level
+history outlives the raw rows. Deletes and downsampling run in batches of
+batch_size rows, each in its own short transaction, under a lock_timeout,
+and stop starting new batches after max_seconds; the next run picks up
+where this one stopped. Only the partitions the batches touched are
+vacuumed afterwards, and with vacuum_seconds set VACUUM stops that long
+after the batch deadline. Run it on a schedule through the ingestion Lambda
+(event {"task": "retention"}) or from the command line:
+
+    DB_HOST=... DB_NAME=... DB_USER=... DB_PASSWORD=... python retention.py --raw-days 7 --hourly-days 90
+"""
+import os
+import re
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+TIME_COLUMNS = {
+    'current_weather': 'timestamp',
+    'forecast_weather': 'forecast_for'
+}
+CURRENT_METRICS = ('temperature_c', 'humidity_percent', 'wind_speed_mps', 'rainfall_mm', 'solar_radiation_wm2')
+# Partitions created by ensure_monthly_partition(): <parent>_yYYYYmMM
+_PARTITION_NAME = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def _hour(column):
+    return f"(date_trunc('hour', {column} AT TIME ZONE 'UTC') AT TIME ZONE 'UTC')"
+
+
+def _month_partitions(cursor, table):
+    """[(partition name, month start, month end)] for table, or None if it is not partitioned."""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    if not row or row['relkind'] != 'p':
+        return None
+    cursor.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    partitions = []
+    for row in cursor.fetchall():
+        match = _PARTITION_NAME.search(row['relname'])
+        if match:
+            start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            end = (start + timedelta(days=32)).replace(day=1)
+            partitions.append((row['relname'], start, end))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def _relation_bytes(cursor, table):
+    cursor.execute("""
+        SELECT COALESCE(SUM(pg_total_relation_size(c.oid)), 0) AS bytes
+        FROM pg_class c
+        WHERE c.oid = to_regclass(%s) OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))
+    """, (table, table))
+    return int(cursor.fetchone()['bytes'])
+
+
+class RetentionJob:
+    """One maintenance pass over both weather tables; run() returns what it reclaimed."""
+
+    def __init__(self, conn, raw_days=7, hourly_days=90, forecast_days=3, batch_size=5000,
+                 max_seconds=45, lock_timeout_ms=5000, now=None, log=print, vacuum_seconds=None):
+        self.conn = conn
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        self.forecast_days = forecast_days
+        self.batch_size = batch_size
+        self.deadline = time.monotonic() + max_seconds
+        self.vacuum_deadline = None if vacuum_seconds is None else self.deadline + vacuum_seconds
+        self.lock_timeout_ms = lock_timeout_ms
+        self.now = now or datetime.now(timezone.utc)
+        self.log = log
+        # Partitions (or unpartitioned tables) that lost rows, as regclass names, for vacuum()
+        self.touched = set()
+        self.stats = {
+            'partitions_dropped': 0, 'rows_deleted': 0, 'rows_downsampled': 0, 'rows_compacted_into': 0,
+            'bytes_dropped': 0, 'batches': 0, 'relations_vacuumed': 0, 'complete': True
+        }
+
+    def _out_of_time(self):
+        if time.monotonic() >= self.deadline:
+            self.stats['complete'] = False
+            return True
+        return False
+
+    def _cursor(self):
+        cursor = self.conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"SET lock_timeout = {int(self.lock_timeout_ms)}")
+        return cursor
+
+    def drop_partitions(self, table, cutoff):
+        """Drop month partitions that end at or before cutoff (no-op if table is not partitioned)."""
+        with self._cursor() as cursor:
+            partitions = _month_partitions(cursor, table)
+            self.conn.commit()
+            if partitions is None:
+                return
+            for name, start, end in partitions:
+                if end > cutoff or self._out_of_time():
+                    break
+                try:
+                    cursor.execute("SELECT pg_total_relation_size(to_regclass(%s)) AS bytes", (name,))
+                    size = int(cursor.fetchone()['bytes'])
+                    cursor.execute(f'DROP TABLE "{name}"')
+                    self.conn.commit()
+                except psycopg2.errors.LockNotAvailable:
+                    self.conn.rollback()
+                    self.log(f"Skipped dropping {name}: table busy")
+                    continue
+                self.stats['partitions_dropped'] += 1
+                self.stats['bytes_dropped'] += size
+                self.log(f"Dropped {name} ({start:%Y-%m}, {size // 1024} KiB)")
+
+    def delete_before(self, table, cutoff):
+        """Delete rows whose time is before cutoff, batch_size rows per transaction."""
+        column = TIME_COLUMNS[table]
+        sql = f"""
+            WITH gone AS (
+                DELETE FROM {table} w
+                USING (
+                    SELECT farm_id, source, {column} FROM {table}
+                    WHERE {column} < %(cutoff)s
+                    ORDER BY {column}
+                    LIMIT %(limit)s
+                ) doomed
+                WHERE w.farm_id = doomed.farm_id AND w.source = doomed.source AND w.{column} = doomed.{column}
+                  AND w.{column} < %(cutoff)s
+                RETURNING w.tableoid
+            )
+            SELECT tableoid::regclass::text AS relation, COUNT(*) AS rows FROM gone GROUP BY 1
+        """
+        with self._cursor() as cursor:
+            while not self._out_of_time():
+                try:
+                    cursor.execute(sql, {'cutoff': cutoff, 'limit': self.batch_size})
+                    relations = cursor.fetchall()
+                    self.conn.commit()
+                except psycopg2.errors.LockNotAvailable:
+                    self.conn.rollback()
+                    self.log(f"Stopped deleting from {table}: table busy")
+                    return
+                deleted = sum(row['rows'] for row in relations)
+                self.touched.update(row['relation'] for row in relations)
+                self.stats['rows_deleted'] += deleted
+                self.stats['batches'] += 1
+                if deleted < self.batch_size:
+                    return
+
+    def downsample_current(self, since, cutoff):
+        """Collapse current_weather rows in [since, cutoff) to one row per farm, source and UTC hour."""
+        hour = _hour('timestamp')
+        # Hours that still hold a raw reading; a compacted hour is a single row on the hour
+        find_sql = f"""
+            SELECT farm_id, source, {hour} AS hour, COUNT(*) AS rows
+            FROM current_weather
+            WHERE timestamp >= %(since)s AND timestamp < %(cutoff)s
+            GROUP BY 1, 2, 3
+            HAVING COUNT(*) > 1 OR MIN(timestamp) <> {hour}
+            ORDER BY 3
+            LIMIT %(limit)s
+        """
+        averages = ', '.join(f"AVG(r.{m})" for m in CURRENT_METRICS)
+
+        def compact_sql(bounds):
+            # bounds repeats the batch's time range as constants so only its partitions are scanned
+            return f"""
+                WITH buckets(farm_id, source, hour) AS (VALUES %s),
+                removed AS (
+                    DELETE FROM current_weather w
+                    USING buckets b
+                    WHERE w.farm_id = b.farm_id AND w.source = b.source
+                      AND w.timestamp >= b.hour AND w.timestamp < b.hour + INTERVAL '1 hour'
+                      AND {bounds}
+                    RETURNING w.*, w.tableoid AS relation_oid
+                ),
+                inserted AS (
+                    INSERT INTO current_weather
+                        (source, farm_id, location, timestamp, {', '.join(CURRENT_METRICS)}, wind_direction_deg)
+                    SELECT r.source, r.farm_id, (ARRAY_AGG(r.location ORDER BY r.timestamp DESC))[1],
+                           {_hour('r.timestamp')}, {averages},
+                           -- Vector mean, so 350 and 10 degrees average to 0 rather than 180
+                           MOD((DEGREES(ATAN2(AVG(SIN(RADIANS(r.wind_direction_deg))),
+                                              AVG(COS(RADIANS(r.wind_direction_deg))))) + 360)::NUMERIC, 360)
+                    FROM removed r
+                    GROUP BY r.farm_id, r.source, {_hour('r.timestamp')}
+                    RETURNING 1
+                )
+                SELECT (SELECT COUNT(*) FROM inserted) AS compacted,
+                       ARRAY(SELECT DISTINCT relation_oid::regclass::text FROM removed) AS relations
+            """
+        with self._cursor() as cursor:
+            while not self._out_of_time():
+                cursor.execute(find_sql, {'since': since, 'cutoff': cutoff, 'limit': max(1, self.batch_size // 4)})
+                buckets = cursor.fetchall()
+                if not buckets:
+                    self.conn.commit()
+                    return
+                bounds = cursor.mogrify("w.timestamp >= %s AND w.timestamp < %s",
+                                        (buckets[0]['hour'], buckets[-1]['hour'] + timedelta(hours=1))).decode()
+                try:
+                    result = execute_values(
+                        cursor, compact_sql(bounds),
+                        [(b['farm_id'], b['source'], b['hour']) for b in buckets],
+                        template='(%s, %s, %s::TIMESTAMPTZ)', page_size=len(buckets), fetch=True
+                    )[0]
+                    self.conn.commit()
+                except psycopg2.errors.LockNotAvailable:
+                    self.conn.rollback()
+                    self.log("Stopped downsampling current_weather: table busy")
+                    return
+                removed = sum(b['rows'] for b in buckets)
+                self.touched.update(result['relations'])
+                self.stats['rows_downsampled'] += removed
+                self.stats['rows_compacted_into'] += result['compacted']
+                self.stats['batches'] += 1
+
+    def vacuum(self, relations):
+        """VACUUM (ANALYZE) so freed space is reused and the planner sees the new row counts.
+
+        Each statement is limited to the time left before vacuum_deadline; what
+        does not fit is left to autovacuum (or the next run).
+        """
+        autocommit = self.conn.autocommit
+        self.conn.autocommit = True
+        try:
+            with self.conn.cursor() as cursor:
+                try:
+                    # VACUUM only takes a SHARE UPDATE EXCLUSIVE lock, so ingestion keeps writing meanwhile
+                    for relation in sorted(relations):
+                        timeout_ms = 0
+                        if self.vacuum_deadline is not None:
+                            timeout_ms = int((self.vacuum_deadline - time.monotonic()) * 1000)
+                            if timeout_ms <= 0:
+                                self.log(f"Skipped vacuuming {relation}: out of time")
+                                break
+                        cursor.execute(f"SET statement_timeout = {timeout_ms}")
+                        try:
+                            cursor.execute(f"VACUUM (ANALYZE) {relation}")
+                        except psycopg2.errors.QueryCanceled:
+                            self.log(f"Stopped vacuuming {relation}: out of time")
+                            break
+                        self.stats['relations_vacuumed'] += 1
+                finally:
+                    # The connection may be reused by the ingestion run that follows
+                    cursor.execute("RESET statement_timeout")
+        finally:
+            self.conn.autocommit = autocommit
+
+    def run(self, vacuum=True):
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            bytes_before = {table: _relation_bytes(cursor, table) for table in TIME_COLUMNS}
+        self.conn.commit()
+
+        # Whole UTC hours, so downsampling never splits an hour across runs
+        hour = self.now.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        history_cutoff = hour - timedelta(days=self.hourly_days)
+        raw_cutoff = hour - timedelta(days=self.raw_days)
+        forecast_cutoff = self.now - timedelta(days=self.forecast_days)
+
+        try:
+            self.drop_partitions('forecast_weather', forecast_cutoff)
+            self.delete_before('forecast_weather', forecast_cutoff)
+            self.drop_partitions('current_weather', history_cutoff)
+            self.delete_before('current_weather', history_cutoff)
+            if raw_cutoff > history_cutoff:
+                self.downsample_current(history_cutoff, raw_cutoff)
+        finally:
+            # The connection may be reused by the ingestion run that follows
+            with self.conn.cursor() as cursor:
+                cursor.execute("RESET lock_timeout")
+            self.conn.commit()
+        if vacuum and self.touched:
+            self.vacuum(self.touched)
+
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            bytes_after = {table: _relation_bytes(cursor, table) for table in TIME_COLUMNS}
+        self.conn.commit()
+        self.stats['rows_reclaimed'] = (self.stats['rows_deleted']
+                                        + self.stats['rows_downsampled'] - self.stats['rows_compacted_into'])
+        self.stats['bytes_before'] = sum(bytes_before.values())
+        self.stats['bytes_after'] = sum(bytes_after.values())
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply retention and downsampling to the weather tables.')
+    parser.add_argument('--raw-days', type=int, default=7, help='keep every current_weather reading this long')
+    parser.add_argument('--hourly-days', type=int, default=90, help='keep hourly current_weather rows this long')
+    parser.add_argument('--forecast-days', type=int, default=3, help='keep forecasts for times up to this far back')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--max-seconds', type=int, default=600)
+    parser.add_argument('--no-vacuum', action='store_true')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        dbname=os.environ.get('DB_NAME'), user=os.environ.get('DB_USER'), password=os.environ.get('DB_PASSWORD'),
+        host=os.environ.get('DB_HOST'), port=os.environ.get('DB_PORT', '5432')
+    )
+    try:
+        job = RetentionJob(conn, args.raw_days, args.hourly_days, args.forecast_days, args.batch_size, args.max_seconds)
+        stats = job.run(vacuum=not args.no_vacuum)
+        for name, value in stats.items():
+            print(f"{name}: {value}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Daily aggregates per (farm_id, source, day, metric) in weather_daily_rollups.
+
+The ingestion Lambda calls refresh_daily_rollups() inside its write
+transaction for every (farm_id, source, day) it touched, so the rollups
+always match the raw rows, including forecast days overwritten by newer
+fetches. Days are UTC calendar days.
+
+Backfill or repair history from the command line:
+
+    DB_HOST=... DB_NAME=... DB_USER=... DB_PASSWORD=... python rollups.py --since 2025-01-01
+"""
+import os
+import argparse
+from datetime import date, datetime, timedelta, timezone
+import psycopg2
+from psycopg2.extras import execute_values
+
+TIME_COLUMNS = {
+    'current_weather': 'timestamp',
+    'forecast_weather': 'forecast_for'
+}
+ROLLUP_METRICS = {
+    'current_weather': ['temperature_c', 'humidity_percent', 'wind_speed_mps', 'wind_direction_deg',
+                        'rainfall_mm', 'solar_radiation_wm2'],
+    'forecast_weather': ['temperature_c', 'humidity_percent', 'wind_speed_mps', 'wind_direction_deg',
+                         'rainfall_mm', 'chance_of_rain_percent']
+}
+
+
+def _aggregate_sql(table, source_sql, where_sql):
+    """INSERT ... SELECT that recomputes the rollups of every day matched by source_sql/where_sql."""
+    time_column = TIME_COLUMNS[table]
+    metrics = ', '.join(f"('{m}', w.{m}::DOUBLE PRECISION)" for m in ROLLUP_METRICS[table])
+    return f"""
+        INSERT INTO weather_daily_rollups
+            (farm_id, table_name, source, day, metric, avg_value, min_value, max_value, sum_value, count)
+        SELECT w.farm_id, '{table}', w.source, (w.{time_column} AT TIME ZONE 'UTC')::DATE, m.metric,
+               AVG(m.value), MIN(m.value), MAX(m.value), SUM(m.value), COUNT(m.value)
+        FROM {source_sql}
+        CROSS JOIN LATERAL (VALUES {metrics}) AS m(metric, value)
+        WHERE {where_sql}
+        GROUP BY w.farm_id, w.source, (w.{time_column} AT TIME ZONE 'UTC')::DATE, m.metric
+        ON CONFLICT (farm_id, table_name, source, day, metric)
+        DO UPDATE SET
+            avg_value = EXCLUDED.avg_value,
+            min_value = EXCLUDED.min_value,
+            max_value = EXCLUDED.max_value,
+            sum_value = EXCLUDED.sum_value,
+            count = EXCLUDED.count,
+            updated_at = NOW()
+    """
+
+
+def day_keys(rows, table, columns):
+    """(farm_id, source, day) for each row tuple laid out as columns."""
+    time_index = columns.index(TIME_COLUMNS[table])
+    source_index, farm_index = columns.index('source'), columns.index('farm_id')
+    return {
+        (row[farm_index], row[source_index], row[time_index].astimezone(timezone.utc).date())
+        for row in rows
+    }
+
+
+def refresh_daily_rollups(cursor, table, keys):
+    """Recompute the rollups of the given (farm_id, source, day) keys from the raw rows."""
+    keys = sorted(keys)
+    if not keys:
+        return 0
+    time_column = TIME_COLUMNS[table]
+    first_day = min(key[2] for key in keys)
+    last_day = max(key[2] for key in keys) + timedelta(days=1)
+    source_sql = f"(VALUES %s) AS k(farm_id, source, day) JOIN {table} w ON w.farm_id = k.farm_id AND w.source = k.source"
+    # The overall day range is repeated as constants so the planner can prune partitions
+    where_sql = (
+        f"w.{time_column} >= (k.day::TIMESTAMP AT TIME ZONE 'UTC') "
+        f"AND w.{time_column} < ((k.day + 1)::TIMESTAMP AT TIME ZONE 'UTC') "
+        f"AND w.{time_column} >= ('{first_day.isoformat()}'::TIMESTAMP AT TIME ZONE 'UTC') "
+        f"AND w.{time_column} < ('{last_day.isoformat()}'::TIMESTAMP AT TIME ZONE 'UTC')"
+    )
+    execute_values(cursor, _aggregate_sql(table, source_sql, where_sql), keys,
+                   template='(%s, %s, %s::DATE)', page_size=len(keys))
+    return len(keys)
+
+
+def rebuild_daily_rollups(conn, table, since, until, chunk_days=31):
+    """Recompute every rollup of table between since and until (dates), one committed chunk at a time."""
+    time_column = TIME_COLUMNS[table]
+    rebuilt = 0
+    start = since
+    with conn.cursor() as cursor:
+        while start < until:
+            end = min(start + timedelta(days=chunk_days), until)
+            cursor.execute(
+                "DELETE FROM weather_daily_rollups WHERE table_name = %s AND day >= %s AND day < %s",
+                (table, start, end)
+            )
+            bounds = (
+                f"w.{time_column} >= ('{start.isoformat()}'::TIMESTAMP AT TIME ZONE 'UTC') "
+                f"AND w.{time_column} < ('{end.isoformat()}'::TIMESTAMP AT TIME ZONE 'UTC')"
+            )
+            cursor.execute(_aggregate_sql(table, f"{table} w", bounds))
+            rebuilt += cursor.rowcount
+            conn.commit()
+            print(f"Rebuilt {cursor.rowcount} {table} rollups for {start} .. {end - timedelta(days=1)}")
+            start = end
+    return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild weather_daily_rollups from the raw weather tables.')
+    parser.add_argument('--since', type=date.fromisoformat, required=True, help='first day to rebuild (YYYY-MM-DD)')
+    parser.add_argument('--until', type=date.fromisoformat, default=None,
+                        help='last day to rebuild, inclusive (default: the furthest forecast day)')
+    parser.add_argument('--table', choices=sorted(TIME_COLUMNS), action='append',
+                        help='only rebuild this table (repeatable; default: both)')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        dbname=os.environ.get('DB_NAME'), user=os.environ.get('DB_USER'), password=os.environ.get('DB_PASSWORD'),
+        host=os.environ.get('DB_HOST'), port=os.environ.get('DB_PORT', '5432')
+    )
+    try:
+        for table in args.table or sorted(TIME_COLUMNS):
+            until = args.until
+            if until is None:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"SELECT MAX({TIME_COLUMNS[table]}) FROM {table}")
+                    latest = cursor.fetchone()[0]
+                until = (latest or datetime.now(timezone.utc)).astimezone(timezone.utc).date()
+            total = rebuild_daily_rollups(conn, table, args.since, until + timedelta(days=1))
+            print(f"{table}: {total} rollup rows rebuilt")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Lazy forecast rows parsed straight from raw provider bodies.
+
+In streaming mode a fetch keeps only the response bytes and its current
+reading; the forecast is a StreamedForecast that parses the body and
+yields normalized rows each time it is iterated, so the writer pulls rows
+one at a time instead of every farm's parsed document and row list being
+held at once. With ijson installed the body is parsed incrementally and
+only one item is ever in memory; without it the whole document is parsed
+for the duration of one iteration and freed afterwards.
+"""
+import io
+import json
+from datetime import timedelta
+
+try:
+    import ijson
+except ImportError:  # optional; add ijson to the deployment package or a layer for incremental parsing
+    ijson = None
+
+# Forecast rows further ahead than this are dropped in both parse modes, so a streamed write only needs
+# partitions up to timestamp + horizon
+FORECAST_HORIZON = timedelta(days=7)
+
+
+def _walk(node, path):
+    if not path:
+        yield node
+    elif path[0] == 'item':
+        for child in node if isinstance(node, list) else []:
+            yield from _walk(child, path[1:])
+    elif isinstance(node, dict) and path[0] in node:
+        yield from _walk(node[path[0]], path[1:])
+
+
+def items_at(document, prefix):
+    """Objects at an ijson-style prefix of a parsed document ('a.b.item' = each element of the array at a.b)."""
+    return _walk(document, prefix.split('.'))
+
+
+def iter_items(body, prefix):
+    """items_at() for a raw body, parsed incrementally when ijson is available; nothing if the prefix is absent."""
+    if ijson is not None:
+        return ijson.items(io.BytesIO(body), prefix, use_float=True)
+    return items_at(json.loads(body), prefix)
+
+
+def first_item(body, prefix, default=None):
+    return next(iter(iter_items(body, prefix)), default)
+
+
+class StreamedForecast:
+    """Re-iterable forecast rows: normalize(items at prefix of body), limited to FORECAST_HORIZON after now."""
+
+    def __init__(self, body, prefix, normalize, now):
+        self.body = body
+        self.prefix = prefix
+        self.normalize = normalize
+        self.until = now + FORECAST_HORIZON
+
+    def __iter__(self):
+        for forecast in self.normalize(iter_items(self.body, self.prefix)):
+            if forecast['forecast_for'] < self.until:
+                yield forecast
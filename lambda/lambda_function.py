@@ -1,10 +1,35 @@
+import os
 import json
 import boto3
 from botocore.exceptions import ClientError
+import telemetry
+from rule_store import (
+    DecimalEncoder, KEY_SEPARATOR, TABLE_NAME, batch_write, export_lines, iter_rules, query_page, replaced_keys,
+    to_item, with_keys
+)
+from rule_plan import compile_rule
+
+# Rules table keyed on farm_id and rule_key (stakeholder#priority#rule_id), see rule_store.py
+RULES_TABLE = os.environ.get('RULES_TABLE', TABLE_NAME)
 
 # Initialize DynamoDB client
 dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('WeatherRules')
+table = dynamodb.Table(RULES_TABLE)
+
+# Largest JSON array accepted by one bulk POST
+BULK_MAX_RULES = int(os.environ.get('BULK_MAX_RULES', '1000'))
+# Page size for GET requests with a limit or cursor, and its upper bound
+PAGE_DEFAULT = int(os.environ.get('PAGE_DEFAULT', '100'))
+PAGE_MAX = int(os.environ.get('PAGE_MAX', '1000'))
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+}
+
+# Leveled logs (LOG_LEVEL) and per-invocation EMF metrics, see telemetry.py
+telemetry.configure(service='RuleApi')
 
 def validate_rule(rule):
     """Validate the rule object for required fields and structure."""
@@ -17,6 +42,11 @@ def validate_rule(rule):
         if field not in rule:
             return False, f"Missing required field: {field}"
     
+    # farm_id and stakeholder are joined into the table's sort keys
+    for field in ['farm_id', 'stakeholder']:
+        if not isinstance(rule[field], str) or not rule[field] or KEY_SEPARATOR in rule[field]:
+            return False, f"{field} must be a non-empty string without '{KEY_SEPARATOR}'."
+
     # Validate data_type
     if rule['data_type'] not in ['forecast', 'current']:
         return False, f"Invalid data_type: {rule['data_type']}. Must be 'forecast' or 'current'."
@@ -79,8 +109,59 @@ def validate_rule(rule):
 
     return True, None
 
-def lambda_handler(event, context):
-    print(f"Event received: {json.dumps(event)}")  # Log the event for debugging
+def with_plan(rule):
+    """The rule as stored: its key attributes and compiled plan attached (see rule_plan.py), or no plan if it cannot be compiled."""
+    rule = {k: v for k, v in rule.items() if k != 'plan'}
+    try:
+        rule['plan'] = compile_rule(rule)
+    except ValueError as e:
+        telemetry.warning("Rule %s saved without a plan, the engine will use its conditions: %s", rule.get('rule_id'), e)
+        telemetry.count('rules_without_plan')
+    return to_item(with_keys(rule))
+
+def put_rule(rule):
+    """Write one validated rule, then delete its old item if a new priority moved it to another key."""
+    item = with_plan(rule)
+    with telemetry.span('dynamodb_put'):
+        stale = replaced_keys(table, [item])
+        table.put_item(Item=item)
+        for key in stale:
+            table.delete_item(Key=key)
+    telemetry.count('rules_saved')
+    telemetry.count('rules_rekeyed', len(stale))
+
+def save_rules(rules):
+    """Validate a whole array of rules, then write them with BatchWriteItem; nothing is written if any is invalid."""
+    if len(rules) > BULK_MAX_RULES:
+        return {'statusCode': 400,
+                'body': json.dumps({'error': f"At most {BULK_MAX_RULES} rules per request, got {len(rules)}"})}
+    errors = []
+    for index, rule in enumerate(rules):
+        is_valid, error = validate_rule(rule) if isinstance(rule, dict) else (False, "Rule must be an object")
+        if not is_valid:
+            errors.append({'index': index, 'error': error})
+    if errors:
+        telemetry.count('rules_rejected', len(errors))
+        return {'statusCode': 400, 'body': json.dumps({'error': 'Invalid rules', 'invalid': errors})}
+
+    items = [with_plan(rule) for rule in rules]
+    with telemetry.span('dynamodb_batch_write'):
+        stats = batch_write(dynamodb, items, table.name, deletes=replaced_keys(table, items))
+    telemetry.count('rules_saved', stats['written'])
+    telemetry.count('rules_rekeyed', stats['deleted'])
+    telemetry.count('batch_write_retries', stats['retries'])
+    telemetry.count('batch_write_throttled', stats['throttled'])
+    telemetry.info("Bulk save: %d rule(s) written and %d old key(s) deleted in %d request(s), %d retries, %d unprocessed",
+                   stats['written'], stats['deleted'], stats['requests'], stats['retries'], len(stats['unprocessed']))
+    if stats['unprocessed']:
+        # Throttled past every retry; the caller can resend just these keys
+        return {'statusCode': 503,
+                'body': json.dumps({'error': 'Some rules were not written', 'written': stats['written'],
+                                    'unprocessed': stats['unprocessed']}, cls=DecimalEncoder)}
+    return {'statusCode': 200, 'body': json.dumps({'message': 'Rules saved', 'written': stats['written']})}
+
+def handle_event(event):
+    telemetry.debug("Event received: %s", lambda: json.dumps(event))
 
     # Check if event is from API Gateway (has httpMethod)
     if 'httpMethod' in event:
@@ -90,7 +171,8 @@ def lambda_handler(event, context):
                 query_params = event.get('queryStringParameters', {}) or {}
                 farm_id = query_params.get('farm_id')
                 stakeholder = query_params.get('stakeholder')
-                if not farm_id or not stakeholder:
+                data_type = query_params.get('data_type')
+                if not farm_id:
                     return {
                         'statusCode': 400,
                         'body': json.dumps({'error': 'Missing farm_id or stakeholder query parameters'}),
@@ -100,18 +182,51 @@ def lambda_handler(event, context):
                             'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
                         }
                     }
-                response = table.query(
-                    IndexName='StakeholderIndex',
-                    KeyConditionExpression='farm_id = :fid AND stakeholder = :stake',
-                    ExpressionAttributeValues={
-                        ':fid': farm_id,
-                        ':stake': stakeholder
+                fields = [f.strip() for f in (query_params.get('fields') or '').split(',') if f.strip()]
+                if query_params.get('format') == 'ndjson':
+                    # Export: every rule for the farm (and stakeholder, if given), one JSON object per line
+                    with telemetry.span('dynamodb_query'):
+                        lines = list(export_lines(table, farm_id, stakeholder, fields, data_type))
+                    telemetry.count('rules_returned', len(lines))
+                    return {
+                        'statusCode': 200,
+                        'body': ''.join(lines),
+                        'headers': {**CORS_HEADERS, 'Content-Type': 'application/x-ndjson'}
+                    }
+                if not stakeholder and not data_type:
+                    return {
+                        'statusCode': 400,
+                        'body': json.dumps({'error': 'Missing stakeholder or data_type query parameter'}),
+                        'headers': CORS_HEADERS
                     }
-                )
-                print(f"GET response: {response['Items']}")
+                if 'limit' in query_params or 'cursor' in query_params:
+                    try:
+                        limit = min(int(query_params.get('limit') or PAGE_DEFAULT), PAGE_MAX)
+                        if limit < 1:
+                            raise ValueError("limit must be positive")
+                        with telemetry.span('dynamodb_query'):
+                            items, next_cursor = query_page(table, farm_id, stakeholder, limit,
+                                                            query_params.get('cursor'), fields, data_type)
+                    except ValueError as e:
+                        return {
+                            'statusCode': 400,
+                            'body': json.dumps({'error': str(e)}),
+                            'headers': CORS_HEADERS
+                        }
+                    telemetry.count('rules_returned', len(items))
+                    return {
+                        'statusCode': 200,
+                        'body': json.dumps({'items': items, 'next_cursor': next_cursor}, cls=DecimalEncoder),
+                        'headers': CORS_HEADERS
+                    }
+                # No paging parameters: every page, returned as one list
+                with telemetry.span('dynamodb_query'):
+                    items = list(iter_rules(table, farm_id, stakeholder, fields, data_type=data_type))
+                telemetry.count('rules_returned', len(items))
+                telemetry.debug("GET response: %s", items)
                 return {
                     'statusCode': 200,
-                    'body': json.dumps(response['Items']),
+                    'body': json.dumps(items, cls=DecimalEncoder),
                     'headers': {
                         'Access-Control-Allow-Origin': '*',
                         'Access-Control-Allow-Headers': 'Content-Type',
@@ -119,7 +234,7 @@ def lambda_handler(event, context):
                     }
                 }
             except ClientError as e:
-                print(f"Error in GET: {str(e)}")
+                telemetry.error("Error in GET: %s", e)
                 return {
                     'statusCode': 500,
                     'body': json.dumps({'error': str(e)}),
@@ -132,11 +247,14 @@ def lambda_handler(event, context):
         elif http_method == 'POST':
             try:
                 body = json.loads(event['body'])
-                print(f"POST body: {json.dumps(body)}")
+                telemetry.debug("POST body: %s", lambda: json.dumps(body))
+                if isinstance(body, list):
+                    return {**save_rules(body), 'headers': CORS_HEADERS}
                 
                 # Validate rule
                 is_valid, error = validate_rule(body)
                 if not is_valid:
+                    telemetry.count('rules_rejected')
                     return {
                         'statusCode': 400,
                         'body': json.dumps({'error': f"Invalid rule: {error}"}),
@@ -147,8 +265,8 @@ def lambda_handler(event, context):
                         }
                     }
                 
-                table.put_item(Item=body)
-                print("Successfully saved to DynamoDB")
+                put_rule(body)
+                telemetry.info("Successfully saved to DynamoDB")
                 return {
                     'statusCode': 200,
                     'body': json.dumps({'message': 'Rule saved'}),
@@ -159,7 +277,7 @@ def lambda_handler(event, context):
                     }
                 }
             except ClientError as e:
-                print(f"Error in POST: {str(e)}")
+                telemetry.error("Error in POST: %s", e)
                 return {
                     'statusCode': 500,
                     'body': json.dumps({'error': str(e)}),
@@ -190,28 +308,38 @@ def lambda_handler(event, context):
             }
     else:
         # Handle direct invocation (e.g., for testing via AWS CLI)
-        print("Direct invocation detected")
+        telemetry.info("Direct invocation detected")
         try:
             rule = event
-            print(f"Direct invocation body: {json.dumps(rule)}")
+            telemetry.debug("Direct invocation body: %s", lambda: json.dumps(rule))
+            if isinstance(rule, list):
+                return save_rules(rule)
             
             # Validate rule
             is_valid, error = validate_rule(rule)
             if not is_valid:
+                telemetry.count('rules_rejected')
                 return {
                     'statusCode': 400,
                     'body': json.dumps({'error': f"Invalid rule: {error}"})
                 }
             
-            table.put_item(Item=rule)
-            print("Successfully saved to DynamoDB (direct)")
+            put_rule(rule)
+            telemetry.info("Successfully saved to DynamoDB (direct)")
             return {
                 'statusCode': 200,
                 'body': json.dumps({'message': 'Rule saved (direct invocation)'})
             }
         except ClientError as e:
-            print(f"Error in direct invocation: {str(e)}")
+            telemetry.error("Error in direct invocation: %s", e)
             return {
                 'statusCode': 500,
                 'body': json.dumps({'error': str(e)})
-            }
\ No newline at end of file
+            }
+
+def lambda_handler(event, context):
+    try:
+        with telemetry.span('invocation'):
+            return handle_event(event)
+    finally:
+        telemetry.flush()
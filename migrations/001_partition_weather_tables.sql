@@ -0,0 +1,113 @@
+-- Migration 001: convert current_weather and forecast_weather to monthly range partitions.
+--
+-- Moves existing rows into partitions covering their full time range (plus
+-- next month), replaces the separate farm_id / time B-tree indexes with
+-- (farm_id, time DESC) composites and BRIN indexes on the time column, and
+-- installs ensure_monthly_partition(), which the ingestion Lambda calls before
+-- writing. Runs in one transaction; pause the ingestion schedule while it runs,
+-- since the tables are locked for the duration of the copy.
+--
+--   psql -h <rds-endpoint> -U postgres -d <db> -v ON_ERROR_STOP=1 -f migrations/001_partition_weather_tables.sql
+
+BEGIN;
+
+-- Create the month partition of parent that holds ts, if it does not exist yet.
+-- Partitions are named <parent>_yYYYYmMM and inherit the parent's indexes.
+CREATE OR REPLACE FUNCTION ensure_monthly_partition(parent TEXT, ts TIMESTAMPTZ)
+RETURNS TEXT AS $$
+DECLARE
+    month_start TIMESTAMPTZ := date_trunc('month', ts AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    partition TEXT := parent || '_y' || to_char(month_start AT TIME ZONE 'UTC', 'YYYY"m"MM');
+BEGIN
+    IF to_regclass(quote_ident(partition)) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            partition, parent, month_start, month_start + INTERVAL '1 month'
+        );
+    END IF;
+    RETURN partition;
+END;
+$$ LANGUAGE plpgsql;
+
+-- --- current_weather ---
+ALTER TABLE current_weather RENAME TO current_weather_legacy;
+ALTER TABLE current_weather_legacy DROP CONSTRAINT current_weather_unique;
+ALTER TABLE current_weather_legacy DROP CONSTRAINT current_weather_pkey;
+DROP INDEX idx_current_weather_farm, idx_current_weather_time, idx_current_weather_location, idx_current_source_time;
+
+CREATE TABLE current_weather (
+    LIKE current_weather_legacy INCLUDING DEFAULTS,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+-- Keep handing out ids from the existing sequence
+ALTER SEQUENCE current_weather_id_seq OWNED BY current_weather.id;
+
+SELECT ensure_monthly_partition('current_weather', month)
+FROM generate_series(
+    date_trunc('month', COALESCE((SELECT MIN(timestamp) FROM current_weather_legacy), NOW()) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+    GREATEST((SELECT MAX(timestamp) FROM current_weather_legacy), NOW() + INTERVAL '1 month'),
+    INTERVAL '1 month'
+) AS month;
+
+INSERT INTO current_weather (id, source, farm_id, location, timestamp, temperature_c, humidity_percent, wind_speed_mps,
+       wind_direction_deg, rainfall_mm, solar_radiation_wm2)
+SELECT id, source, farm_id, location, timestamp, temperature_c, humidity_percent, wind_speed_mps,
+       wind_direction_deg, rainfall_mm, solar_radiation_wm2
+FROM current_weather_legacy;
+
+DROP TABLE current_weather_legacy;
+
+-- --- forecast_weather ---
+ALTER TABLE forecast_weather RENAME TO forecast_weather_legacy;
+ALTER TABLE forecast_weather_legacy DROP CONSTRAINT forecast_weather_unique;
+ALTER TABLE forecast_weather_legacy DROP CONSTRAINT forecast_weather_pkey;
+DROP INDEX idx_forecast_weather_farm, idx_forecast_weather_time, idx_forecast_weather_location, idx_forecast_source_time;
+
+CREATE TABLE forecast_weather (
+    LIKE forecast_weather_legacy INCLUDING DEFAULTS,
+    PRIMARY KEY (id, forecast_for)
+) PARTITION BY RANGE (forecast_for);
+-- Keep handing out ids from the existing sequence
+ALTER SEQUENCE forecast_weather_id_seq OWNED BY forecast_weather.id;
+
+SELECT ensure_monthly_partition('forecast_weather', month)
+FROM generate_series(
+    date_trunc('month', COALESCE((SELECT MIN(forecast_for) FROM forecast_weather_legacy), NOW()) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+    GREATEST((SELECT MAX(forecast_for) FROM forecast_weather_legacy), NOW() + INTERVAL '1 month'),
+    INTERVAL '1 month'
+) AS month;
+
+INSERT INTO forecast_weather (id, source, farm_id, forecast_for, fetched_at, location, temperature_c, humidity_percent,
+       wind_speed_mps, wind_direction_deg, rainfall_mm, chance_of_rain_percent)
+SELECT id, source, farm_id, forecast_for, fetched_at, location, temperature_c, humidity_percent,
+       wind_speed_mps, wind_direction_deg, rainfall_mm, chance_of_rain_percent
+FROM forecast_weather_legacy;
+
+DROP TABLE forecast_weather_legacy;
+
+-- Create indexes for current_weather (created on every partition)
+-- (farm_id, time DESC) serves the rules engine's farm + time-range lookups in index order
+CREATE INDEX idx_current_weather_farm_time ON current_weather (farm_id, timestamp DESC);
+CREATE INDEX idx_current_weather_time_brin ON current_weather USING BRIN (timestamp);
+CREATE INDEX idx_current_weather_location ON current_weather USING GIST (location);
+CREATE INDEX idx_current_source_time ON current_weather (source, timestamp);
+
+-- Create indexes for forecast_weather (created on every partition)
+CREATE INDEX idx_forecast_weather_farm_time ON forecast_weather (farm_id, forecast_for DESC);
+CREATE INDEX idx_forecast_weather_time_brin ON forecast_weather USING BRIN (forecast_for);
+CREATE INDEX idx_forecast_weather_location ON forecast_weather USING GIST (location);
+CREATE INDEX idx_forecast_source_time ON forecast_weather (source, fetched_at);
+
+-- Add unique constraints
+ALTER TABLE current_weather
+ADD CONSTRAINT current_weather_unique
+UNIQUE (farm_id, source, timestamp);
+
+ALTER TABLE forecast_weather
+ADD CONSTRAINT forecast_weather_unique
+UNIQUE (farm_id, source, forecast_for);
+
+ANALYZE current_weather;
+ANALYZE forecast_weather;
+
+COMMIT;
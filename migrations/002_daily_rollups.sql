@@ -0,0 +1,21 @@
+-- Migration 002: daily rollup table read by the rules engine's DAY_DIFF> operator.
+--
+-- After creating the table, backfill it from the raw rows with
+--   python lambda/Lambda_ingestion/src/rollups.py --since <first day with data>
+-- The ingestion Lambda keeps it up to date from then on.
+
+CREATE TABLE IF NOT EXISTS weather_daily_rollups (
+    farm_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    day DATE NOT NULL,
+    metric TEXT NOT NULL,
+    avg_value DOUBLE PRECISION,
+    min_value DOUBLE PRECISION,
+    max_value DOUBLE PRECISION,
+    sum_value DOUBLE PRECISION,
+    count INTEGER NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (farm_id, table_name, source, day, metric)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_rollups_lookup ON weather_daily_rollups (table_name, farm_id, day, metric);
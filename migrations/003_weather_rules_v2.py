@@ -0,0 +1,89 @@
+"""Migration 003: copy WeatherRules into WeatherRulesV2, which holds many rules per farm and stakeholder.
+
+WeatherRules is keyed on (farm_id, stakeholder), so a second rule for the
+same farm and stakeholder overwrote the first. WeatherRulesV2 (see dynamo_db)
+is keyed on farm_id and rule_key, "stakeholder#priority#rule_id", and has
+DataTypeIndex for listing rules by data_type; see rule_store.py. DynamoDB
+cannot change the keys of a table, so the rules are copied: the target table
+is created from dynamo_db unless it exists, then the source table is scanned
+a page at a time and every item is written with rule_key and type_key added
+and its other attributes, plan included, unchanged. Items whose keys cannot
+be built (missing rule_id or priority, '#' in farm_id or stakeholder) are
+listed and skipped.
+
+Re-running is safe, items land on the same keys. Pause rule API writes while
+it runs (or run it again afterwards), then set RULES_TABLE on the rule API
+and the rules engine to the new table and move the engine's stream trigger
+to the new table's stream. Delete the old table once both run from the new one.
+
+    python migrations/003_weather_rules_v2.py [--source WeatherRules] [--target WeatherRulesV2] [--dry-run]
+"""
+import os
+import sys
+import json
+import argparse
+
+import boto3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'Dynamo_Rule_Define'))
+from rule_store import KEY_SEPARATOR, batch_write, iter_rules, with_keys  # noqa: E402
+
+TABLE_DEFINITION = os.path.join(ROOT, 'dynamo_db')
+
+
+def create_table(client, name):
+    """Create the target table from dynamo_db unless it exists, and wait until it is active."""
+    try:
+        client.describe_table(TableName=name)
+        return False
+    except client.exceptions.ResourceNotFoundException:
+        pass
+    with open(TABLE_DEFINITION) as f:
+        definition = json.load(f)
+    definition['TableName'] = name
+    client.create_table(**definition)
+    client.get_waiter('table_exists').wait(TableName=name)
+    return True
+
+
+def keyed_items(items, skipped):
+    """items with their new key attributes; items that cannot be keyed are appended to skipped instead."""
+    for item in items:
+        try:
+            if any(KEY_SEPARATOR in item[field] for field in ('farm_id', 'stakeholder')):
+                raise ValueError(f"'{KEY_SEPARATOR}' in farm_id or stakeholder")
+            yield with_keys(item)
+        except (KeyError, TypeError, ValueError) as e:
+            skipped.append({'farm_id': item.get('farm_id'), 'stakeholder': item.get('stakeholder'), 'error': repr(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copy WeatherRules into the farm_id/rule_key table layout.')
+    parser.add_argument('--source', default='WeatherRules')
+    parser.add_argument('--target', default='WeatherRulesV2')
+    parser.add_argument('--page-size', type=int, default=500, help='items per scan page of the source table')
+    parser.add_argument('--dry-run', action='store_true', help='scan and key the items without writing')
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb')
+    skipped = []
+    items = keyed_items(iter_rules(dynamodb.Table(args.source), page_size=args.page_size), skipped)
+    if args.dry_run:
+        print(f"{sum(1 for _ in items)} rule(s) would be copied from {args.source} to {args.target}")
+    else:
+        if create_table(dynamodb.meta.client, args.target):
+            print(f"Created {args.target}")
+        stats = batch_write(dynamodb, items, args.target)
+        print(f"Copied {stats['written']} rule(s) from {args.source} to {args.target} in {stats['requests']} "
+              f"request(s), {stats['retries']} retries")
+        for key in stats['unprocessed']:
+            print(f"not written: {key}")
+    for item in skipped:
+        print(f"skipped: {item}")
+    if skipped or (not args.dry_run and stats['unprocessed']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
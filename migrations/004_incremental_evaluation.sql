@@ -0,0 +1,35 @@
+-- Migration 004: tables behind the rules engine's incremental evaluation (INCREMENTAL_EVAL).
+--
+-- ingestion_watermarks is advanced by the ingestion Lambda in the same transaction as its
+-- rows; rule_evaluations holds each rule's last outcome. Until both exist the engine
+-- evaluates every rule. Safe to re-run.
+--
+--   psql -h <rds-endpoint> -U postgres -d <db> -v ON_ERROR_STOP=1 -f migrations/004_incremental_evaluation.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ingestion_watermarks (
+    farm_id TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    watermark TIMESTAMPTZ NOT NULL,
+    revision BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (farm_id, table_name)
+);
+
+CREATE TABLE IF NOT EXISTS rule_evaluations (
+    rule_id TEXT NOT NULL,
+    farm_id TEXT NOT NULL,
+    stakeholder TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    watermark TIMESTAMPTZ NOT NULL,
+    revision BIGINT NOT NULL,
+    result BOOLEAN NOT NULL,
+    metrics TEXT[] NOT NULL,
+    evaluated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    valid_until TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (rule_id, farm_id, stakeholder)
+);
+CREATE INDEX IF NOT EXISTS idx_rule_evaluations_farm ON rule_evaluations (farm_id);
+
+COMMIT;
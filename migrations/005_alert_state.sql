@@ -0,0 +1,26 @@
+-- Migration 005: alert lifecycle table read and written by the rules engine (ALERT_STATE).
+--
+-- Without it the engine notifies on every matching run, with no debounce, cooldown or
+-- escalation. Safe to re-run.
+--
+--   psql -h <rds-endpoint> -U postgres -d <db> -v ON_ERROR_STOP=1 -f migrations/005_alert_state.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS alert_state (
+    rule_id TEXT NOT NULL,
+    farm_id TEXT NOT NULL,
+    stakeholder TEXT NOT NULL,
+    active BOOLEAN NOT NULL,
+    first_fired_at TIMESTAMPTZ NOT NULL,
+    last_fired_at TIMESTAMPTZ NOT NULL,
+    last_notified_at TIMESTAMPTZ,
+    consecutive INTEGER NOT NULL DEFAULT 0,
+    fingerprint TEXT,
+    severity DOUBLE PRECISION,
+    notify_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (rule_id, farm_id, stakeholder)
+);
+CREATE INDEX IF NOT EXISTS idx_alert_state_farm ON alert_state (farm_id);
+
+COMMIT;